@@ -2,7 +2,12 @@ package main
 
 import (
 	"log"
+	"os"
+	"path/filepath"
+	"strconv"
+	"time"
 	"websocket-git/internal/handlers"
+	"websocket-git/internal/metrics"
 	"websocket-git/internal/services"
 
 	"github.com/gin-gonic/gin"
@@ -12,19 +17,112 @@ func main() {
 	// Set Gin to debug mode
 	gin.SetMode(gin.DebugMode)
 
+	schedulerOn := os.Getenv("SCHEDULER") != "0"
+	maxRunning := envInt("SCHEDULER_MAX_RUNNING", 8)
+
+	// Start the long-lived runner workers (RUNNER_WORKERS=0 forks per request).
+	// A test run holds its worker throughout, so there is one per run the
+	// scheduler admits; namespace, scaling and maintenance calls get their own
+	// small pool so they never wait behind test runs.
+	var pool, controlPool *services.WorkerPool
+	if size := envInt("RUNNER_WORKERS", maxRunning); size > 0 {
+		if schedulerOn && size < maxRunning {
+			size = maxRunning
+		}
+		pool = services.NewWorkerPool(size)
+		defer pool.Close()
+		controlPool = services.NewWorkerPool(envInt("RUNNER_CONTROL_WORKERS", 2))
+		controlPool.Name = "control_pool"
+		defer controlPool.Close()
+	}
+
+	// Cancelled runners get this long to stop their pod command and report
+	services.CancelGrace = time.Duration(envInt("CANCEL_GRACE", 15)) * time.Second
+
 	// Initialize services
-	nsService := services.NewNamespaceService()
-	testService := services.NewTestService()
+	nsService := services.NewNamespaceService(controlPool)
+	testService := services.NewTestService(pool)
+	if os.Getenv("RESULT_CACHE") != "0" {
+		testService.Cache = services.NewResultCache(
+			envString("RESULT_CACHE_DIR", filepath.Join("state", "results")),
+			time.Duration(envInt("RESULT_CACHE_TTL", 86400))*time.Second,
+			envInt("RESULT_CACHE_MAX_ENTRIES", 1000),
+			int64(envInt("RESULT_CACHE_DISK_MAX_MB", 512))<<20,
+		)
+	}
+
+	// Admit at most SCHEDULER_MAX_RUNNING runs at once, queued fairly per
+	// user (SCHEDULER=0 runs every request immediately)
+	if schedulerOn {
+		scheduler := services.NewScheduler(maxRunning)
+		scheduler.MaxQueuedPerUser = envInt("SCHEDULER_MAX_QUEUED_PER_USER", 20)
+		scheduler.MaxQueued = envInt("SCHEDULER_MAX_QUEUED", 200)
+		limits, err := services.ParseLimits(os.Getenv("SCHEDULER_PROJECT_LIMITS"))
+		if err != nil {
+			log.Fatalf("SCHEDULER_PROJECT_LIMITS: %v", err)
+		}
+		scheduler.ProjectLimits = limits
+		testService.Scheduler = scheduler
+	}
+
+	// Track namespaces and test pods through kubectl watches so repeat
+	// messages skip namespace_handler.py (NAMESPACE_CACHE=0 disables it)
+	if os.Getenv("NAMESPACE_CACHE") != "0" {
+		nsService.Cache = services.NewNamespaceCache(time.Duration(envInt("NAMESPACE_CACHE_TTL", 300)) * time.Second)
+		nsService.Cache.Start()
+	}
+
+	// Keep WARM_POOL_SIZE ready namespaces per template in the background
+	if os.Getenv("WARM_POOL_SIZE") != "" {
+		nsService.MaintainWarmPool(time.Duration(envInt("WARM_POOL_INTERVAL", 30)) * time.Second)
+	}
+
+	// Scale idle chat namespaces to zero and delete long-idle ones
+	// (opt-in with NAMESPACE_REAPER=1)
+	if os.Getenv("NAMESPACE_REAPER") == "1" {
+		nsService.MaintainNamespaces(time.Duration(envInt("NAMESPACE_REAP_INTERVAL", 60)) * time.Second)
+	}
 
 	// Initialize handlers
 	wsHandler := handlers.NewWebSocketHandler(nsService, testService)
+	wsHandler.BatchMaxPods = envInt("BATCH_MAX_PODS", wsHandler.BatchMaxPods)
 
 	// Setup router with default middleware (Logger and Recovery)
 	r := gin.Default()
 	r.GET("/ws", wsHandler.HandleConnection)
 
+	// Full test logs spilled by the runner, by run ID
+	artifactDir := envString("ARTIFACT_DIR", filepath.Join(envString("IM_STATE_DIR", "state"), "artifacts"))
+	artifactHandler := handlers.NewArtifactHandler(services.NewArtifactStore(artifactDir))
+	r.GET("/artifacts/:runID/:stream", artifactHandler.GetArtifact)
+
+	// Label runs by deployment template; unknown project types become "other"
+	templates, _ := filepath.Glob(filepath.Join("deployments", "templates", "*", "test-pod.yaml"))
+	var projectTypes []string
+	for _, template := range templates {
+		projectTypes = append(projectTypes, filepath.Base(filepath.Dir(template)))
+	}
+	metrics.SetProjectTypes(projectTypes)
+
+	// Prometheus metrics: phase histograms, failures, in-flight runs, queues
+	r.GET("/metrics", gin.WrapH(metrics.Handler()))
+
 	log.Printf("WebSocket server starting on :8080")
 	if err := r.Run(":8080"); err != nil {
 		log.Fatal("ListenAndServe: ", err)
 	}
 }
+
+func envInt(name string, fallback int) int {
+	if value, err := strconv.Atoi(os.Getenv(name)); err == nil {
+		return value
+	}
+	return fallback
+}
+
+func envString(name, fallback string) string {
+	if value := os.Getenv(name); value != "" {
+		return value
+	}
+	return fallback
+}
@@ -0,0 +1,56 @@
+package handlers
+
+import (
+    "compress/gzip"
+    "io"
+    "log"
+    "net/http"
+    "os"
+    "strings"
+    "github.com/gin-gonic/gin"
+    "websocket-git/internal/services"
+)
+
+type ArtifactHandler struct {
+    store *services.ArtifactStore
+}
+
+func NewArtifactHandler(store *services.ArtifactStore) *ArtifactHandler {
+    return &ArtifactHandler{store: store}
+}
+
+// GetArtifact streams the full log of one run's stdout or stderr. Clients
+// that accept gzip get the stored file as is; others get it decompressed on
+// the fly, so memory use does not depend on the log size.
+func (h *ArtifactHandler) GetArtifact(c *gin.Context) {
+    file, err := h.store.Open(c.Param("runID"), c.Param("stream"))
+    if err != nil {
+        status := http.StatusNotFound
+        if !os.IsNotExist(err) {
+            status = http.StatusBadRequest
+        }
+        c.JSON(status, gin.H{"message": err.Error()})
+        return
+    }
+    defer file.Close()
+
+    c.Header("Content-Type", "text/plain; charset=utf-8")
+    if strings.Contains(c.Request.Header.Get("Accept-Encoding"), "gzip") {
+        c.Header("Content-Encoding", "gzip")
+        c.Status(http.StatusOK)
+        if _, err := io.Copy(c.Writer, file); err != nil {
+            log.Printf("Error sending artifact: %v", err)
+        }
+        return
+    }
+
+    reader, err := gzip.NewReader(file)
+    if err != nil {
+        c.JSON(http.StatusInternalServerError, gin.H{"message": "corrupt artifact"})
+        return
+    }
+    c.Status(http.StatusOK)
+    if _, err := io.Copy(c.Writer, reader); err != nil {
+        log.Printf("Error sending artifact: %v", err)
+    }
+}
@@ -0,0 +1,113 @@
+package handlers
+
+import (
+    "context"
+    "errors"
+    "fmt"
+    "log"
+    "sync"
+    "websocket-git/internal/models"
+    "websocket-git/internal/services"
+)
+
+// maxPendingMessages bounds the messages one connection may have waiting
+// behind its current run
+const maxPendingMessages = 32
+
+var (
+    errCancelled    = errors.New("cancelled by client")
+    errDisconnected = errors.New("client disconnected")
+)
+
+// activeRun is a message that is queued or running on a connection. Its ctx
+// is cancelled by a cancel message, by a newer coalescing commit for the
+// same chat, or when the connection closes.
+type activeRun struct {
+    msg    models.GitMessage
+    runID  string
+    conn   *safeConn
+    ctx    context.Context
+    cancel context.CancelCauseFunc
+}
+
+// runRegistry tracks active runs per chat across connections.
+type runRegistry struct {
+    mu     sync.Mutex
+    byChat map[string][]*activeRun
+}
+
+func newRunRegistry() *runRegistry {
+    return &runRegistry{byChat: make(map[string][]*activeRun)}
+}
+
+// add registers msg as a run of its chat. A coalescing single-commit
+// message supersedes the chat's older single-commit runs; batches and
+// bisects are never superseded.
+func (r *runRegistry) add(parent context.Context, conn *safeConn, msg models.GitMessage) *activeRun {
+    ctx, cancel := context.WithCancelCause(parent)
+    run := &activeRun{msg: msg, runID: services.NewRunID(), conn: conn, ctx: ctx, cancel: cancel}
+
+    r.mu.Lock()
+    defer r.mu.Unlock()
+    if msg.Coalesce && singleCommit(msg) {
+        superseded := fmt.Errorf("superseded by commit %s", msg.CommitHash)
+        for _, older := range r.byChat[msg.ChatID] {
+            if singleCommit(older.msg) && older.ctx.Err() == nil {
+                log.Printf("Run %s (%s) superseded by %s", older.runID, older.msg.CommitHash, msg.CommitHash)
+                older.cancel(superseded)
+            }
+        }
+    }
+    r.byChat[msg.ChatID] = append(r.byChat[msg.ChatID], run)
+    return run
+}
+
+func singleCommit(msg models.GitMessage) bool {
+    return msg.Type != "batch" && msg.Type != "bisect"
+}
+
+// remove forgets a finished run.
+func (r *runRegistry) remove(run *activeRun) {
+    run.cancel(nil)
+    r.mu.Lock()
+    defer r.mu.Unlock()
+    runs := r.byChat[run.msg.ChatID]
+    for i, active := range runs {
+        if active == run {
+            runs = append(runs[:i], runs[i+1:]...)
+            break
+        }
+    }
+    if len(runs) == 0 {
+        delete(r.byChat, run.msg.ChatID)
+    } else {
+        r.byChat[run.msg.ChatID] = runs
+    }
+}
+
+// cancel stops the runs a cancel message names: those of its chat (or of
+// conn, when it names no chat), narrowed to one run ID or commit if given.
+// Runs started on another connection are only stopped for their own user.
+// It returns the number of runs cancelled.
+func (r *runRegistry) cancel(conn *safeConn, msg models.GitMessage, cause error) int {
+    r.mu.Lock()
+    defer r.mu.Unlock()
+    cancelled := 0
+    for chatID, runs := range r.byChat {
+        for _, run := range runs {
+            switch {
+            case msg.ChatID != "" && chatID != msg.ChatID:
+            case msg.ChatID == "" && run.conn != conn:
+            case run.conn != conn && (msg.UserID == "" || run.msg.UserID != msg.UserID):
+            case msg.RunID != "" && run.runID != msg.RunID:
+            case msg.CommitHash != "" && run.msg.CommitHash != msg.CommitHash:
+            case run.ctx.Err() != nil:
+            default:
+                log.Printf("Run %s (%s) cancelled by client", run.runID, run.msg.CommitHash)
+                run.cancel(cause)
+                cancelled++
+            }
+        }
+    }
+    return cancelled
+}
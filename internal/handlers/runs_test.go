@@ -0,0 +1,117 @@
+package handlers
+
+import (
+    "context"
+    "errors"
+    "testing"
+    "websocket-git/internal/models"
+)
+
+func commitMsg(chat, user, commit string) models.GitMessage {
+    return models.GitMessage{ChatID: chat, UserID: user, CommitHash: commit}
+}
+
+func stopped(run *activeRun) bool {
+    return run.ctx.Err() != nil
+}
+
+func TestCancelStopsTheChatsRuns(t *testing.T) {
+    r := newRunRegistry()
+    conn := &safeConn{}
+    first := r.add(context.Background(), conn, commitMsg("chat", "alice", "aaa"))
+    second := r.add(context.Background(), conn, commitMsg("chat", "alice", "bbb"))
+    other := r.add(context.Background(), conn, commitMsg("other", "alice", "ccc"))
+
+    if n := r.cancel(conn, models.GitMessage{ChatID: "chat"}, errCancelled); n != 2 {
+        t.Fatalf("cancelled %d runs, want 2", n)
+    }
+    if !stopped(first) || !stopped(second) || stopped(other) {
+        t.Error("cancel did not stop exactly the chat's runs")
+    }
+    if !errors.Is(context.Cause(first.ctx), errCancelled) {
+        t.Errorf("cause = %v, want %v", context.Cause(first.ctx), errCancelled)
+    }
+    // Runs already stopped are not counted again
+    if n := r.cancel(conn, models.GitMessage{ChatID: "chat"}, errCancelled); n != 0 {
+        t.Errorf("second cancel stopped %d runs", n)
+    }
+}
+
+func TestCancelNarrowsToRunOrCommit(t *testing.T) {
+    r := newRunRegistry()
+    conn := &safeConn{}
+    first := r.add(context.Background(), conn, commitMsg("chat", "alice", "aaa"))
+    second := r.add(context.Background(), conn, commitMsg("chat", "alice", "bbb"))
+    third := r.add(context.Background(), conn, commitMsg("chat", "alice", "ccc"))
+
+    r.cancel(conn, models.GitMessage{ChatID: "chat", RunID: second.runID}, errCancelled)
+    if stopped(first) || !stopped(second) || stopped(third) {
+        t.Error("cancel by run ID stopped the wrong runs")
+    }
+    r.cancel(conn, models.GitMessage{ChatID: "chat", CommitHash: "ccc"}, errCancelled)
+    if stopped(first) || !stopped(third) {
+        t.Error("cancel by commit stopped the wrong runs")
+    }
+}
+
+func TestCancelWithoutChatStopsOnlyTheConnectionsRuns(t *testing.T) {
+    r := newRunRegistry()
+    conn, other := &safeConn{}, &safeConn{}
+    mine := r.add(context.Background(), conn, commitMsg("chat", "alice", "aaa"))
+    theirs := r.add(context.Background(), other, commitMsg("chat", "alice", "bbb"))
+
+    r.cancel(conn, models.GitMessage{}, errCancelled)
+    if !stopped(mine) || stopped(theirs) {
+        t.Error("cancel without a chat reached another connection's run")
+    }
+}
+
+func TestCancelFromAnotherConnectionNeedsTheSameUser(t *testing.T) {
+    r := newRunRegistry()
+    conn, other := &safeConn{}, &safeConn{}
+    run := r.add(context.Background(), conn, commitMsg("chat", "alice", "aaa"))
+
+    for _, user := range []string{"", "bob"} {
+        if n := r.cancel(other, models.GitMessage{ChatID: "chat", UserID: user}, errCancelled); n != 0 || stopped(run) {
+            t.Fatalf("user %q on another connection cancelled alice's run", user)
+        }
+    }
+    if n := r.cancel(other, models.GitMessage{ChatID: "chat", UserID: "alice"}, errCancelled); n != 1 || !stopped(run) {
+        t.Error("alice could not cancel the run from another connection")
+    }
+}
+
+func TestCoalescingSupersedesOlderSingleCommitRuns(t *testing.T) {
+    r := newRunRegistry()
+    conn := &safeConn{}
+    older := r.add(context.Background(), conn, commitMsg("chat", "alice", "aaa"))
+    batch := r.add(context.Background(), conn, models.GitMessage{Type: "batch", ChatID: "chat", CommitHashes: []string{"aaa", "bbb"}})
+    elsewhere := r.add(context.Background(), conn, commitMsg("other", "alice", "aaa"))
+
+    newer := commitMsg("chat", "alice", "bbb")
+    newer.Coalesce = true
+    latest := r.add(context.Background(), conn, newer)
+
+    if !stopped(older) {
+        t.Error("older commit was not superseded")
+    }
+    if stopped(batch) || stopped(elsewhere) || stopped(latest) {
+        t.Error("coalescing stopped a batch, another chat's run or itself")
+    }
+}
+
+func TestRemoveForgetsTheRun(t *testing.T) {
+    r := newRunRegistry()
+    conn := &safeConn{}
+    first := r.add(context.Background(), conn, commitMsg("chat", "alice", "aaa"))
+    second := r.add(context.Background(), conn, commitMsg("chat", "alice", "bbb"))
+
+    r.remove(first)
+    if !stopped(first) || len(r.byChat["chat"]) != 1 {
+        t.Fatal("removed run is still registered or running")
+    }
+    r.remove(second)
+    if _, ok := r.byChat["chat"]; ok {
+        t.Error("empty chat was kept")
+    }
+}
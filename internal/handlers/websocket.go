@@ -1,11 +1,17 @@
 package handlers
 
 import (
+    "context"
     "encoding/json"
+    "errors"
+    "fmt"
     "log"
     "net/http"
+    "sync"
+    "time"
     "github.com/gin-gonic/gin"
     "github.com/gorilla/websocket"
+    "websocket-git/internal/metrics"
     "websocket-git/internal/models"
     "websocket-git/internal/services"
 )
@@ -14,32 +20,81 @@ type WebSocketHandler struct {
     upgrader         websocket.Upgrader
     namespaceService *services.NamespaceService
     testService      *services.TestService
+    runs             *runRegistry
+
+    // BatchMaxPods caps how many test pods one batch request may use
+    BatchMaxPods int
+}
+
+// compressThreshold is the frame size from which permessage-deflate is used,
+// when the client negotiated it; small progress frames are cheaper raw
+const compressThreshold = 16 * 1024
+
+// safeConn serializes writes, since batch runs stream from several goroutines
+type safeConn struct {
+    *websocket.Conn
+    mu sync.Mutex
+}
+
+func (c *safeConn) WriteJSON(v interface{}) error {
+    data, err := json.Marshal(v)
+    if err != nil {
+        return err
+    }
+    c.mu.Lock()
+    defer c.mu.Unlock()
+    c.EnableWriteCompression(len(data) >= compressThreshold)
+    return c.WriteMessage(websocket.TextMessage, data)
 }
 
 func NewWebSocketHandler(ns *services.NamespaceService, ts *services.TestService) *WebSocketHandler {
     return &WebSocketHandler{
         upgrader: websocket.Upgrader{
-            ReadBufferSize:  1024,
-            WriteBufferSize: 1024,
+            ReadBufferSize:    1024,
+            WriteBufferSize:   1024,
+            EnableCompression: true,
             CheckOrigin: func(r *http.Request) bool {
                 return true
             },
         },
         namespaceService: ns,
         testService:      ts,
+        runs:             newRunRegistry(),
+        BatchMaxPods:     4,
     }
 }
 
 func (h *WebSocketHandler) HandleConnection(c *gin.Context) {
-    conn, err := h.upgrader.Upgrade(c.Writer, c.Request, nil)
+    rawConn, err := h.upgrader.Upgrade(c.Writer, c.Request, nil)
     if err != nil {
         log.Printf("Failed to upgrade connection: %v", err)
         return
     }
+    conn := &safeConn{Conn: rawConn}
     defer conn.Close()
+    metrics.WebSocketConnections.Add(1)
+    defer metrics.WebSocketConnections.Add(-1)
 
     log.Printf("New WebSocket connection established from %s", c.Request.RemoteAddr)
 
+    // Messages are read continuously, so cancel messages and disconnects are
+    // seen while a run is in progress, and processed in order by one goroutine.
+    // Closing the connection cancels everything it still has queued or running.
+    ctx, disconnect := context.WithCancelCause(context.Background())
+    pending := make(chan *activeRun, maxPendingMessages)
+    processed := make(chan struct{})
+    go func() {
+        defer close(processed)
+        for run := range pending {
+            h.handleMessage(conn, run)
+        }
+    }()
+    defer func() {
+        disconnect(errDisconnected)
+        close(pending)
+        <-processed
+    }()
+
     for {
         _, rawMessage, err := conn.ReadMessage()
         if err != nil {
@@ -54,46 +109,356 @@ func (h *WebSocketHandler) HandleConnection(c *gin.Context) {
             continue
         }
 
-        // Handle namespace operations
-        nsResult, err := h.namespaceService.HandleNamespace(gitMsg.ChatID, gitMsg.UserID, gitMsg.ProjectType)
-        if err != nil {
-            log.Printf("Namespace error: %v", err)
-            sendError(conn, "Namespace error: "+err.Error())
+        if gitMsg.Type == "cancel" {
+            cancelled := h.runs.cancel(conn, gitMsg, errCancelled)
+            conn.WriteJSON(models.Response{
+                Type:    "cancel_ack",
+                Payload: map[string]interface{}{"cancelled": cancelled},
+            })
             continue
         }
 
-        namespace, ok := nsResult["namespace"].(string)
-        if !ok || namespace == "" {
-            log.Printf("Invalid namespace response: %v", nsResult)
-            sendError(conn, "Invalid namespace received")
-            continue
+        run := h.runs.add(ctx, conn, gitMsg)
+        select {
+        case pending <- run:
+        default:
+            h.runs.remove(run)
+            sendBusy(conn, fmt.Errorf("%w: %d messages already pending on this connection", services.ErrBusy, maxPendingMessages))
+        }
+    }
+}
+
+// handleMessage sets up the namespace for one queued message and runs its
+// tests, unless the message was cancelled while it waited.
+func (h *WebSocketHandler) handleMessage(conn *safeConn, run *activeRun) {
+    defer h.runs.remove(run)
+    gitMsg := run.msg
+    if run.ctx.Err() != nil {
+        sendCancelled(conn, run, nil)
+        return
+    }
+
+    // A commit tested before needs no namespace or pod at all
+    if singleCommit(gitMsg) {
+        cached := h.testService.CachedResult(services.TestRequest{
+            RepoURL:     gitMsg.RepoURL,
+            Commit:      gitMsg.CommitHash,
+            TestCmd:     gitMsg.TestCmd,
+            ProjectType: gitMsg.ProjectType,
+            NoCache:     gitMsg.NoCache,
+        })
+        if cached != nil {
+            response := models.Response{
+                Type: "test_results",
+                Payload: map[string]interface{}{
+                    "namespace_status": map[string]interface{}{"status": "skipped", "reason": "cached result"},
+                    "test_results":     cached,
+                },
+            }
+            if err := conn.WriteJSON(response); err != nil {
+                log.Printf("Error sending response: %v", err)
+            }
+            return
         }
+    }
 
-        // Execute tests
-        testResult, err := h.testService.RunTests(namespace, gitMsg.RepoURL, gitMsg.CommitHash, gitMsg.TestCmd)
+    // Handle namespace operations
+    nsResult, err := h.namespaceService.HandleNamespace(gitMsg.ChatID, gitMsg.UserID, gitMsg.ProjectType)
+    if err != nil {
+        log.Printf("Namespace error: %v", err)
+        sendError(conn, "Namespace error: "+err.Error())
+        return
+    }
+
+    namespace, ok := nsResult["namespace"].(string)
+    if !ok || namespace == "" {
+        log.Printf("Invalid namespace response: %v", nsResult)
+        sendError(conn, "Invalid namespace received")
+        return
+    }
+
+    if gitMsg.Type == "batch" {
+        h.handleBatch(conn, run, namespace, nsResult)
+        return
+    }
+    if gitMsg.Type == "bisect" {
+        h.handleBisect(conn, run, namespace, nsResult)
+        return
+    }
+
+    // Execute tests, streaming step and output events as they happen.
+    // A pod from the namespace cache was seen Ready, so the runner goes
+    // straight to its exec.
+    pod, _ := nsResult["pod"].(string)
+    var shardPods []string
+    if gitMsg.Shards > 1 {
+        shards := gitMsg.Shards
+        if shards > h.BatchMaxPods {
+            shards = h.BatchMaxPods
+        }
+        shardPods, err = h.namespaceService.ScalePods(namespace, shards, run.runID)
         if err != nil {
-            log.Printf("Test error: %v", err)
-            sendError(conn, "Test execution failed: "+err.Error())
-            continue
+            log.Printf("Shard pod scaling error: %v", err)
+            h.namespaceService.Invalidate(namespace)
+            sendError(conn, "Shard setup failed: "+err.Error())
+            return
         }
+        defer h.namespaceService.ReleasePods(namespace, run.runID)
+        if len(shardPods) > shards {
+            shardPods = shardPods[:shards]
+        }
+    }
+    log.Printf("Run %s: %s@%s in %s", run.runID, gitMsg.RepoURL, gitMsg.CommitHash, namespace)
+    testResult, err := h.testService.RunTests(run.ctx, services.TestRequest{
+        Namespace:   namespace,
+        RepoURL:     gitMsg.RepoURL,
+        Commit:      gitMsg.CommitHash,
+        TestCmd:     gitMsg.TestCmd,
+        ProjectType: gitMsg.ProjectType,
+        Pod:         pod,
+        PodReady:    pod != "",
+        Pods:        shardPods,
+        Incremental: gitMsg.Incremental,
+        NoCache:     gitMsg.NoCache,
+        RunID:       run.runID,
+        UserID:      schedulingKey(gitMsg),
+    }, streamEvents(conn))
+    if run.ctx.Err() != nil {
+        log.Printf("Run %s cancelled: %v", run.runID, context.Cause(run.ctx))
+        sendCancelled(conn, run, testResult)
+        return
+    }
+    if errors.Is(err, services.ErrBusy) {
+        sendBusy(conn, err)
+        return
+    }
+    if err != nil {
+        log.Printf("Run %s test error: %v", run.runID, err)
+        h.namespaceService.Invalidate(namespace)
+        sendError(conn, "Test execution failed: "+err.Error())
+        return
+    }
+    if testResult["status"] == "error" {
+        h.namespaceService.Invalidate(namespace)
+    }
 
-        // Send combined response
-        response := models.Response{
-            Type: "test_results",
-            Payload: map[string]interface{}{
-                "namespace_status": nsResult,
-                "test_results":     testResult,
-            },
+    // Send combined response
+    response := models.Response{
+        Type: "test_results",
+        Payload: map[string]interface{}{
+            "namespace_status": nsResult,
+            "test_results":     testResult,
+        },
+    }
+
+    if err := conn.WriteJSON(response); err != nil {
+        log.Printf("Error sending response: %v", err)
+    }
+}
+
+// handleBatch fans a multi-commit request out over the namespace's test pods,
+// sending a batch_result frame per commit as it finishes and a batch_summary
+// frame, in commit order, at the end.
+func (h *WebSocketHandler) handleBatch(conn *safeConn, run *activeRun, namespace string, nsResult map[string]interface{}) {
+    ctx, gitMsg := run.ctx, run.msg
+    if len(gitMsg.CommitHashes) == 0 {
+        sendError(conn, "Batch request has no commitHashes")
+        return
+    }
+
+    parallelism := gitMsg.Parallelism
+    if parallelism <= 0 || parallelism > h.BatchMaxPods {
+        parallelism = h.BatchMaxPods
+    }
+    if parallelism > len(gitMsg.CommitHashes) {
+        parallelism = len(gitMsg.CommitHashes)
+    }
+
+    pods, err := h.namespaceService.ScalePods(namespace, parallelism, run.runID)
+    if err != nil {
+        log.Printf("Batch pod scaling error: %v", err)
+        h.namespaceService.Invalidate(namespace)
+        sendError(conn, "Batch setup failed: "+err.Error())
+        return
+    }
+    defer h.namespaceService.ReleasePods(namespace, run.runID)
+    if len(pods) > parallelism {
+        pods = pods[:parallelism]
+    }
+
+    start := time.Now()
+    base := services.TestRequest{
+        Namespace:   namespace,
+        RepoURL:     gitMsg.RepoURL,
+        TestCmd:     gitMsg.TestCmd,
+        ProjectType: gitMsg.ProjectType,
+        NoCache:     gitMsg.NoCache,
+        UserID:      schedulingKey(gitMsg),
+    }
+    results := h.testService.RunBatch(ctx, base, gitMsg.CommitHashes, pods, streamEvents(conn), func(item services.BatchResult) {
+        if err := conn.WriteJSON(models.Response{Type: "batch_result", Payload: item}); err != nil {
+            log.Printf("Error sending batch result for %s: %v", item.Commit, err)
         }
+    })
 
-        if err := conn.WriteJSON(response); err != nil {
-            log.Printf("Error sending response: %v", err)
-            break
+    passed := 0
+    for _, item := range results {
+        if item.Result != nil && item.Result["status"] == "passed" {
+            passed++
+        }
+    }
+
+    summary := models.Response{
+        Type: "batch_summary",
+        Payload: map[string]interface{}{
+            "namespace_status": nsResult,
+            "pods":             pods,
+            "results":          results,
+            "passed":           passed,
+            "failed":           len(results) - passed,
+            "duration":         time.Since(start).Round(10 * time.Millisecond).Seconds(),
+        },
+    }
+    if err := conn.WriteJSON(summary); err != nil {
+        log.Printf("Error sending batch summary: %v", err)
+    }
+}
+
+// handleBisect searches the commits between a good and a bad commit for the
+// first failure, testing several commits per round on parallel pods. It
+// sends a bisect_round frame as each round starts, a bisect_result frame per
+// tested commit and a bisect_summary frame with the first bad commit's
+// result at the end.
+func (h *WebSocketHandler) handleBisect(conn *safeConn, run *activeRun, namespace string, nsResult map[string]interface{}) {
+    gitMsg := run.msg
+    if gitMsg.GoodCommit == "" || gitMsg.BadCommit == "" {
+        sendError(conn, "Bisect request needs goodCommit and badCommit")
+        return
+    }
+
+    good, commits, err := h.testService.ListCommits(gitMsg.RepoURL, gitMsg.GoodCommit, gitMsg.BadCommit)
+    if err != nil {
+        log.Printf("Bisect commit listing error: %v", err)
+        sendError(conn, "Bisect setup failed: "+err.Error())
+        return
+    }
+    if len(commits) == 0 {
+        sendError(conn, fmt.Sprintf("No commits after %s up to %s", gitMsg.GoodCommit, gitMsg.BadCommit))
+        return
+    }
+
+    parallelism := gitMsg.Parallelism
+    if parallelism <= 0 || parallelism > h.BatchMaxPods {
+        parallelism = h.BatchMaxPods
+    }
+    if parallelism > len(commits) {
+        parallelism = len(commits)
+    }
+    pods, err := h.namespaceService.ScalePods(namespace, parallelism, run.runID)
+    if err != nil {
+        log.Printf("Bisect pod scaling error: %v", err)
+        h.namespaceService.Invalidate(namespace)
+        sendError(conn, "Bisect setup failed: "+err.Error())
+        return
+    }
+    defer h.namespaceService.ReleasePods(namespace, run.runID)
+    if len(pods) > parallelism {
+        pods = pods[:parallelism]
+    }
+
+    start := time.Now()
+    base := services.TestRequest{
+        Namespace:   namespace,
+        RepoURL:     gitMsg.RepoURL,
+        TestCmd:     gitMsg.TestCmd,
+        ProjectType: gitMsg.ProjectType,
+        NoCache:     gitMsg.NoCache,
+        UserID:      schedulingKey(gitMsg),
+    }
+    log.Printf("Run %s: bisecting %d commits of %s between %s and %s on %d pods", run.runID, len(commits), gitMsg.RepoURL, gitMsg.GoodCommit, gitMsg.BadCommit, len(pods))
+    result, err := h.testService.Bisect(run.ctx, base, good, commits, pods, streamEvents(conn),
+        func(round services.BisectRound) {
+            if err := conn.WriteJSON(models.Response{Type: "bisect_round", Payload: round}); err != nil {
+                log.Printf("Error sending bisect round %d: %v", round.Round, err)
+            }
+        },
+        func(item services.BatchResult) {
+            if err := conn.WriteJSON(models.Response{Type: "bisect_result", Payload: item}); err != nil {
+                log.Printf("Error sending bisect result for %s: %v", item.Commit, err)
+            }
+        })
+    if run.ctx.Err() != nil {
+        log.Printf("Run %s cancelled: %v", run.runID, context.Cause(run.ctx))
+        sendCancelled(conn, run, nil)
+        return
+    }
+    if err != nil {
+        log.Printf("Run %s bisect error: %v", run.runID, err)
+        sendError(conn, "Bisect failed: "+err.Error())
+        return
+    }
+
+    summary := models.Response{
+        Type: "bisect_summary",
+        Payload: map[string]interface{}{
+            "namespace_status": nsResult,
+            "pods":             pods,
+            "bisect":           result,
+            "duration":         time.Since(start).Round(10 * time.Millisecond).Seconds(),
+        },
+    }
+    if err := conn.WriteJSON(summary); err != nil {
+        log.Printf("Error sending bisect summary: %v", err)
+    }
+}
+
+// streamEvents forwards runner progress events as WebSocket frames
+func streamEvents(conn *safeConn) services.EventFunc {
+    return func(event map[string]interface{}) {
+        eventType, _ := event["type"].(string)
+        if err := conn.WriteJSON(models.Response{Type: eventType, Payload: event}); err != nil {
+            log.Printf("Error streaming %s event: %v", eventType, err)
         }
     }
 }
 
-func sendError(conn *websocket.Conn, message string) {
+// schedulingKey is who a request is queued for: the user, or the chat when
+// the client sends no user ID
+func schedulingKey(gitMsg models.GitMessage) string {
+    if gitMsg.UserID != "" {
+        return gitMsg.UserID
+    }
+    return "chat:" + gitMsg.ChatID
+}
+
+// sendBusy tells the client its request was refused because the queues are
+// full, so it can back off and retry
+func sendBusy(conn *safeConn, err error) {
+    log.Printf("Backpressure: %v", err)
+    conn.WriteJSON(models.Response{
+        Type: "error",
+        Payload: map[string]interface{}{
+            "message": "Server busy, retry later: " + err.Error(),
+            "busy":    true,
+        },
+    })
+}
+
+// sendCancelled reports a run stopped by a cancel message, a newer commit or
+// the server; result is its partial test_results, if the run had started
+func sendCancelled(conn *safeConn, run *activeRun, result map[string]interface{}) {
+    payload := map[string]interface{}{
+        "commit": run.msg.CommitHash,
+        "run_id": run.runID,
+        "reason": context.Cause(run.ctx).Error(),
+    }
+    if result != nil {
+        payload["test_results"] = result
+    }
+    conn.WriteJSON(models.Response{Type: "cancelled", Payload: payload})
+}
+
+func sendError(conn *safeConn, message string) {
     response := models.Response{
         Type: "error",
         Payload: map[string]interface{}{
@@ -0,0 +1,283 @@
+// Package metrics is a small Prometheus text-format registry: counters,
+// gauges and histograms with fixed label names, served by Handler.
+package metrics
+
+import (
+	"fmt"
+	"io"
+	"math"
+	"net/http"
+	"sort"
+	"strconv"
+	"strings"
+	"sync"
+)
+
+// DefaultBuckets (seconds) spans sub-second API calls to long test suites.
+var DefaultBuckets = []float64{0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600}
+
+var (
+	PhaseDuration = NewHistogram("im_phase_duration_seconds",
+		"Duration of each test run phase.", DefaultBuckets, "phase", "project_type")
+	RunsTotal = NewCounter("im_runs_total",
+		"Completed test runs by outcome.", "project_type", "status")
+	SubprocessFailures = NewCounter("im_subprocess_failures_total",
+		"Failed worker, script and kubectl invocations.", "kind")
+	ResultCacheHits = NewCounter("im_result_cache_hits_total",
+		"Test requests answered from the result cache.")
+	RunsInFlight = NewGauge("im_runs_in_flight",
+		"Test runs currently executing.")
+	WebSocketConnections = NewGauge("im_websocket_connections",
+		"Open WebSocket connections.")
+	QueueDepth = NewGauge("im_queue_depth",
+		"Requests waiting for a slot.", "queue")
+)
+
+var (
+	projectTypesMu sync.RWMutex
+	projectTypes   map[string]bool
+)
+
+// SetProjectTypes fixes the project_type label values; any other value a
+// client sends is reported as "other" so it cannot grow the series count.
+func SetProjectTypes(names []string) {
+	known := make(map[string]bool, len(names))
+	for _, name := range names {
+		known[strings.ToLower(name)] = true
+	}
+	projectTypesMu.Lock()
+	projectTypes = known
+	projectTypesMu.Unlock()
+}
+
+// ProjectType maps a client-supplied project type to its label value.
+func ProjectType(name string) string {
+	if name == "" {
+		return "unknown"
+	}
+	name = strings.ToLower(name)
+	projectTypesMu.RLock()
+	defer projectTypesMu.RUnlock()
+	if projectTypes[name] {
+		return name
+	}
+	return "other"
+}
+
+type metric interface {
+	write(w io.Writer)
+}
+
+var (
+	registryMu sync.Mutex
+	registry   []metric
+)
+
+func register(m metric) {
+	registryMu.Lock()
+	defer registryMu.Unlock()
+	registry = append(registry, m)
+}
+
+// family holds one time series per combination of label values.
+type family struct {
+	name   string
+	help   string
+	kind   string
+	labels []string
+
+	mu     sync.Mutex
+	series map[string]*series
+}
+
+type series struct {
+	labelValues []string
+	value       float64
+	buckets     []uint64
+	count       uint64
+}
+
+func newFamily(name, help, kind string, labels []string) *family {
+	f := &family{name: name, help: help, kind: kind, labels: labels, series: make(map[string]*series)}
+	if len(labels) == 0 {
+		// Unlabelled metrics are reported as 0 before their first update
+		f.get(nil)
+	}
+	return f
+}
+
+// get returns the series for values; the caller holds f.mu.
+func (f *family) get(values []string) *series {
+	if len(values) != len(f.labels) {
+		panic(fmt.Sprintf("metrics: %s wants %d label values, got %d", f.name, len(f.labels), len(values)))
+	}
+	key := strings.Join(values, "\xff")
+	s, ok := f.series[key]
+	if !ok {
+		s = &series{labelValues: append([]string(nil), values...)}
+		f.series[key] = s
+	}
+	return s
+}
+
+// sorted returns the series in label order for stable output; the caller holds f.mu.
+func (f *family) sorted() []*series {
+	keys := make([]string, 0, len(f.series))
+	for key := range f.series {
+		keys = append(keys, key)
+	}
+	sort.Strings(keys)
+	out := make([]*series, len(keys))
+	for i, key := range keys {
+		out[i] = f.series[key]
+	}
+	return out
+}
+
+func (f *family) header(w io.Writer) {
+	fmt.Fprintf(w, "# HELP %s %s\n# TYPE %s %s\n", f.name, helpEscaper.Replace(f.help), f.name, f.kind)
+}
+
+// The text exposition format escapes only these; strconv.Quote would also
+// rewrite non-ASCII and control characters into Go syntax.
+var (
+	helpEscaper  = strings.NewReplacer(`\`, `\\`, "\n", `\n`)
+	labelEscaper = strings.NewReplacer(`\`, `\\`, `"`, `\"`, "\n", `\n`)
+)
+
+func labelString(names, values []string, extra ...string) string {
+	var parts []string
+	for i, name := range names {
+		parts = append(parts, name+`="`+labelEscaper.Replace(values[i])+`"`)
+	}
+	for i := 0; i+1 < len(extra); i += 2 {
+		parts = append(parts, extra[i]+`="`+labelEscaper.Replace(extra[i+1])+`"`)
+	}
+	if len(parts) == 0 {
+		return ""
+	}
+	return "{" + strings.Join(parts, ",") + "}"
+}
+
+func formatFloat(v float64) string {
+	if math.IsInf(v, 1) {
+		return "+Inf"
+	}
+	return strconv.FormatFloat(v, 'g', -1, 64)
+}
+
+// Counter only goes up.
+type Counter struct{ *family }
+
+func NewCounter(name, help string, labels ...string) *Counter {
+	c := &Counter{newFamily(name, help, "counter", labels)}
+	register(c)
+	return c
+}
+
+func (c *Counter) Inc(labelValues ...string) { c.Add(1, labelValues...) }
+
+func (c *Counter) Add(delta float64, labelValues ...string) {
+	c.mu.Lock()
+	c.get(labelValues).value += delta
+	c.mu.Unlock()
+}
+
+func (c *Counter) write(w io.Writer) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	c.header(w)
+	for _, s := range c.sorted() {
+		fmt.Fprintf(w, "%s%s %s\n", c.name, labelString(c.labels, s.labelValues), formatFloat(s.value))
+	}
+}
+
+// Gauge can go up and down.
+type Gauge struct{ *family }
+
+func NewGauge(name, help string, labels ...string) *Gauge {
+	g := &Gauge{newFamily(name, help, "gauge", labels)}
+	register(g)
+	return g
+}
+
+func (g *Gauge) Add(delta float64, labelValues ...string) {
+	g.mu.Lock()
+	g.get(labelValues).value += delta
+	g.mu.Unlock()
+}
+
+func (g *Gauge) Set(value float64, labelValues ...string) {
+	g.mu.Lock()
+	g.get(labelValues).value = value
+	g.mu.Unlock()
+}
+
+func (g *Gauge) write(w io.Writer) {
+	g.mu.Lock()
+	defer g.mu.Unlock()
+	g.header(w)
+	for _, s := range g.sorted() {
+		fmt.Fprintf(w, "%s%s %s\n", g.name, labelString(g.labels, s.labelValues), formatFloat(s.value))
+	}
+}
+
+// Histogram counts observations into cumulative buckets.
+type Histogram struct {
+	*family
+	bounds []float64
+}
+
+func NewHistogram(name, help string, bounds []float64, labels ...string) *Histogram {
+	h := &Histogram{newFamily(name, help, "histogram", labels), bounds}
+	register(h)
+	return h
+}
+
+func (h *Histogram) Observe(value float64, labelValues ...string) {
+	h.mu.Lock()
+	defer h.mu.Unlock()
+	s := h.get(labelValues)
+	if s.buckets == nil {
+		s.buckets = make([]uint64, len(h.bounds))
+	}
+	for i, bound := range h.bounds {
+		if value <= bound {
+			s.buckets[i]++
+		}
+	}
+	s.count++
+	s.value += value
+}
+
+func (h *Histogram) write(w io.Writer) {
+	h.mu.Lock()
+	defer h.mu.Unlock()
+	h.header(w)
+	for _, s := range h.sorted() {
+		if s.buckets == nil {
+			continue
+		}
+		for i, bound := range h.bounds {
+			fmt.Fprintf(w, "%s_bucket%s %d\n", h.name,
+				labelString(h.labels, s.labelValues, "le", formatFloat(bound)), s.buckets[i])
+		}
+		fmt.Fprintf(w, "%s_bucket%s %d\n", h.name,
+			labelString(h.labels, s.labelValues, "le", "+Inf"), s.count)
+		fmt.Fprintf(w, "%s_sum%s %s\n", h.name, labelString(h.labels, s.labelValues), formatFloat(s.value))
+		fmt.Fprintf(w, "%s_count%s %d\n", h.name, labelString(h.labels, s.labelValues), s.count)
+	}
+}
+
+// Handler serves every registered metric in the Prometheus text format.
+func Handler() http.Handler {
+	return http.HandlerFunc(func(w http.ResponseWriter, r *http.Request) {
+		w.Header().Set("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+		registryMu.Lock()
+		metrics := append([]metric(nil), registry...)
+		registryMu.Unlock()
+		for _, m := range metrics {
+			m.write(w)
+		}
+	})
+}
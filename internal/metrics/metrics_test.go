@@ -0,0 +1,108 @@
+package metrics
+
+import (
+	"net/http/httptest"
+	"strings"
+	"testing"
+)
+
+func scrape(t *testing.T) string {
+	t.Helper()
+	rec := httptest.NewRecorder()
+	Handler().ServeHTTP(rec, httptest.NewRequest("GET", "/metrics", nil))
+	if ct := rec.Header().Get("Content-Type"); !strings.HasPrefix(ct, "text/plain; version=0.0.4") {
+		t.Errorf("Content-Type = %q", ct)
+	}
+	return rec.Body.String()
+}
+
+func assertLines(t *testing.T, body string, lines ...string) {
+	t.Helper()
+	for _, line := range lines {
+		if !strings.Contains(body, line+"\n") {
+			t.Errorf("missing %q in:\n%s", line, body)
+		}
+	}
+}
+
+func TestCounterAndGauge(t *testing.T) {
+	counter := NewCounter("test_counter_total", "A counter.", "kind")
+	counter.Inc("b")
+	counter.Add(2.5, "a")
+	counter.Inc("b")
+	gauge := NewGauge("test_gauge", "A gauge.")
+	gauge.Add(3)
+	gauge.Add(-1)
+
+	body := scrape(t)
+	assertLines(t, body,
+		"# HELP test_counter_total A counter.",
+		"# TYPE test_counter_total counter",
+		`test_counter_total{kind="a"} 2.5`,
+		`test_counter_total{kind="b"} 2`,
+		"# TYPE test_gauge gauge",
+		"test_gauge 2",
+	)
+	if strings.Index(body, `kind="a"`) > strings.Index(body, `kind="b"`) {
+		t.Error("series are not in label order")
+	}
+}
+
+func TestUnlabelledMetricsStartAtZero(t *testing.T) {
+	NewCounter("test_untouched_total", "Never incremented.")
+	assertLines(t, scrape(t), "test_untouched_total 0")
+}
+
+func TestHistogram(t *testing.T) {
+	h := NewHistogram("test_duration_seconds", "A histogram.", []float64{0.5, 1}, "phase")
+	h.Observe(0.2, "run")
+	h.Observe(0.7, "run")
+	h.Observe(4, "run")
+
+	assertLines(t, scrape(t),
+		"# TYPE test_duration_seconds histogram",
+		`test_duration_seconds_bucket{phase="run",le="0.5"} 1`,
+		`test_duration_seconds_bucket{phase="run",le="1"} 2`,
+		`test_duration_seconds_bucket{phase="run",le="+Inf"} 3`,
+		`test_duration_seconds_sum{phase="run"} 4.9`,
+		`test_duration_seconds_count{phase="run"} 3`,
+	)
+}
+
+func TestEscaping(t *testing.T) {
+	counter := NewCounter("test_escaped_total", "Help with a \\ and a\nnewline \"quoted\".", "value")
+	counter.Inc("a\\b \"c\"\nd é")
+
+	assertLines(t, scrape(t),
+		`# HELP test_escaped_total Help with a \\ and a\nnewline "quoted".`,
+		`test_escaped_total{value="a\\b \"c\"\nd é"} 1`,
+	)
+}
+
+func TestWrongLabelCountPanics(t *testing.T) {
+	counter := NewCounter("test_labels_total", "Two labels.", "a", "b")
+	defer func() {
+		if recover() == nil {
+			t.Error("Inc with one of two label values did not panic")
+		}
+	}()
+	counter.Inc("x")
+}
+
+func TestProjectType(t *testing.T) {
+	SetProjectTypes([]string{"fastapi", "Django"})
+	defer SetProjectTypes(nil)
+
+	for name, want := range map[string]string{
+		"":        "unknown",
+		"fastapi": "fastapi",
+		"FastAPI": "fastapi",
+		"django":  "django",
+		"rails":   "other",
+		"x\ny":    "other",
+	} {
+		if got := ProjectType(name); got != want {
+			t.Errorf("ProjectType(%q) = %q, want %q", name, got, want)
+		}
+	}
+}
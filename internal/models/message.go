@@ -1,12 +1,38 @@
 package models
 
 type GitMessage struct {
+    Type        string `json:"type,omitempty"`
     UserID      string `json:"userId"`
     ChatID      string `json:"chatId"`
     RepoURL     string `json:"repoURL"`
     CommitHash  string `json:"commitHash"`
     ProjectType string `json:"projectType"`
     TestCmd     string `json:"testCommand,omitempty"`
+    // NoCache forces a rerun instead of returning a memoized result
+    NoCache     bool   `json:"noCache,omitempty"`
+    // Coalesce cancels the chat's older queued or running commits in favour
+    // of this one
+    Coalesce    bool   `json:"coalesce,omitempty"`
+    // RunID picks the run a "cancel" message stops (with CommitHash as the
+    // alternative); a cancel naming neither stops all of the chat's runs
+    RunID       string `json:"runId,omitempty"`
+    // Shards splits a single commit's pytest suite across up to this many
+    // test pods, balanced by recorded test durations
+    Shards      int    `json:"shards,omitempty"`
+    // Incremental skips the tests the diff from the last fully tested
+    // commit cannot affect; the result's "selection" lists what was skipped
+    Incremental bool   `json:"incremental,omitempty"`
+
+    // Batch requests (type "batch") test every commit in CommitHashes,
+    // spread over up to Parallelism test pods
+    CommitHashes []string `json:"commitHashes,omitempty"`
+    Parallelism  int      `json:"parallelism,omitempty"`
+
+    // Bisect requests (type "bisect") find the first commit after
+    // GoodCommit, up to BadCommit, whose tests fail, using up to Parallelism
+    // test pods per round
+    GoodCommit string `json:"goodCommit,omitempty"`
+    BadCommit  string `json:"badCommit,omitempty"`
 }
 
 type Response struct {
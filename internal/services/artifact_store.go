@@ -0,0 +1,29 @@
+package services
+
+import (
+	"fmt"
+	"os"
+	"path/filepath"
+	"regexp"
+)
+
+var runIDPattern = regexp.MustCompile(`^[0-9a-f]{8,64}$`)
+
+// ArtifactStore reads the gzipped full test logs the runner writes to
+// <Dir>/<run id>/<stream>.log.gz (see scripts/output_capture.py).
+type ArtifactStore struct {
+	Dir string
+}
+
+func NewArtifactStore(dir string) *ArtifactStore {
+	return &ArtifactStore{Dir: dir}
+}
+
+// Open returns the compressed log for one stream of a run. The caller
+// closes the file.
+func (s *ArtifactStore) Open(runID, stream string) (*os.File, error) {
+	if !runIDPattern.MatchString(runID) || (stream != "stdout" && stream != "stderr") {
+		return nil, fmt.Errorf("invalid artifact %s/%s", runID, stream)
+	}
+	return os.Open(filepath.Join(s.Dir, runID, stream+".log.gz"))
+}
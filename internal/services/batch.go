@@ -0,0 +1,61 @@
+package services
+
+import (
+	"context"
+	"log"
+	"sync"
+)
+
+// BatchResult is one commit's outcome within a batch.
+type BatchResult struct {
+	Commit string                 `json:"commit"`
+	Index  int                    `json:"index"`
+	Pod    string                 `json:"pod"`
+	Result map[string]interface{} `json:"result,omitempty"`
+	Error  string                 `json:"error,omitempty"`
+}
+
+// RunBatch tests commits in parallel, one run per pod at a time. onResult
+// is called in completion order; the returned slice is in commit order.
+func (s *TestService) RunBatch(ctx context.Context, base TestRequest, commits, pods []string, onEvent EventFunc, onResult func(BatchResult)) []BatchResult {
+	results := make([]BatchResult, len(commits))
+
+	// Each pod has its own checkout, so a pod only ever runs one commit at a time
+	free := make(chan string, len(pods))
+	for _, pod := range pods {
+		free <- pod
+	}
+
+	var wg sync.WaitGroup
+	var mu sync.Mutex
+	for i, commit := range commits {
+		wg.Add(1)
+		go func(i int, commit string) {
+			defer wg.Done()
+			pod := <-free
+			defer func() { free <- pod }()
+
+			req := base
+			req.Commit = commit
+			req.Pod = pod
+			item := BatchResult{Commit: commit, Index: i, Pod: pod}
+			result, err := s.RunTests(ctx, req, onEvent)
+			if err != nil {
+				log.Printf("Batch run for %s on %s failed: %v", commit, pod, err)
+				item.Error = err.Error()
+			} else {
+				item.Result = result
+			}
+
+			mu.Lock()
+			results[i] = item
+			if onResult != nil {
+				onResult(item)
+			}
+			mu.Unlock()
+		}(i, commit)
+	}
+	wg.Wait()
+
+	return results
+}
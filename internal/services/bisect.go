@@ -0,0 +1,196 @@
+package services
+
+import (
+	"context"
+	"fmt"
+	"log"
+)
+
+// BisectRound is the progress reported as each bisect round starts.
+type BisectRound struct {
+	Round int    `json:"round"`
+	Good  string `json:"good"`
+	Bad   string `json:"bad"`
+	// Remaining counts the untested commits that may still be the first bad one
+	Remaining int      `json:"remaining"`
+	Testing   []string `json:"testing"`
+}
+
+// BisectResult is the outcome of a bisect: the first failing commit and its
+// result, or the candidates left when runs between good and bad errored.
+type BisectResult struct {
+	Good       string                 `json:"good"`
+	FirstBad   string                 `json:"first_bad,omitempty"`
+	Result     map[string]interface{} `json:"result,omitempty"`
+	Candidates []string               `json:"candidates,omitempty"`
+	Commits    int                    `json:"commits"`
+	Rounds     int                    `json:"rounds"`
+	Tested     int                    `json:"tested"`
+	// Reused counts results taken from the result cache before any round ran
+	Reused int `json:"reused"`
+}
+
+// ListCommits returns good resolved to a full SHA and the first-parent
+// commits after it up to and including bad, oldest first, from the git
+// mirror.
+func (s *TestService) ListCommits(repoURL, good, bad string) (string, []string, error) {
+	result, err := CallWorker(s.Pool, "commits_between", map[string]interface{}{
+		"repo_url": repoURL,
+		"good":     good,
+		"bad":      bad,
+	}, nil)
+	if err != nil {
+		return "", nil, err
+	}
+	goodSHA, _ := result["good"].(string)
+	listed, _ := result["commits"].([]interface{})
+	commits := make([]string, 0, len(listed))
+	for _, commit := range listed {
+		if sha, ok := commit.(string); ok {
+			commits = append(commits, sha)
+		}
+	}
+	return goodSHA, commits, nil
+}
+
+// Bisect finds the first failing commit in commits (oldest first, the last
+// one known bad, all descendants of good). Each round tests up to one
+// commit per pod, evenly spaced over the commits still in question, so the
+// range shrinks by a factor of len(pods)+1 per round. Results already in
+// the cache narrow the range before the first round. Commits whose runs
+// error are skipped, as with git bisect skip. onRound and onResult may be
+// nil.
+func (s *TestService) Bisect(ctx context.Context, base TestRequest, good string, commits, pods []string, onEvent EventFunc, onRound func(BisectRound), onResult func(BatchResult)) (*BisectResult, error) {
+	if len(commits) == 0 {
+		return nil, fmt.Errorf("no commits after %s to bisect", good)
+	}
+	report := &BisectResult{Good: good, Commits: len(commits)}
+	known := make(map[int]map[string]interface{})
+	skipped := make(map[int]bool)
+	if s.Cache != nil && !base.NoCache {
+		for i, commit := range commits {
+			key := CacheKey(base.RepoURL, commit, base.TestCmd, base.ProjectType)
+			if key == "" {
+				continue
+			}
+			if result := s.Cache.Lookup(key); result != nil {
+				known[i] = result
+				report.Reused++
+			}
+		}
+	}
+
+	// good sits at index -1; bad is the earliest known failure after it and
+	// good the latest known pass before that
+	lo, hi := -1, len(commits)-1
+	narrow := func() {
+		for i := lo + 1; i < hi; i++ {
+			if known[i] != nil && known[i]["status"] == "failed" {
+				hi = i
+				break
+			}
+		}
+		for i := hi - 1; i > lo; i-- {
+			if known[i] != nil && known[i]["status"] == "passed" {
+				lo = i
+				break
+			}
+		}
+	}
+	commitAt := func(i int) string {
+		if i < 0 {
+			return good
+		}
+		return commits[i]
+	}
+	test := func(indexes []int) error {
+		batch := make([]string, len(indexes))
+		for j, i := range indexes {
+			batch[j] = commits[i]
+		}
+		items := s.RunBatch(ctx, base, batch, pods, onEvent, func(item BatchResult) {
+			item.Index = indexes[item.Index]
+			if onResult != nil {
+				onResult(item)
+			}
+		})
+		if err := ctx.Err(); err != nil {
+			return err
+		}
+		report.Tested += len(items)
+		for j, item := range items {
+			status, _ := item.Result["status"].(string)
+			if status == "passed" || status == "failed" {
+				known[indexes[j]] = item.Result
+			} else {
+				skipped[indexes[j]] = true
+			}
+		}
+		return nil
+	}
+
+	for {
+		narrow()
+		var candidates []int
+		for i := lo + 1; i < hi; i++ {
+			if !skipped[i] {
+				candidates = append(candidates, i)
+			}
+		}
+		if len(candidates) == 0 {
+			break
+		}
+		// Split the candidates into len(pods)+1 roughly equal parts
+		points := candidates
+		if len(candidates) > len(pods) {
+			points = nil
+			for j := 1; j <= len(pods); j++ {
+				point := candidates[j*len(candidates)/(len(pods)+1)]
+				if len(points) == 0 || points[len(points)-1] != point {
+					points = append(points, point)
+				}
+			}
+		}
+
+		report.Rounds++
+		round := BisectRound{Round: report.Rounds, Good: commitAt(lo), Bad: commits[hi], Remaining: len(candidates)}
+		for _, i := range points {
+			round.Testing = append(round.Testing, commits[i])
+		}
+		log.Printf("Bisect round %d: %d candidates between %s and %s, testing %d", round.Round, round.Remaining, round.Good, round.Bad, len(points))
+		if onRound != nil {
+			onRound(round)
+		}
+		if err := test(points); err != nil {
+			return nil, err
+		}
+	}
+
+	// The bad end is only assumed to fail until it has been run
+	if known[hi] == nil && !skipped[hi] {
+		report.Rounds++
+		if onRound != nil {
+			onRound(BisectRound{Round: report.Rounds, Good: commitAt(lo), Bad: commits[hi], Testing: []string{commits[hi]}})
+		}
+		if err := test([]int{hi}); err != nil {
+			return nil, err
+		}
+	}
+	if known[hi] != nil && known[hi]["status"] == "passed" {
+		return nil, fmt.Errorf("%s passes, so there is no failure to bisect", commits[hi])
+	}
+
+	report.Good = commitAt(lo)
+	for i := lo + 1; i <= hi; i++ {
+		if skipped[i] {
+			report.Candidates = append(report.Candidates, commits[i])
+		}
+	}
+	if len(report.Candidates) == 0 {
+		report.FirstBad = commits[hi]
+		report.Result = known[hi]
+	} else if !skipped[hi] {
+		report.Candidates = append(report.Candidates, commits[hi])
+	}
+	return report, nil
+}
@@ -0,0 +1,136 @@
+package services
+
+import (
+	"context"
+	"encoding/json"
+	"fmt"
+	"os"
+	"path/filepath"
+	"strings"
+	"testing"
+	"time"
+)
+
+// fakeRunner is a stand-in test-runner.py that reports statuses[commit]
+// ("error" when missing) and logs every commit it was asked to test.
+const fakeRunner = `import json, sys
+args = sys.argv[1:]
+commit = args[args.index("-c") + 1]
+with open(sys.argv[0] + ".json") as f:
+    statuses = json.load(f)
+with open(sys.argv[0] + ".log", "a") as f:
+    f.write(commit + "\n")
+status = statuses.get(commit, "error")
+errors = [{"step": "test_execution", "error": "tests failed"}] if status == "failed" else []
+print(json.dumps({"result": {"status": status, "commit": commit, "output": {"kubectl_errors": errors}}}))
+`
+
+func bisectService(t *testing.T, statuses map[string]string) (*TestService, func() []string) {
+	t.Helper()
+	script := filepath.Join(t.TempDir(), "runner.py")
+	data, _ := json.Marshal(statuses)
+	if err := os.WriteFile(script, []byte(fakeRunner), 0o644); err != nil {
+		t.Fatal(err)
+	}
+	if err := os.WriteFile(script+".json", data, 0o644); err != nil {
+		t.Fatal(err)
+	}
+	tested := func() []string {
+		log, _ := os.ReadFile(script + ".log")
+		return strings.Fields(string(log))
+	}
+	return &TestService{ScriptPath: script}, tested
+}
+
+// history returns n full-SHA commits; the first firstBad pass and the rest fail
+func history(n, firstBad int) ([]string, map[string]string) {
+	commits := make([]string, n)
+	statuses := make(map[string]string)
+	for i := range commits {
+		commits[i] = fmt.Sprintf("%040x", i+1)
+		statuses[commits[i]] = "passed"
+		if i >= firstBad {
+			statuses[commits[i]] = "failed"
+		}
+	}
+	return commits, statuses
+}
+
+func TestBisectFindsTheFirstFailingCommit(t *testing.T) {
+	for _, firstBad := range []int{0, 1, 9, 22, 23} {
+		commits, statuses := history(24, firstBad)
+		service, tested := bisectService(t, statuses)
+		var rounds []BisectRound
+		report, err := service.Bisect(context.Background(), TestRequest{}, "good", commits,
+			[]string{"pod-0", "pod-1", "pod-2"}, nil, func(r BisectRound) { rounds = append(rounds, r) }, nil)
+		if err != nil {
+			t.Fatalf("first bad %d: %v", firstBad, err)
+		}
+		if report.FirstBad != commits[firstBad] {
+			t.Errorf("first bad %d: got %s, want %s", firstBad, report.FirstBad, commits[firstBad])
+		}
+		// 23 candidates shrink four-fold per round with three pods, plus
+		// the final check of the bad end
+		if report.Rounds > 4 || len(tested()) > 3*4 {
+			t.Errorf("first bad %d: %d rounds and %d runs for 24 commits", firstBad, report.Rounds, len(tested()))
+		}
+		if len(rounds) != report.Rounds || report.Tested != len(tested()) {
+			t.Errorf("first bad %d: reported %d rounds and %d tested, saw %d and %d",
+				firstBad, report.Rounds, report.Tested, len(rounds), len(tested()))
+		}
+	}
+}
+
+func TestBisectSkipsCommitsThatError(t *testing.T) {
+	commits, statuses := history(8, 5)
+	statuses[commits[4]] = "error"
+	service, _ := bisectService(t, statuses)
+	report, err := service.Bisect(context.Background(), TestRequest{}, "good", commits,
+		[]string{"pod-0", "pod-1"}, nil, nil, nil)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if report.FirstBad != "" {
+		t.Errorf("named %s although the commit before it could not be tested", report.FirstBad)
+	}
+	if want := []string{commits[4], commits[5]}; strings.Join(report.Candidates, ",") != strings.Join(want, ",") {
+		t.Errorf("candidates = %v, want %v", report.Candidates, want)
+	}
+	if report.Good != commits[3] {
+		t.Errorf("good = %s, want %s", report.Good, commits[3])
+	}
+}
+
+func TestBisectRefusesAPassingBadEnd(t *testing.T) {
+	commits, statuses := history(5, 5)
+	service, _ := bisectService(t, statuses)
+	if _, err := service.Bisect(context.Background(), TestRequest{}, "good", commits,
+		[]string{"pod-0"}, nil, nil, nil); err == nil {
+		t.Error("bisect of a passing range succeeded")
+	}
+}
+
+func TestBisectStartsFromCachedResults(t *testing.T) {
+	commits, statuses := history(16, 11)
+	service, tested := bisectService(t, statuses)
+	service.Cache = NewResultCache(t.TempDir(), time.Hour, 100, 1<<20)
+	service.Cache.put(CacheKey("", commits[9], "", ""), map[string]interface{}{"status": "passed"})
+	for _, i := range []int{12, 15} {
+		service.Cache.put(CacheKey("", commits[i], "", ""), testFailure("test_execution"))
+	}
+
+	report, err := service.Bisect(context.Background(), TestRequest{}, "good", commits,
+		[]string{"pod-0", "pod-1"}, nil, nil, nil)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if report.FirstBad != commits[11] || report.Reused != 3 {
+		t.Errorf("first bad %s with %d reused, want %s with 3", report.FirstBad, report.Reused, commits[11])
+	}
+	// Only 10 and 11 lie between the cached pass at 9 and failure at 12
+	for _, commit := range tested() {
+		if commit != commits[10] && commit != commits[11] {
+			t.Errorf("tested %s outside the range the cache left", commit)
+		}
+	}
+}
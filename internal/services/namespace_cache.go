@@ -0,0 +1,247 @@
+package services
+
+import (
+	"encoding/json"
+	"io"
+	"log"
+	"os"
+	"os/exec"
+	"sort"
+	"strings"
+	"sync"
+	"time"
+)
+
+// NamespaceCache remembers which namespace serves each chat/user and which
+// of its test pods are Ready, so repeat messages skip namespace_handler.py
+// and the runner's pod lookup. Namespace and pod state comes from two
+// `kubectl get --watch` streams; while either stream is down the cache
+// reports misses and every message takes the slow path.
+type NamespaceCache struct {
+	Kubectl string
+	// TTL bounds how long an owner entry is trusted; the slow path also
+	// refreshes warm pool leases, so it must still run now and then
+	TTL time.Duration
+
+	mu         sync.Mutex
+	watching   map[string]bool
+	namespaces map[string]bool
+	pods       map[string]map[string]bool
+	owners     map[string]ownerEntry
+}
+
+type ownerEntry struct {
+	result   map[string]interface{}
+	storedAt time.Time
+}
+
+type watchEvent struct {
+	Type   string `json:"type"`
+	Object struct {
+		Metadata struct {
+			Name              string  `json:"name"`
+			Namespace         string  `json:"namespace"`
+			DeletionTimestamp *string `json:"deletionTimestamp"`
+		} `json:"metadata"`
+		Status struct {
+			Phase      string `json:"phase"`
+			Conditions []struct {
+				Type   string `json:"type"`
+				Status string `json:"status"`
+			} `json:"conditions"`
+		} `json:"status"`
+	} `json:"object"`
+}
+
+func NewNamespaceCache(ttl time.Duration) *NamespaceCache {
+	kubectl := os.Getenv("KUBECTL")
+	if kubectl == "" {
+		kubectl = "kubectl"
+	}
+	return &NamespaceCache{
+		Kubectl:    kubectl,
+		TTL:        ttl,
+		watching:   make(map[string]bool),
+		namespaces: make(map[string]bool),
+		pods:       make(map[string]map[string]bool),
+		owners:     make(map[string]ownerEntry),
+	}
+}
+
+// Start launches the namespace and test-pod watches, restarting them with
+// backoff whenever kubectl exits.
+func (c *NamespaceCache) Start() {
+	go c.watch("namespaces", []string{"get", "namespaces"}, c.applyNamespace)
+	// Same selector the runner uses to find the test pod
+	go c.watch("pods", []string{"get", "pods", "--all-namespaces", "-l", "app=test-pod"}, c.applyPod)
+}
+
+func (c *NamespaceCache) watch(kind string, args []string, apply func(watchEvent)) {
+	backoff := time.Second
+	for {
+		started := time.Now()
+		err := c.runWatch(kind, args, apply)
+		log.Printf("Namespace cache %s watch stopped: %v", kind, err)
+
+		// Everything seen so far may be stale; miss until the watch relists
+		c.mu.Lock()
+		c.watching[kind] = false
+		if kind == "namespaces" {
+			c.namespaces = make(map[string]bool)
+		} else {
+			c.pods = make(map[string]map[string]bool)
+		}
+		c.mu.Unlock()
+
+		if time.Since(started) > time.Minute {
+			backoff = time.Second
+		}
+		time.Sleep(backoff)
+		if backoff < 30*time.Second {
+			backoff *= 2
+		}
+	}
+}
+
+func (c *NamespaceCache) runWatch(kind string, args []string, apply func(watchEvent)) error {
+	cmd := exec.Command(c.Kubectl, append(args, "--watch", "--output-watch-events", "-o", "json")...)
+	cmd.Stderr = os.Stderr
+	stdout, err := cmd.StdoutPipe()
+	if err != nil {
+		return err
+	}
+	if err := cmd.Start(); err != nil {
+		return err
+	}
+	defer cmd.Wait()
+	defer cmd.Process.Kill()
+
+	c.mu.Lock()
+	c.watching[kind] = true
+	c.mu.Unlock()
+
+	// kubectl writes one JSON document per event, starting with an ADDED
+	// event for every existing object
+	decoder := json.NewDecoder(stdout)
+	for {
+		var event watchEvent
+		if err := decoder.Decode(&event); err != nil {
+			if err == io.EOF {
+				return io.ErrUnexpectedEOF
+			}
+			return err
+		}
+		c.mu.Lock()
+		apply(event)
+		c.mu.Unlock()
+	}
+}
+
+// applyNamespace and applyPod are called with c.mu held
+func (c *NamespaceCache) applyNamespace(event watchEvent) {
+	name := event.Object.Metadata.Name
+	if event.Type == "DELETED" || event.Object.Status.Phase == "Terminating" {
+		c.dropNamespace(name)
+		return
+	}
+	c.namespaces[name] = true
+}
+
+func (c *NamespaceCache) applyPod(event watchEvent) {
+	meta := event.Object.Metadata
+	ready := event.Type != "DELETED" && meta.DeletionTimestamp == nil
+	if ready {
+		ready = false
+		for _, cond := range event.Object.Status.Conditions {
+			if cond.Type == "Ready" {
+				ready = cond.Status == "True"
+			}
+		}
+	}
+
+	pods := c.pods[meta.Namespace]
+	if !ready {
+		delete(pods, meta.Name)
+		return
+	}
+	if pods == nil {
+		pods = make(map[string]bool)
+		c.pods[meta.Namespace] = pods
+	}
+	pods[meta.Name] = true
+}
+
+func (c *NamespaceCache) dropNamespace(namespace string) {
+	delete(c.namespaces, namespace)
+	delete(c.pods, namespace)
+	for owner, entry := range c.owners {
+		if entry.result["namespace"] == namespace {
+			delete(c.owners, owner)
+		}
+	}
+}
+
+// Lookup returns the cached namespace_handler result for chat/user with a
+// Ready test pod (possibly "") of its namespace, or ok=false on a miss.
+func (c *NamespaceCache) Lookup(chatID, userID string) (result map[string]interface{}, pod string, ok bool) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	if !c.watching["namespaces"] || !c.watching["pods"] {
+		return nil, "", false
+	}
+
+	owner := ownerKey(chatID, userID)
+	entry, found := c.owners[owner]
+	if !found || time.Since(entry.storedAt) >= c.TTL {
+		delete(c.owners, owner)
+		return nil, "", false
+	}
+	namespace, _ := entry.result["namespace"].(string)
+	if !c.namespaces[namespace] {
+		return nil, "", false
+	}
+
+	var ready []string
+	for name := range c.pods[namespace] {
+		ready = append(ready, name)
+	}
+	if len(ready) > 0 {
+		sort.Strings(ready)
+		pod = ready[0]
+	}
+
+	result = make(map[string]interface{}, len(entry.result)+1)
+	for k, v := range entry.result {
+		result[k] = v
+	}
+	result["status"] = "exists"
+	result["cached"] = true
+	return result, pod, true
+}
+
+// Store records a successful namespace_handler result for chat/user.
+func (c *NamespaceCache) Store(chatID, userID string, result map[string]interface{}) {
+	if _, ok := result["namespace"].(string); !ok {
+		return
+	}
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	c.owners[ownerKey(chatID, userID)] = ownerEntry{result: result, storedAt: time.Now()}
+}
+
+// Invalidate forgets every owner mapped to namespace after a failed
+// operation, so the next message re-checks it through namespace_handler.
+func (c *NamespaceCache) Invalidate(namespace string) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	for owner, entry := range c.owners {
+		if entry.result["namespace"] == namespace {
+			delete(c.owners, owner)
+		}
+	}
+}
+
+// ownerKey matches the im-<chat>-<user> name namespace_handler.py derives
+func ownerKey(chatID, userID string) string {
+	return strings.ToLower("im-" + chatID + "-" + userID)
+}
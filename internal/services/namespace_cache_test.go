@@ -0,0 +1,150 @@
+package services
+
+import (
+	"encoding/json"
+	"os"
+	"path/filepath"
+	"testing"
+	"time"
+)
+
+// watchedCache is a cache whose watches are up, fed by the test instead of kubectl
+func watchedCache(ttl time.Duration) *NamespaceCache {
+	c := NewNamespaceCache(ttl)
+	c.watching["namespaces"] = true
+	c.watching["pods"] = true
+	return c
+}
+
+func event(t *testing.T, doc string) watchEvent {
+	t.Helper()
+	var e watchEvent
+	if err := json.Unmarshal([]byte(doc), &e); err != nil {
+		t.Fatal(err)
+	}
+	return e
+}
+
+func namespaceEvent(t *testing.T, kind, name, phase string) watchEvent {
+	return event(t, `{"type": "`+kind+`", "object": {"metadata": {"name": "`+name+`"}, "status": {"phase": "`+phase+`"}}}`)
+}
+
+func podEvent(t *testing.T, kind, namespace, name, ready string) watchEvent {
+	return event(t, `{"type": "`+kind+`", "object": {"metadata": {"name": "`+name+`", "namespace": "`+namespace+`"},
+		"status": {"phase": "Running", "conditions": [{"type": "Ready", "status": "`+ready+`"}]}}}`)
+}
+
+// feed applies events as the watches would
+func (c *NamespaceCache) feed(events ...watchEvent) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	for _, e := range events {
+		if e.Object.Metadata.Namespace == "" {
+			c.applyNamespace(e)
+		} else {
+			c.applyPod(e)
+		}
+	}
+}
+
+func TestNamespaceCacheHit(t *testing.T) {
+	c := watchedCache(time.Minute)
+	c.Store("Chat", "User", map[string]interface{}{"status": "created", "namespace": "im-chat-user"})
+	if _, _, ok := c.Lookup("chat", "user"); ok {
+		t.Fatal("hit before the watch saw the namespace")
+	}
+
+	c.feed(namespaceEvent(t, "ADDED", "im-chat-user", "Active"),
+		podEvent(t, "ADDED", "im-chat-user", "test-pod-b", "True"),
+		podEvent(t, "ADDED", "im-chat-user", "test-pod-a", "True"),
+		podEvent(t, "ADDED", "im-chat-user", "test-pod-0", "False"))
+	result, pod, ok := c.Lookup("chat", "user")
+	if !ok {
+		t.Fatal("miss for a stored owner with a live namespace")
+	}
+	if result["status"] != "exists" || result["cached"] != true || result["namespace"] != "im-chat-user" {
+		t.Errorf("result = %v", result)
+	}
+	if pod != "test-pod-a" {
+		t.Errorf("pod = %q, want the first Ready pod", pod)
+	}
+
+	// Pods going away leave the namespace cached without a pod
+	c.feed(podEvent(t, "DELETED", "im-chat-user", "test-pod-a", "True"),
+		podEvent(t, "MODIFIED", "im-chat-user", "test-pod-b", "False"))
+	if _, pod, ok := c.Lookup("chat", "user"); !ok || pod != "" {
+		t.Errorf("after the pods went: ok = %v, pod = %q", ok, pod)
+	}
+}
+
+func TestNamespaceCacheMissesWhileAWatchIsDown(t *testing.T) {
+	c := watchedCache(time.Minute)
+	c.Store("chat", "user", map[string]interface{}{"namespace": "im-chat-user"})
+	c.feed(namespaceEvent(t, "ADDED", "im-chat-user", "Active"))
+	c.watching["pods"] = false
+	if _, _, ok := c.Lookup("chat", "user"); ok {
+		t.Error("hit while the pod watch was down")
+	}
+}
+
+func TestNamespaceCacheEntriesExpire(t *testing.T) {
+	c := watchedCache(50 * time.Millisecond)
+	c.Store("chat", "user", map[string]interface{}{"namespace": "im-chat-user"})
+	c.feed(namespaceEvent(t, "ADDED", "im-chat-user", "Active"))
+	if _, _, ok := c.Lookup("chat", "user"); !ok {
+		t.Fatal("fresh entry missed")
+	}
+	time.Sleep(60 * time.Millisecond)
+	if _, _, ok := c.Lookup("chat", "user"); ok {
+		t.Error("entry outlived its TTL")
+	}
+}
+
+func TestNamespaceCacheInvalidation(t *testing.T) {
+	c := watchedCache(time.Minute)
+	for _, user := range []string{"a", "b", "c"} {
+		c.Store("chat", user, map[string]interface{}{"namespace": "im-chat-" + user})
+		c.feed(namespaceEvent(t, "ADDED", "im-chat-"+user, "Active"))
+	}
+
+	c.Invalidate("im-chat-a")
+	c.feed(namespaceEvent(t, "MODIFIED", "im-chat-b", "Terminating"))
+	for user, want := range map[string]bool{"a": false, "b": false, "c": true} {
+		if _, _, ok := c.Lookup("chat", user); ok != want {
+			t.Errorf("Lookup(%s) ok = %v, want %v", user, ok, want)
+		}
+	}
+	// A namespace created again is not trusted until namespace_handler confirms its owner
+	c.feed(namespaceEvent(t, "ADDED", "im-chat-b", "Active"))
+	if _, _, ok := c.Lookup("chat", "b"); ok {
+		t.Error("owner of a deleted namespace came back without a Store")
+	}
+}
+
+// watchStream stands in for kubectl: it prints watch events as
+// --output-watch-events does, indented and back to back, then exits.
+const watchStream = `#!/bin/sh
+cat <<'END'
+{
+    "type": "ADDED",
+    "object": {"metadata": {"name": "im-chat-user"}, "status": {"phase": "Active"}}
+}
+{"type": "ADDED", "object": {"metadata": {"name": "im-old"}, "status": {"phase": "Active"}}}
+{"type": "DELETED", "object": {"metadata": {"name": "im-old"}, "status": {"phase": "Active"}}}
+END
+`
+
+func TestNamespaceCacheReadsTheWatchStream(t *testing.T) {
+	kubectl := filepath.Join(t.TempDir(), "kubectl")
+	if err := os.WriteFile(kubectl, []byte(watchStream), 0o755); err != nil {
+		t.Fatal(err)
+	}
+	c := NewNamespaceCache(time.Minute)
+	c.Kubectl = kubectl
+	if err := c.runWatch("namespaces", []string{"get", "namespaces"}, c.applyNamespace); err == nil {
+		t.Error("a watch that ended reported no error")
+	}
+	if !c.watching["namespaces"] || !c.namespaces["im-chat-user"] || c.namespaces["im-old"] {
+		t.Errorf("watching = %v, namespaces = %v", c.watching, c.namespaces)
+	}
+}
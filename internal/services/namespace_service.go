@@ -7,19 +7,86 @@ import (
 	"log"
 	"os/exec"
 	"path/filepath"
+	"time"
+	"websocket-git/internal/metrics"
 )
 
 type NamespaceService struct {
 	ScriptPath string
+	Pool       *WorkerPool
+	// Cache answers repeat messages without calling the worker; nil disables it
+	Cache *NamespaceCache
 }
 
-func NewNamespaceService() *NamespaceService {
+// NewNamespaceService runs requests through pool when it is non-nil and
+// falls back to forking the script per request otherwise.
+func NewNamespaceService(pool *WorkerPool) *NamespaceService {
 	return &NamespaceService{
 		ScriptPath: filepath.Join("scripts", "namespace_handler.py"),
+		Pool:       pool,
 	}
 }
 
+// HandleNamespace ensures the chat/user namespace exists. A cache hit also
+// carries "pod", a test pod the watch has seen Ready.
 func (s *NamespaceService) HandleNamespace(chatID, userID, projectType string) (map[string]interface{}, error) {
+	start := time.Now()
+	result, err := s.ensureNamespace(chatID, userID, projectType)
+	if err != nil {
+		metrics.SubprocessFailures.Inc("namespace")
+	} else {
+		metrics.PhaseDuration.Observe(time.Since(start).Seconds(), "namespace", metrics.ProjectType(projectType))
+	}
+	return result, err
+}
+
+func (s *NamespaceService) ensureNamespace(chatID, userID, projectType string) (map[string]interface{}, error) {
+	if s.Cache != nil {
+		if result, pod, ok := s.Cache.Lookup(chatID, userID); ok {
+			if pod != "" {
+				result["pod"] = pod
+			}
+			return result, nil
+		}
+	}
+
+	var result map[string]interface{}
+	var err error
+	if s.Pool != nil {
+		result, err = s.Pool.Call("namespace", map[string]interface{}{
+			"chat_id":      chatID,
+			"user_id":      userID,
+			"project_type": projectType,
+		})
+		if err != nil {
+			return nil, err
+		}
+	} else if result, err = s.runScript(chatID, userID, projectType); err != nil {
+		return nil, err
+	}
+
+	if status, ok := result["status"]; ok && status == "error" {
+		log.Printf("Namespace handler error details: %+v", result)
+		if kubectlErr, exists := result["kubectl_error"]; exists {
+			return result, fmt.Errorf("kubectl error: %v", kubectlErr)
+		}
+		return result, fmt.Errorf("namespace handler error: %v (full response: %+v)", result["message"], result)
+	}
+
+	if s.Cache != nil {
+		s.Cache.Store(chatID, userID, result)
+	}
+	return result, nil
+}
+
+// Invalidate drops cached state for namespace after an operation in it failed.
+func (s *NamespaceService) Invalidate(namespace string) {
+	if s.Cache != nil {
+		s.Cache.Invalidate(namespace)
+	}
+}
+
+func (s *NamespaceService) runScript(chatID, userID, projectType string) (map[string]interface{}, error) {
 	cmd := exec.Command("python3", s.ScriptPath, chatID, userID, projectType)
 	output, err := cmd.CombinedOutput()
 	
@@ -47,13 +114,100 @@ func (s *NamespaceService) HandleNamespace(chatID, userID, projectType string) (
 		return nil, fmt.Errorf("failed to parse JSON output: %v", err)
 	}
 
-	if status, ok := result["status"]; ok && status == "error" {
-		log.Printf("Namespace handler error details: %+v", result)
-		if kubectlErr, exists := result["kubectl_error"]; exists {
-			return result, fmt.Errorf("kubectl error: %v", kubectlErr)
+	return result, nil
+}
+
+// ScalePods grows the namespace's test-pod deployment to at least replicas
+// and returns the names of its ready pods. The replicas are held under lease
+// (the run's ID) until ReleasePods; on error the lease is already released.
+func (s *NamespaceService) ScalePods(namespace string, replicas int, lease string) ([]string, error) {
+	result, err := CallWorker(s.Pool, "scale_pods", map[string]interface{}{
+		"namespace": namespace,
+		"replicas":  replicas,
+		"lease":     lease,
+	}, nil)
+	if err != nil {
+		// The worker may have died after recording the lease
+		s.ReleasePods(namespace, lease)
+		return nil, err
+	}
+	if result["status"] == "error" {
+		return nil, fmt.Errorf("failed to scale test pods: %v", result["message"])
+	}
+
+	rawPods, _ := result["pods"].([]interface{})
+	pods := make([]string, 0, len(rawPods))
+	for _, pod := range rawPods {
+		if name, ok := pod.(string); ok && name != "" {
+			pods = append(pods, name)
 		}
-		return result, fmt.Errorf("namespace handler error: %v (full response: %+v)", result["message"], result)
 	}
+	if len(pods) == 0 {
+		s.ReleasePods(namespace, lease)
+		return nil, fmt.Errorf("no ready test pods in %s", namespace)
+	}
+	return pods, nil
+}
 
-	return result, nil
+// ReleasePods drops lease and scales the namespace's test-pod deployment
+// back down to what its remaining leases need, at least one replica.
+func (s *NamespaceService) ReleasePods(namespace, lease string) {
+	result, err := CallWorker(s.Pool, "release_pods", map[string]interface{}{
+		"namespace": namespace,
+		"lease":     lease,
+	}, nil)
+	if err != nil {
+		log.Printf("Releasing test pods in %s failed: %v", namespace, err)
+	} else if result["status"] == "error" {
+		log.Printf("Releasing test pods in %s failed: %v", namespace, result["message"])
+	}
+}
+
+// MaintainWarmPool periodically refills the warm pool of ready test
+// namespaces and reclaims idle leases (see scripts/pool_manager.py). It is a
+// no-op on the worker side unless WARM_POOL_SIZE is set.
+func (s *NamespaceService) MaintainWarmPool(interval time.Duration) {
+	go func() {
+		for {
+			result, err := CallWorker(s.Pool, "pool_maintain", nil, nil)
+			if err != nil {
+				log.Printf("Warm pool maintenance failed: %v", err)
+			} else if result["status"] == "disabled" {
+				return
+			} else {
+				log.Printf("Warm pool maintenance: %v", result)
+			}
+			time.Sleep(interval)
+		}
+	}()
+}
+
+// MaintainNamespaces periodically scales idle chat namespaces to zero and
+// deletes long-idle ones (see scripts/namespace_lifecycle.py), dropping
+// them from the namespace cache so the next message re-warms or recreates
+// them. It stops if the worker reports the reaper disabled.
+func (s *NamespaceService) MaintainNamespaces(interval time.Duration) {
+	go func() {
+		for {
+			result, err := CallWorker(s.Pool, "reap", nil, nil)
+			if err != nil {
+				log.Printf("Namespace reaping failed: %v", err)
+			} else if result["status"] == "disabled" {
+				return
+			} else {
+				for _, key := range []string{"scaled_down", "deleted"} {
+					namespaces, _ := result[key].([]interface{})
+					for _, namespace := range namespaces {
+						if name, ok := namespace.(string); ok {
+							s.Invalidate(name)
+						}
+					}
+					if len(namespaces) > 0 {
+						log.Printf("Namespace reaper %s: %v", key, namespaces)
+					}
+				}
+			}
+			time.Sleep(interval)
+		}
+	}()
 }
@@ -0,0 +1,47 @@
+package services
+
+import (
+	"context"
+	"log"
+	"os/exec"
+	"syscall"
+	"time"
+)
+
+// CancelGrace is how long a cancelled runner process gets to stop the
+// command in its pod and report before its process group is killed.
+var CancelGrace = 15 * time.Second
+
+// setProcessGroup starts cmd in its own process group, so a forced stop also
+// takes down the kubectl processes it started.
+func setProcessGroup(cmd *exec.Cmd) {
+	cmd.SysProcAttr = &syscall.SysProcAttr{Setpgid: true}
+}
+
+// watchCancel sends cmd's process SIGTERM once ctx is done (the runner
+// scripts then cancel the run and still report a result) and kills its
+// process group if it has not finished CancelGrace later. The returned
+// function ends the watch and returns once the watcher has stopped.
+func watchCancel(ctx context.Context, cmd *exec.Cmd) func() {
+	done := make(chan struct{})
+	stopped := make(chan struct{})
+	go func() {
+		defer close(stopped)
+		select {
+		case <-done:
+			return
+		case <-ctx.Done():
+		}
+		cmd.Process.Signal(syscall.SIGTERM)
+		select {
+		case <-done:
+		case <-time.After(CancelGrace):
+			log.Printf("Process %d did not stop within %v, killing its process group", cmd.Process.Pid, CancelGrace)
+			syscall.Kill(-cmd.Process.Pid, syscall.SIGKILL)
+		}
+	}()
+	return func() {
+		close(done)
+		<-stopped
+	}
+}
@@ -0,0 +1,305 @@
+package services
+
+import (
+	"container/list"
+	"context"
+	"crypto/sha256"
+	"encoding/hex"
+	"encoding/json"
+	"errors"
+	"log"
+	"os"
+	"path/filepath"
+	"regexp"
+	"sort"
+	"sync"
+	"time"
+)
+
+var fullSHA = regexp.MustCompile(`^[0-9a-f]{40}$`)
+
+// ResultCache memoizes test results per (repo, commit, test command, project
+// type, template version). Entries live in an in-memory LRU backed by JSON
+// files on disk, so hits survive restarts, and identical concurrent requests
+// share a single in-flight run.
+type ResultCache struct {
+	Dir          string
+	TTL          time.Duration
+	MaxEntries   int
+	MaxDiskBytes int64
+
+	mu       sync.Mutex
+	lru      *list.List
+	items    map[string]*list.Element
+	inflight map[string]*inflightRun
+}
+
+type cacheEntry struct {
+	Key      string                 `json:"key"`
+	StoredAt time.Time              `json:"stored_at"`
+	Result   map[string]interface{} `json:"result"`
+}
+
+type inflightRun struct {
+	done   chan struct{}
+	result map[string]interface{}
+	err    error
+}
+
+func NewResultCache(dir string, ttl time.Duration, maxEntries int, maxDiskBytes int64) *ResultCache {
+	if err := os.MkdirAll(dir, 0o755); err != nil {
+		log.Printf("Result cache disk tier disabled: %v", err)
+		dir = ""
+	}
+	return &ResultCache{
+		Dir:          dir,
+		TTL:          ttl,
+		MaxEntries:   maxEntries,
+		MaxDiskBytes: maxDiskBytes,
+		lru:          list.New(),
+		items:        make(map[string]*list.Element),
+		inflight:     make(map[string]*inflightRun),
+	}
+}
+
+// CacheKey identifies a deterministic run. It returns "" when the commit is
+// not a full SHA, since branch names and HEAD~n move over time.
+func CacheKey(repoURL, commit, testCmd, projectType string) string {
+	if !fullSHA.MatchString(commit) {
+		return ""
+	}
+	if testCmd == "" {
+		testCmd = "pytest tests/"
+	}
+	h := sha256.New()
+	for _, part := range []string{repoURL, commit, testCmd, projectType, templateVersion(projectType)} {
+		h.Write([]byte(part))
+		h.Write([]byte{0})
+	}
+	return hex.EncodeToString(h.Sum(nil))
+}
+
+// templateVersion hashes the project's deployment template, so editing the
+// pod spec or base image invalidates earlier results.
+func templateVersion(projectType string) string {
+	h := sha256.New()
+	files, _ := filepath.Glob(filepath.Join("deployments", "templates", projectType, "*"))
+	sort.Strings(files)
+	for _, file := range files {
+		if data, err := os.ReadFile(file); err == nil {
+			h.Write([]byte(filepath.Base(file)))
+			h.Write(data)
+		}
+	}
+	return hex.EncodeToString(h.Sum(nil))[:16]
+}
+
+// Do returns the cached result for key or runs fn, storing what it returns.
+// noCache skips the lookup (and any in-flight run) but still refreshes the
+// entry. The returned bool reports whether the result came from the cache or
+// another caller's run. A caller waiting on another's run stops waiting when
+// its ctx is done, and runs fn itself if that run was cancelled.
+func (c *ResultCache) Do(ctx context.Context, key string, noCache bool, fn func() (map[string]interface{}, error)) (map[string]interface{}, bool, error) {
+	if !noCache {
+		if result := c.get(key); result != nil {
+			return markCached(result), true, nil
+		}
+
+		c.mu.Lock()
+		if run, ok := c.inflight[key]; ok {
+			c.mu.Unlock()
+			select {
+			case <-run.done:
+			case <-ctx.Done():
+				return nil, false, ctx.Err()
+			}
+			if errors.Is(run.err, context.Canceled) || (run.err == nil && run.result["status"] == "cancelled") {
+				return c.Do(ctx, key, noCache, fn)
+			}
+			if run.err != nil {
+				return nil, false, run.err
+			}
+			return markCached(run.result), true, nil
+		}
+		run := &inflightRun{done: make(chan struct{})}
+		c.inflight[key] = run
+		c.mu.Unlock()
+
+		defer func() {
+			c.mu.Lock()
+			delete(c.inflight, key)
+			c.mu.Unlock()
+			close(run.done)
+		}()
+		run.result, run.err = fn()
+		if run.err == nil {
+			c.put(key, run.result)
+		}
+		return run.result, false, run.err
+	}
+
+	result, err := fn()
+	if err == nil {
+		c.put(key, result)
+	}
+	return result, false, err
+}
+
+// Lookup returns the cached result for key without running anything, or
+// nil if there is none.
+func (c *ResultCache) Lookup(key string) map[string]interface{} {
+	if result := c.get(key); result != nil {
+		return markCached(result)
+	}
+	return nil
+}
+
+// markCached returns a shallow copy flagged as served from the cache
+func markCached(result map[string]interface{}) map[string]interface{} {
+	cached := make(map[string]interface{}, len(result)+1)
+	for k, v := range result {
+		cached[k] = v
+	}
+	cached["cached"] = true
+	return cached
+}
+
+func (c *ResultCache) get(key string) map[string]interface{} {
+	c.mu.Lock()
+	if el, ok := c.items[key]; ok {
+		entry := el.Value.(*cacheEntry)
+		if time.Since(entry.StoredAt) < c.TTL {
+			c.lru.MoveToFront(el)
+			c.mu.Unlock()
+			return entry.Result
+		}
+		c.lru.Remove(el)
+		delete(c.items, key)
+	}
+	c.mu.Unlock()
+
+	if c.Dir == "" {
+		return nil
+	}
+	path := filepath.Join(c.Dir, key+".json")
+	data, err := os.ReadFile(path)
+	if err != nil {
+		return nil
+	}
+	var entry cacheEntry
+	if err := json.Unmarshal(data, &entry); err != nil || time.Since(entry.StoredAt) >= c.TTL {
+		os.Remove(path)
+		return nil
+	}
+	now := time.Now()
+	os.Chtimes(path, now, now)
+	c.remember(&entry)
+	return entry.Result
+}
+
+// Cacheable reports whether result is deterministic for its commit: a pass,
+// or a failure of the test command itself. A "failed" run whose namespace,
+// pod, checkout or install broke is retried instead.
+func Cacheable(result map[string]interface{}) bool {
+	switch result["status"] {
+	case "passed":
+		return true
+	case "failed":
+		return failedInTests(result)
+	}
+	return false
+}
+
+// failedInTests reports whether every error the runner recorded came from
+// the test step.
+func failedInTests(result map[string]interface{}) bool {
+	output, _ := result["output"].(map[string]interface{})
+	kubectlErrors, _ := output["kubectl_errors"].([]interface{})
+	if len(kubectlErrors) == 0 {
+		return false
+	}
+	for _, entry := range kubectlErrors {
+		if e, ok := entry.(map[string]interface{}); !ok || e["step"] != "test_execution" {
+			return false
+		}
+	}
+	return true
+}
+
+func (c *ResultCache) put(key string, result map[string]interface{}) {
+	if !Cacheable(result) {
+		return
+	}
+	// An incremental run skipped tests, so it does not stand in for a full one
+	if selection, ok := result["selection"].(map[string]interface{}); ok && selection["mode"] == "incremental" {
+		return
+	}
+	entry := &cacheEntry{Key: key, StoredAt: time.Now(), Result: result}
+	c.remember(entry)
+
+	if c.Dir == "" {
+		return
+	}
+	data, err := json.Marshal(entry)
+	if err != nil {
+		return
+	}
+	tmp := filepath.Join(c.Dir, key+".json.tmp")
+	if err := os.WriteFile(tmp, data, 0o644); err != nil {
+		log.Printf("Result cache write failed: %v", err)
+		return
+	}
+	os.Rename(tmp, filepath.Join(c.Dir, key+".json"))
+	c.trimDisk()
+}
+
+func (c *ResultCache) remember(entry *cacheEntry) {
+	c.mu.Lock()
+	defer c.mu.Unlock()
+	if el, ok := c.items[entry.Key]; ok {
+		el.Value = entry
+		c.lru.MoveToFront(el)
+		return
+	}
+	c.items[entry.Key] = c.lru.PushFront(entry)
+	for c.lru.Len() > c.MaxEntries {
+		oldest := c.lru.Back()
+		c.lru.Remove(oldest)
+		delete(c.items, oldest.Value.(*cacheEntry).Key)
+	}
+}
+
+// trimDisk removes the least recently used files once the disk tier is over budget
+func (c *ResultCache) trimDisk() {
+	entries, err := os.ReadDir(c.Dir)
+	if err != nil {
+		return
+	}
+	type fileInfo struct {
+		path    string
+		size    int64
+		modTime time.Time
+	}
+	var files []fileInfo
+	var total int64
+	for _, e := range entries {
+		info, err := e.Info()
+		if err != nil || filepath.Ext(e.Name()) != ".json" {
+			continue
+		}
+		files = append(files, fileInfo{filepath.Join(c.Dir, e.Name()), info.Size(), info.ModTime()})
+		total += info.Size()
+	}
+	if total <= c.MaxDiskBytes {
+		return
+	}
+	sort.Slice(files, func(i, j int) bool { return files[i].modTime.Before(files[j].modTime) })
+	for _, f := range files {
+		if total <= c.MaxDiskBytes {
+			break
+		}
+		if os.Remove(f.path) == nil {
+			total -= f.size
+		}
+	}
+}
@@ -0,0 +1,260 @@
+package services
+
+import (
+	"context"
+	"errors"
+	"os"
+	"path/filepath"
+	"strings"
+	"sync"
+	"sync/atomic"
+	"testing"
+	"time"
+)
+
+const testSHA = "0123456789abcdef0123456789abcdef01234567"
+
+func newTestCache(t *testing.T) *ResultCache {
+	t.Helper()
+	return NewResultCache(t.TempDir(), time.Hour, 10, 1<<20)
+}
+
+func testFailure(steps ...string) map[string]interface{} {
+	var kubectlErrors []interface{}
+	for _, step := range steps {
+		entry := map[string]interface{}{"error": "exit status 1"}
+		if step != "" {
+			entry["step"] = step
+		}
+		kubectlErrors = append(kubectlErrors, entry)
+	}
+	return map[string]interface{}{
+		"status": "failed",
+		"output": map[string]interface{}{"kubectl_errors": kubectlErrors},
+	}
+}
+
+func TestCacheKey(t *testing.T) {
+	key := CacheKey("https://example.com/r.git", testSHA, "", "fastapi")
+	if key == "" {
+		t.Fatal("full SHA gave no key")
+	}
+	if got := CacheKey("https://example.com/r.git", testSHA, "pytest tests/", "fastapi"); got != key {
+		t.Error("empty test command should default to pytest tests/")
+	}
+	for name, other := range map[string]string{
+		"repo":    CacheKey("https://example.com/other.git", testSHA, "", "fastapi"),
+		"command": CacheKey("https://example.com/r.git", testSHA, "pytest -x", "fastapi"),
+		"type":    CacheKey("https://example.com/r.git", testSHA, "", "django"),
+	} {
+		if other == key {
+			t.Errorf("changing the %s kept the same key", name)
+		}
+	}
+	for _, commit := range []string{"main", "HEAD~1", testSHA[:12], strings.ToUpper(testSHA)} {
+		if got := CacheKey("https://example.com/r.git", commit, "", "fastapi"); got != "" {
+			t.Errorf("CacheKey(%q) = %q, want no key", commit, got)
+		}
+	}
+}
+
+func TestCacheable(t *testing.T) {
+	tests := []struct {
+		name   string
+		result map[string]interface{}
+		want   bool
+	}{
+		{"passed", map[string]interface{}{"status": "passed"}, true},
+		{"test failure", testFailure("test_execution"), true},
+		{"failure without errors", testFailure(), false},
+		{"pod wait failed", testFailure(""), false},
+		{"checkout failed", testFailure("repo_update"), false},
+		{"install and tests failed", testFailure("dependencies", "test_execution"), false},
+		{"error", map[string]interface{}{"status": "error"}, false},
+		{"cancelled", map[string]interface{}{"status": "cancelled"}, false},
+	}
+	for _, tt := range tests {
+		if got := Cacheable(tt.result); got != tt.want {
+			t.Errorf("%s: Cacheable = %v, want %v", tt.name, got, tt.want)
+		}
+	}
+}
+
+func TestResultCacheStoresOnlyCacheableResults(t *testing.T) {
+	cache := newTestCache(t)
+	run := func(key string, result map[string]interface{}) {
+		cache.Do(context.Background(), key, false, func() (map[string]interface{}, error) { return result, nil })
+	}
+	run("pass", map[string]interface{}{"status": "passed"})
+	run("fail", testFailure("test_execution"))
+	run("infra", testFailure(""))
+	run("incremental", map[string]interface{}{
+		"status":    "passed",
+		"selection": map[string]interface{}{"mode": "incremental"},
+	})
+
+	for key, want := range map[string]bool{"pass": true, "fail": true, "infra": false, "incremental": false} {
+		if got := cache.Lookup(key) != nil; got != want {
+			t.Errorf("Lookup(%q) cached = %v, want %v", key, got, want)
+		}
+	}
+	if cached := cache.Lookup("pass"); cached["cached"] != true {
+		t.Error("a hit should be marked cached")
+	}
+}
+
+func TestResultCacheSurvivesRestart(t *testing.T) {
+	dir := t.TempDir()
+	first := NewResultCache(dir, time.Hour, 10, 1<<20)
+	first.Do(context.Background(), "key", false, func() (map[string]interface{}, error) {
+		return map[string]interface{}{"status": "passed"}, nil
+	})
+
+	second := NewResultCache(dir, time.Hour, 10, 1<<20)
+	if second.Lookup("key") == nil {
+		t.Error("disk tier lost the entry")
+	}
+	expired := NewResultCache(dir, 0, 10, 1<<20)
+	if expired.Lookup("key") != nil {
+		t.Error("expired entry was served")
+	}
+}
+
+func TestResultCacheEvictsLeastRecentlyUsed(t *testing.T) {
+	cache := NewResultCache("", time.Hour, 2, 0)
+	for _, key := range []string{"a", "b"} {
+		cache.put(key, map[string]interface{}{"status": "passed"})
+	}
+	cache.Lookup("a")
+	cache.put("c", map[string]interface{}{"status": "passed"})
+
+	if cache.Lookup("a") == nil || cache.Lookup("c") == nil {
+		t.Error("recently used entries were evicted")
+	}
+	if cache.Lookup("b") != nil {
+		t.Error("least recently used entry was kept")
+	}
+}
+
+func TestResultCacheSharesInFlightRuns(t *testing.T) {
+	cache := newTestCache(t)
+	release := make(chan struct{})
+	var runs int32
+	fn := func() (map[string]interface{}, error) {
+		atomic.AddInt32(&runs, 1)
+		<-release
+		return map[string]interface{}{"status": "passed"}, nil
+	}
+
+	var wg sync.WaitGroup
+	hits := make([]bool, 5)
+	for i := range hits {
+		wg.Add(1)
+		go func(i int) {
+			defer wg.Done()
+			_, hits[i], _ = cache.Do(context.Background(), "key", false, fn)
+		}(i)
+	}
+	time.Sleep(50 * time.Millisecond)
+	close(release)
+	wg.Wait()
+
+	if runs != 1 {
+		t.Errorf("fn ran %d times, want 1", runs)
+	}
+	shared := 0
+	for _, hit := range hits {
+		if hit {
+			shared++
+		}
+	}
+	if shared != len(hits)-1 {
+		t.Errorf("%d callers shared the run, want %d", shared, len(hits)-1)
+	}
+}
+
+func TestResultCacheWaiterRetriesAfterCancelledRun(t *testing.T) {
+	cache := newTestCache(t)
+	started := make(chan struct{})
+	release := make(chan struct{})
+	go cache.Do(context.Background(), "key", false, func() (map[string]interface{}, error) {
+		close(started)
+		<-release
+		return nil, context.Canceled
+	})
+	<-started
+
+	done := make(chan bool)
+	go func() {
+		_, hit, err := cache.Do(context.Background(), "key", false, func() (map[string]interface{}, error) {
+			return map[string]interface{}{"status": "passed"}, nil
+		})
+		done <- !hit && err == nil
+	}()
+	close(release)
+	if !<-done {
+		t.Error("waiter did not run the tests itself after the shared run was cancelled")
+	}
+}
+
+func TestResultCacheWaiterStopsOnItsOwnCancel(t *testing.T) {
+	cache := newTestCache(t)
+	release := make(chan struct{})
+	defer close(release)
+	started := make(chan struct{})
+	go cache.Do(context.Background(), "key", false, func() (map[string]interface{}, error) {
+		close(started)
+		<-release
+		return nil, nil
+	})
+	<-started
+
+	ctx, cancel := context.WithCancel(context.Background())
+	cancel()
+	if _, _, err := cache.Do(ctx, "key", false, nil); !errors.Is(err, context.Canceled) {
+		t.Errorf("err = %v, want context.Canceled", err)
+	}
+}
+
+// slowRunner is a stand-in test-runner.py that passes after a pause, with an
+// incremental selection when asked for one.
+const slowRunner = `import json, sys, time
+time.sleep(0.3)
+result = {"status": "passed", "output": {"kubectl_errors": []}}
+if "--incremental" in sys.argv:
+    result["selection"] = {"mode": "incremental"}
+print(json.dumps({"result": result}))
+`
+
+func TestFullRequestDoesNotShareAnIncrementalRun(t *testing.T) {
+	script := filepath.Join(t.TempDir(), "runner.py")
+	if err := os.WriteFile(script, []byte(slowRunner), 0o644); err != nil {
+		t.Fatal(err)
+	}
+	service := &TestService{ScriptPath: script, Cache: newTestCache(t)}
+	req := TestRequest{RepoURL: "https://example.com/r.git", Commit: testSHA}
+
+	incremental := req
+	incremental.Incremental = true
+	done := make(chan map[string]interface{})
+	go func() {
+		result, _ := service.RunTests(context.Background(), incremental, nil)
+		done <- result
+	}()
+	time.Sleep(100 * time.Millisecond)
+
+	full, err := service.RunTests(context.Background(), req, nil)
+	if err != nil {
+		t.Fatal(err)
+	}
+	if full["selection"] != nil || full["cached"] == true {
+		t.Errorf("full request got %v", full)
+	}
+	if partial := <-done; partial["selection"] == nil {
+		t.Errorf("incremental request got %v", partial)
+	}
+	// The full result now answers incremental requests too
+	if result, _ := service.RunTests(context.Background(), incremental, nil); result["cached"] != true {
+		t.Error("incremental request did not reuse the full result")
+	}
+}
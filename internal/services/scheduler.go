@@ -0,0 +1,242 @@
+package services
+
+import (
+	"context"
+	"errors"
+	"fmt"
+	"sort"
+	"strconv"
+	"strings"
+	"sync"
+	"time"
+	"websocket-git/internal/metrics"
+)
+
+// ErrBusy is returned, wrapped with the reason, when a run is refused
+// because the scheduler's queues are full.
+var ErrBusy = errors.New("server busy")
+
+// Scheduler admits test runs under a global concurrency cap and optional
+// per-project-type limits. Runs that cannot start yet wait in a FIFO queue
+// per user; a freed slot goes to the waiting user with the fewest runs in
+// progress, so one user's burst of requests cannot starve everyone else.
+type Scheduler struct {
+	// MaxRunning caps concurrent runs across all users
+	MaxRunning int
+	// ProjectLimits caps concurrent runs per project type; types not listed
+	// are only bound by MaxRunning
+	ProjectLimits map[string]int
+	// MaxQueuedPerUser and MaxQueued bound the waiting runs per user and in
+	// total; further requests fail with ErrBusy. Zero means unbounded.
+	MaxQueuedPerUser int
+	MaxQueued        int
+
+	mu               sync.Mutex
+	running          int
+	runningByUser    map[string]int
+	runningByProject map[string]int
+	queues           map[string][]*ticket
+	waiting          int
+	seq              uint64
+}
+
+type ticket struct {
+	user        string
+	projectType string
+	seq         uint64
+	position    int
+	ready       chan struct{}
+	onQueued    func(position int)
+}
+
+type queueNotice struct {
+	onQueued func(position int)
+	position int
+}
+
+func NewScheduler(maxRunning int) *Scheduler {
+	return &Scheduler{
+		MaxRunning:       maxRunning,
+		ProjectLimits:    make(map[string]int),
+		runningByUser:    make(map[string]int),
+		runningByProject: make(map[string]int),
+		queues:           make(map[string][]*ticket),
+	}
+}
+
+// ParseLimits reads "python=4,node=2" into per-project limits.
+func ParseLimits(spec string) (map[string]int, error) {
+	limits := make(map[string]int)
+	for _, entry := range strings.Split(spec, ",") {
+		entry = strings.TrimSpace(entry)
+		if entry == "" {
+			continue
+		}
+		name, value, ok := strings.Cut(entry, "=")
+		limit, err := strconv.Atoi(strings.TrimSpace(value))
+		if !ok || err != nil || limit < 1 {
+			return nil, fmt.Errorf("invalid limit %q", entry)
+		}
+		limits[strings.TrimSpace(name)] = limit
+	}
+	return limits, nil
+}
+
+// Acquire blocks until the run may start and returns the function that
+// frees its slot. While the run waits, onQueued (which may be nil) is
+// called with its estimated 1-based queue position whenever it changes.
+// Cancelling ctx takes the run out of the queue.
+func (s *Scheduler) Acquire(ctx context.Context, user, projectType string, onQueued func(position int)) (func(), error) {
+	start := time.Now()
+	s.mu.Lock()
+	if s.MaxQueuedPerUser > 0 && len(s.queues[user]) >= s.MaxQueuedPerUser {
+		s.mu.Unlock()
+		return nil, fmt.Errorf("%w: %d runs already queued for this user", ErrBusy, s.MaxQueuedPerUser)
+	}
+	if s.MaxQueued > 0 && s.waiting >= s.MaxQueued {
+		s.mu.Unlock()
+		return nil, fmt.Errorf("%w: %d runs already queued", ErrBusy, s.MaxQueued)
+	}
+
+	s.seq++
+	t := &ticket{user: user, projectType: projectType, seq: s.seq, ready: make(chan struct{}), onQueued: onQueued}
+	s.queues[user] = append(s.queues[user], t)
+	s.waiting++
+	notices := s.dispatch()
+	s.mu.Unlock()
+	notify(notices)
+
+	var once sync.Once
+	release := func() { once.Do(func() { s.release(t) }) }
+	select {
+	case <-t.ready:
+	case <-ctx.Done():
+		if !s.withdraw(t) {
+			// Dispatched while we were giving up
+			release()
+		}
+		return nil, ctx.Err()
+	}
+	metrics.PhaseDuration.Observe(time.Since(start).Seconds(), "queue", metrics.ProjectType(projectType))
+	return release, nil
+}
+
+// withdraw removes a waiting ticket from its queue, reporting false if it
+// had already been dispatched.
+func (s *Scheduler) withdraw(t *ticket) bool {
+	s.mu.Lock()
+	queue := s.queues[t.user]
+	for i, queued := range queue {
+		if queued != t {
+			continue
+		}
+		queue = append(queue[:i], queue[i+1:]...)
+		if len(queue) == 0 {
+			delete(s.queues, t.user)
+		} else {
+			s.queues[t.user] = queue
+		}
+		s.waiting--
+		notices := s.dispatch()
+		s.mu.Unlock()
+		notify(notices)
+		return true
+	}
+	s.mu.Unlock()
+	return false
+}
+
+func (s *Scheduler) release(t *ticket) {
+	s.mu.Lock()
+	s.running--
+	s.runningByUser[t.user]--
+	if s.runningByUser[t.user] == 0 {
+		delete(s.runningByUser, t.user)
+	}
+	s.runningByProject[t.projectType]--
+	notices := s.dispatch()
+	s.mu.Unlock()
+	notify(notices)
+}
+
+// Stats reports the running and waiting run counts.
+func (s *Scheduler) Stats() (running, waiting int) {
+	s.mu.Lock()
+	defer s.mu.Unlock()
+	return s.running, s.waiting
+}
+
+// dispatch starts as many waiting runs as the limits allow and returns the
+// position updates for those still waiting; the caller holds s.mu and sends
+// the notices after unlocking, so a slow client cannot stall the scheduler.
+func (s *Scheduler) dispatch() []queueNotice {
+	for s.MaxRunning <= 0 || s.running < s.MaxRunning {
+		var best *ticket
+		bestIndex := 0
+		for _, queue := range s.queues {
+			// A user's first run whose project type has room
+			for i, t := range queue {
+				if limit, ok := s.ProjectLimits[t.projectType]; ok && s.runningByProject[t.projectType] >= limit {
+					continue
+				}
+				if best == nil || s.runningByUser[t.user] < s.runningByUser[best.user] ||
+					(s.runningByUser[t.user] == s.runningByUser[best.user] && t.seq < best.seq) {
+					best, bestIndex = t, i
+				}
+				break
+			}
+		}
+		if best == nil {
+			break
+		}
+
+		queue := s.queues[best.user]
+		queue = append(queue[:bestIndex], queue[bestIndex+1:]...)
+		if len(queue) == 0 {
+			delete(s.queues, best.user)
+		} else {
+			s.queues[best.user] = queue
+		}
+		s.waiting--
+		s.running++
+		s.runningByUser[best.user]++
+		s.runningByProject[best.projectType]++
+		close(best.ready)
+	}
+	metrics.QueueDepth.Set(float64(s.waiting), "scheduler")
+
+	// Estimate positions by round robin over users: everyone's first waiting
+	// run, then everyone's second, and so on, oldest first within a round.
+	type rank struct {
+		t     *ticket
+		round int
+	}
+	var ranks []rank
+	for _, queue := range s.queues {
+		for i, t := range queue {
+			ranks = append(ranks, rank{t, i})
+		}
+	}
+	sort.Slice(ranks, func(i, j int) bool {
+		if ranks[i].round != ranks[j].round {
+			return ranks[i].round < ranks[j].round
+		}
+		return ranks[i].t.seq < ranks[j].t.seq
+	})
+	var notices []queueNotice
+	for i, r := range ranks {
+		if r.t.position != i+1 {
+			r.t.position = i + 1
+			if r.t.onQueued != nil {
+				notices = append(notices, queueNotice{r.t.onQueued, i + 1})
+			}
+		}
+	}
+	return notices
+}
+
+func notify(notices []queueNotice) {
+	for _, n := range notices {
+		n.onQueued(n.position)
+	}
+}
@@ -0,0 +1,204 @@
+package services
+
+import (
+	"context"
+	"errors"
+	"reflect"
+	"sync"
+	"testing"
+	"time"
+)
+
+// queued starts an Acquire in the background and waits until it is queued;
+// the returned channel yields its release func once it is admitted.
+func queued(t *testing.T, s *Scheduler, ctx context.Context, user, projectType string) <-chan func() {
+	t.Helper()
+	admitted := make(chan func(), 1)
+	_, before := s.Stats()
+	go func() {
+		release, err := s.Acquire(ctx, user, projectType, nil)
+		if err == nil {
+			admitted <- release
+		}
+	}()
+	deadline := time.Now().Add(time.Second)
+	for {
+		if _, waiting := s.Stats(); waiting > before {
+			return admitted
+		}
+		if time.Now().After(deadline) {
+			t.Fatalf("%s's run never queued", user)
+		}
+		time.Sleep(time.Millisecond)
+	}
+}
+
+func mustAcquire(t *testing.T, s *Scheduler, user, projectType string) func() {
+	t.Helper()
+	release, err := s.Acquire(context.Background(), user, projectType, nil)
+	if err != nil {
+		t.Fatalf("Acquire(%s): %v", user, err)
+	}
+	return release
+}
+
+func admittedWithin(ch <-chan func()) func() {
+	select {
+	case release := <-ch:
+		return release
+	case <-time.After(100 * time.Millisecond):
+		return nil
+	}
+}
+
+func TestSchedulerServesTheLeastBusyUserFirst(t *testing.T) {
+	s := NewScheduler(2)
+	mustAcquire(t, s, "alice", "fastapi")
+	carol := mustAcquire(t, s, "carol", "fastapi")
+	alice := queued(t, s, context.Background(), "alice", "fastapi")
+	bob := queued(t, s, context.Background(), "bob", "fastapi")
+
+	// Bob queued last but has nothing running, while Alice still has a run
+	carol()
+	next := admittedWithin(bob)
+	if next == nil {
+		t.Fatal("bob was not admitted ahead of alice's second run")
+	}
+	if admittedWithin(alice) != nil {
+		t.Fatal("alice's queued run started while both slots were taken")
+	}
+	next()
+	if admittedWithin(alice) == nil {
+		t.Fatal("alice's queued run was not admitted once a slot freed")
+	}
+}
+
+func TestSchedulerKeepsEachUsersOrder(t *testing.T) {
+	s := NewScheduler(1)
+	release := mustAcquire(t, s, "alice", "fastapi")
+	first := queued(t, s, context.Background(), "alice", "fastapi")
+	second := queued(t, s, context.Background(), "alice", "fastapi")
+
+	release()
+	next := admittedWithin(first)
+	if next == nil {
+		t.Fatal("alice's oldest queued run was not admitted first")
+	}
+	if admittedWithin(second) != nil {
+		t.Fatal("alice's newer run started out of order")
+	}
+	next()
+	if admittedWithin(second) == nil {
+		t.Fatal("alice's second run was not admitted")
+	}
+}
+
+func TestSchedulerProjectLimits(t *testing.T) {
+	s := NewScheduler(4)
+	s.ProjectLimits = map[string]int{"django": 1}
+	release := mustAcquire(t, s, "alice", "django")
+	blocked := queued(t, s, context.Background(), "bob", "django")
+	// Other project types still have room
+	mustAcquire(t, s, "bob", "fastapi")
+
+	if admittedWithin(blocked) != nil {
+		t.Fatal("project limit was exceeded")
+	}
+	release()
+	if admittedWithin(blocked) == nil {
+		t.Fatal("queued run was not admitted after the project slot freed")
+	}
+}
+
+func TestSchedulerBackpressure(t *testing.T) {
+	s := NewScheduler(1)
+	s.MaxQueuedPerUser = 1
+	s.MaxQueued = 2
+	mustAcquire(t, s, "alice", "fastapi")
+	queued(t, s, context.Background(), "alice", "fastapi")
+
+	if _, err := s.Acquire(context.Background(), "alice", "fastapi", nil); !errors.Is(err, ErrBusy) {
+		t.Errorf("per-user limit: err = %v, want ErrBusy", err)
+	}
+	queued(t, s, context.Background(), "bob", "fastapi")
+	if _, err := s.Acquire(context.Background(), "carol", "fastapi", nil); !errors.Is(err, ErrBusy) {
+		t.Errorf("global limit: err = %v, want ErrBusy", err)
+	}
+}
+
+func TestSchedulerCancelLeavesTheQueue(t *testing.T) {
+	s := NewScheduler(1)
+	release := mustAcquire(t, s, "alice", "fastapi")
+	ctx, cancel := context.WithCancel(context.Background())
+	cancelled := queued(t, s, ctx, "bob", "fastapi")
+	waiting := queued(t, s, context.Background(), "carol", "fastapi")
+
+	cancel()
+	deadline := time.Now().Add(time.Second)
+	for _, n := s.Stats(); n != 1; _, n = s.Stats() {
+		if time.Now().After(deadline) {
+			t.Fatalf("cancelled run still queued: %d waiting", n)
+		}
+		time.Sleep(time.Millisecond)
+	}
+	release()
+	if admittedWithin(waiting) == nil {
+		t.Fatal("run behind the cancelled one was not admitted")
+	}
+	if admittedWithin(cancelled) != nil {
+		t.Fatal("cancelled run was admitted")
+	}
+}
+
+func TestSchedulerReportsQueuePositions(t *testing.T) {
+	s := NewScheduler(1)
+	release := mustAcquire(t, s, "alice", "fastapi")
+	var mu sync.Mutex
+	positions := make(map[string]int)
+	enqueue := func(name, user string) {
+		_, before := s.Stats()
+		go s.Acquire(context.Background(), user, "fastapi", func(p int) {
+			mu.Lock()
+			positions[name] = p
+			mu.Unlock()
+		})
+		for _, waiting := s.Stats(); waiting == before; _, waiting = s.Stats() {
+			time.Sleep(time.Millisecond)
+		}
+	}
+	enqueue("alice1", "alice")
+	enqueue("alice2", "alice")
+	enqueue("bob1", "bob")
+
+	// Round robin: every user's first waiting run, then every second one
+	mu.Lock()
+	got := map[string]int{"alice1": positions["alice1"], "alice2": positions["alice2"], "bob1": positions["bob1"]}
+	mu.Unlock()
+	if want := map[string]int{"alice1": 1, "bob1": 2, "alice2": 3}; !reflect.DeepEqual(got, want) {
+		t.Errorf("positions = %v, want %v", got, want)
+	}
+
+	// Once alice1 starts, the two left move up
+	release()
+	time.Sleep(20 * time.Millisecond)
+	mu.Lock()
+	defer mu.Unlock()
+	if positions["alice2"]+positions["bob1"] != 3 {
+		t.Errorf("positions after a run started = %v, want 1 and 2 for alice2 and bob1", positions)
+	}
+}
+
+func TestParseLimits(t *testing.T) {
+	limits, err := ParseLimits(" fastapi=4, django=1 ,")
+	if err != nil {
+		t.Fatal(err)
+	}
+	if want := map[string]int{"fastapi": 4, "django": 1}; !reflect.DeepEqual(limits, want) {
+		t.Errorf("limits = %v, want %v", limits, want)
+	}
+	for _, spec := range []string{"fastapi", "fastapi=0", "fastapi=x"} {
+		if _, err := ParseLimits(spec); err == nil {
+			t.Errorf("ParseLimits(%q) accepted an invalid limit", spec)
+		}
+	}
+}
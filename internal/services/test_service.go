@@ -1,46 +1,307 @@
 package services
 
 import (
+	"bufio"
+	"context"
+	"crypto/rand"
+	"encoding/hex"
 	"encoding/json"
+	"errors"
 	"fmt"
 	"log"
+	"os"
 	"os/exec"
 	"path/filepath"
+	"strings"
+	"time"
+	"websocket-git/internal/metrics"
 )
 
 type TestService struct {
 	ScriptPath string
+	Pool       *WorkerPool
+	// Cache memoizes results of full-SHA runs; nil disables it
+	Cache *ResultCache
+	// Scheduler queues runs fairly across users; nil runs everything at once
+	Scheduler *Scheduler
 }
 
-func NewTestService() *TestService {
+// NewTestService runs requests through pool when it is non-nil and falls
+// back to forking the script per request otherwise.
+func NewTestService(pool *WorkerPool) *TestService {
 	return &TestService{
 		ScriptPath: filepath.Join("scripts", "test-runner.py"),
+		Pool:       pool,
 	}
 }
 
-func (s *TestService) RunTests(namespace, repoURL, commit, testCmd string) (map[string]interface{}, error) {
+// TestRequest describes one commit's test run.
+type TestRequest struct {
+	Namespace   string
+	RepoURL     string
+	Commit      string
+	TestCmd     string
+	ProjectType string
+	// Pod pins the run to one test pod; empty means the first ready one
+	Pod string
+	// PodReady means Pod was just seen Ready, so the runner skips its wait
+	PodReady bool
+	// Pods, when more than one, splits the pytest suite into one shard per
+	// pod and merges the results; Pod is then ignored
+	Pods []string
+	// Incremental skips the pytest tests the commit's diff from the last
+	// fully tested commit cannot affect
+	Incremental bool
+	// NoCache forces a rerun even when a cached result exists
+	NoCache bool
+	// RunID names the run's output artifacts; empty means generate one
+	RunID string
+	// UserID is who the Scheduler queues the run for
+	UserID string
+}
+
+// NewRunID returns a random ID that follows a run through the handler, the
+// runner scripts, their logs and the run's output artifacts.
+func NewRunID() string {
+	buf := make([]byte, 8)
+	rand.Read(buf)
+	return hex.EncodeToString(buf)
+}
+
+// RunTests executes one commit's tests, forwarding step and output events
+// to onEvent (which may be nil) while the run is in progress. Results of
+// identical earlier or concurrent runs are served from Cache when set.
+// Cancelling ctx stops the run, in the pod too: a run that had started
+// returns its partial result with status "cancelled", one still waiting
+// returns ctx's error.
+func (s *TestService) RunTests(ctx context.Context, req TestRequest, onEvent EventFunc) (map[string]interface{}, error) {
+	key := ""
+	if s.Cache != nil {
+		key = CacheKey(req.RepoURL, req.Commit, req.TestCmd, req.ProjectType)
+	}
+	if key == "" {
+		return s.runTests(ctx, req, onEvent)
+	}
+	if req.Incremental {
+		return s.runIncremental(ctx, key, req, onEvent)
+	}
+
+	start := time.Now()
+	result, cached, err := s.Cache.Do(ctx, key, req.NoCache, func() (map[string]interface{}, error) {
+		return s.runTests(ctx, req, onEvent)
+	})
+	if cached {
+		metrics.ResultCacheHits.Inc()
+		log.Printf("Serving cached result for %s@%s in %v", req.RepoURL, req.Commit, time.Since(start))
+	}
+	return result, err
+}
+
+// runIncremental serves an incremental request from an earlier full result
+// when there is one. Its own run may skip tests, so it is never shared with
+// concurrent requests; the cache keeps it only if it ran in full.
+func (s *TestService) runIncremental(ctx context.Context, key string, req TestRequest, onEvent EventFunc) (map[string]interface{}, error) {
+	if !req.NoCache {
+		if result := s.Cache.Lookup(key); result != nil {
+			metrics.ResultCacheHits.Inc()
+			log.Printf("Serving cached result for %s@%s", req.RepoURL, req.Commit)
+			return result, nil
+		}
+	}
+	result, err := s.runTests(ctx, req, onEvent)
+	if err == nil {
+		s.Cache.put(key, result)
+	}
+	return result, err
+}
+
+// CachedResult returns the cached result of an identical earlier run of req,
+// or nil when there is none or req asks for a fresh run. It lets callers
+// skip setting up a namespace for a run that will not happen.
+func (s *TestService) CachedResult(req TestRequest) map[string]interface{} {
+	if s.Cache == nil || req.NoCache {
+		return nil
+	}
+	key := CacheKey(req.RepoURL, req.Commit, req.TestCmd, req.ProjectType)
+	if key == "" {
+		return nil
+	}
+	result := s.Cache.Lookup(key)
+	if result != nil {
+		metrics.ResultCacheHits.Inc()
+		log.Printf("Serving cached result for %s@%s before namespace setup", req.RepoURL, req.Commit)
+	}
+	return result
+}
+
+// phaseOf groups runner step ids into the phases reported by /metrics
+var phaseOf = map[string]string{
+	"setup":           "pod_ready",
+	"pod_ready":       "pod_ready",
+	"setup_complete":  "pod_ready",
+	"mirror_sync":     "git",
+	"repo_check":      "git",
+	"repo_update":     "git",
+	"repo_clone":      "git",
+	"commit_checkout": "git",
+	"commit_verified": "git",
+	"dependencies":    "install",
+	"test_execution":  "test",
+}
+
+// recordRun reports a finished run's outcome and per-phase durations
+func recordRun(req TestRequest, result map[string]interface{}, err error, elapsed time.Duration) {
+	projectType := metrics.ProjectType(req.ProjectType)
+	if err != nil {
+		metrics.SubprocessFailures.Inc("runner")
+		metrics.RunsTotal.Inc(projectType, "error")
+		return
+	}
+
+	status, _ := result["status"].(string)
+	metrics.RunsTotal.Inc(projectType, status)
+	metrics.PhaseDuration.Observe(elapsed.Seconds(), "total", projectType)
+
+	phases := make(map[string]float64)
+	timings, _ := result["timings"].(map[string]interface{})
+	for step, ms := range timings {
+		if value, ok := ms.(float64); ok && phaseOf[step] != "" {
+			phases[phaseOf[step]] += value / 1000
+		}
+	}
+	for phase, seconds := range phases {
+		metrics.PhaseDuration.Observe(seconds, phase, projectType)
+	}
+
+	// Failing tests are reported too; only count infrastructure failures
+	output, _ := result["output"].(map[string]interface{})
+	kubectlErrors, _ := output["kubectl_errors"].([]interface{})
+	for _, entry := range kubectlErrors {
+		if e, ok := entry.(map[string]interface{}); !ok || e["step"] != "test_execution" {
+			metrics.SubprocessFailures.Inc("kubectl")
+		}
+	}
+}
+
+func (s *TestService) runTests(ctx context.Context, req TestRequest, onEvent EventFunc) (map[string]interface{}, error) {
+	if err := ctx.Err(); err != nil {
+		return nil, err
+	}
+	if req.RunID == "" {
+		req.RunID = NewRunID()
+	}
+	if s.Scheduler != nil {
+		release, err := s.Scheduler.Acquire(ctx, req.UserID, req.ProjectType, func(position int) {
+			if onEvent != nil {
+				onEvent(map[string]interface{}{"type": "queued", "position": position, "run_id": req.RunID})
+			}
+		})
+		if errors.Is(err, ErrBusy) {
+			log.Printf("Rejected test run %s for user %s: %v", req.RunID, req.UserID, err)
+		}
+		if err != nil {
+			return nil, err
+		}
+		defer release()
+	}
+	metrics.RunsInFlight.Add(1)
+	defer metrics.RunsInFlight.Add(-1)
+	start := time.Now()
+	result, err := s.execute(ctx, req, onEvent)
+	recordRun(req, result, err, time.Since(start))
+	return result, err
+}
+
+func (s *TestService) execute(ctx context.Context, req TestRequest, onEvent EventFunc) (map[string]interface{}, error) {
+	if s.Pool != nil {
+		log.Printf("Dispatching test run %s to worker: namespace=%s commit=%s pod=%s", req.RunID, req.Namespace, req.Commit, req.Pod)
+		return s.Pool.CallStream(ctx, "test", map[string]interface{}{
+			"namespace":    req.Namespace,
+			"repo_url":     req.RepoURL,
+			"commit":       req.Commit,
+			"test_cmd":     req.TestCmd,
+			"pod":          req.Pod,
+			"pod_ready":    req.PodReady,
+			"pods":         req.Pods,
+			"incremental":  req.Incremental,
+			"run_id":       req.RunID,
+			"project_type": req.ProjectType,
+		}, onEvent)
+	}
+
 	cmdArgs := []string{
 		s.ScriptPath,
-		"-n", namespace,
-		"-r", repoURL,
-		"-c", commit,
+		"-n", req.Namespace,
+		"-r", req.RepoURL,
+		"-c", req.Commit,
+		"--run-id", req.RunID,
+		"--stream",
 	}
 
-	if testCmd != "" {
-		cmdArgs = append(cmdArgs, "-t", testCmd)
+	if req.TestCmd != "" {
+		cmdArgs = append(cmdArgs, "-t", req.TestCmd)
+	}
+	if req.Pod != "" {
+		cmdArgs = append(cmdArgs, "--pod", req.Pod)
+	}
+	if req.PodReady {
+		cmdArgs = append(cmdArgs, "--pod-ready")
+	}
+	if len(req.Pods) > 1 {
+		cmdArgs = append(cmdArgs, "--pods", strings.Join(req.Pods, ","))
+	}
+	if req.Incremental {
+		cmdArgs = append(cmdArgs, "--incremental")
+	}
+	if req.ProjectType != "" {
+		cmdArgs = append(cmdArgs, "-p", req.ProjectType)
 	}
 
-	log.Printf("Executing test command: %v", cmdArgs)
+	log.Printf("Executing test run %s: %v", req.RunID, cmdArgs)
 	cmd := exec.Command("python3", cmdArgs...)
-	output, err := cmd.CombinedOutput()
+	cmd.Stderr = os.Stderr
+	setProcessGroup(cmd)
+	stdout, err := cmd.StdoutPipe()
 	if err != nil {
-		log.Printf("Test execution failed. Raw output:\n%s", string(output))
 		return nil, fmt.Errorf("test runner error: %w", err)
 	}
+	if err := cmd.Start(); err != nil {
+		return nil, fmt.Errorf("test runner error: %w", err)
+	}
+	stopWatch := watchCancel(ctx, cmd)
+	defer stopWatch()
 
+	// The runner prints {"event": ...} lines while it works and a final {"result": ...}
 	var result map[string]interface{}
-	if err := json.Unmarshal(output, &result); err != nil {
-		return nil, fmt.Errorf("failed to parse test results: %w", err)
+	reader := bufio.NewReaderSize(stdout, 64*1024)
+	for {
+		line, readErr := reader.ReadBytes('\n')
+		if len(line) > 0 {
+			var msg struct {
+				Event  map[string]interface{} `json:"event"`
+				Result map[string]interface{} `json:"result"`
+			}
+			if err := json.Unmarshal(line, &msg); err != nil {
+				log.Printf("Ignoring unparseable test runner line: %q", line)
+			} else if msg.Event != nil && onEvent != nil {
+				onEvent(msg.Event)
+			} else if msg.Result != nil {
+				result = msg.Result
+			}
+		}
+		if readErr != nil {
+			break
+		}
+	}
+
+	if err := cmd.Wait(); err != nil {
+		if ctx.Err() != nil {
+			return nil, ctx.Err()
+		}
+		return nil, fmt.Errorf("test runner error: %w", err)
+	}
+	if result == nil {
+		return nil, fmt.Errorf("failed to parse test results: no result received")
 	}
 
 	return result, nil
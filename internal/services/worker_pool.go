@@ -0,0 +1,208 @@
+package services
+
+import (
+	"bufio"
+	"context"
+	"encoding/json"
+	"fmt"
+	"io"
+	"log"
+	"os"
+	"os/exec"
+	"path/filepath"
+	"sync/atomic"
+	"websocket-git/internal/metrics"
+)
+
+// WorkerPool keeps long-lived scripts/worker.py processes and talks to them
+// over stdin/stdout JSON lines, so a request costs a pipe round trip instead
+// of a python3 startup plus a fresh kubectl connection.
+type WorkerPool struct {
+	ScriptPath string
+	// Name labels the pool's im_queue_depth series
+	Name   string
+	idle   chan *runnerWorker
+	nextID uint64
+}
+
+type runnerWorker struct {
+	cmd    *exec.Cmd
+	stdin  io.WriteCloser
+	stdout *bufio.Reader
+}
+
+type workerRequest struct {
+	ID     uint64                 `json:"id"`
+	Action string                 `json:"action"`
+	Args   map[string]interface{} `json:"args"`
+}
+
+type workerResponse struct {
+	ID     uint64                 `json:"id"`
+	Result map[string]interface{} `json:"result"`
+	Event  map[string]interface{} `json:"event"`
+	Error  string                 `json:"error"`
+}
+
+// EventFunc receives progress events streamed while a request runs.
+type EventFunc func(event map[string]interface{})
+
+func NewWorkerPool(size int) *WorkerPool {
+	if size < 1 {
+		size = 1
+	}
+	p := &WorkerPool{
+		ScriptPath: filepath.Join("scripts", "worker.py"),
+		Name:       "worker_pool",
+		idle:       make(chan *runnerWorker, size),
+	}
+	// Workers are started lazily; a nil slot means "spawn on first use"
+	for i := 0; i < size; i++ {
+		p.idle <- nil
+	}
+	return p
+}
+
+func (p *WorkerPool) spawn(extraArgs ...string) (*runnerWorker, error) {
+	cmd := exec.Command("python3", append([]string{p.ScriptPath}, extraArgs...)...)
+	cmd.Stderr = os.Stderr
+	setProcessGroup(cmd)
+	stdin, err := cmd.StdinPipe()
+	if err != nil {
+		return nil, err
+	}
+	stdout, err := cmd.StdoutPipe()
+	if err != nil {
+		return nil, err
+	}
+	if err := cmd.Start(); err != nil {
+		return nil, fmt.Errorf("failed to start worker: %w", err)
+	}
+	log.Printf("Started runner worker pid %d", cmd.Process.Pid)
+	return &runnerWorker{cmd: cmd, stdin: stdin, stdout: bufio.NewReaderSize(stdout, 64*1024)}, nil
+}
+
+func (w *runnerWorker) kill() {
+	w.stdin.Close()
+	w.cmd.Process.Kill()
+	w.cmd.Wait()
+}
+
+// Call sends one action to an idle worker and waits for its result.
+func (p *WorkerPool) Call(action string, args map[string]interface{}) (map[string]interface{}, error) {
+	return p.CallStream(context.Background(), action, args, nil)
+}
+
+// CallStream is Call with progress events forwarded to onEvent as they arrive.
+// Cancelling ctx sends the worker SIGTERM, which cancels a test run in
+// progress; the worker then answers with the run's "cancelled" result.
+func (p *WorkerPool) CallStream(ctx context.Context, action string, args map[string]interface{}, onEvent EventFunc) (map[string]interface{}, error) {
+	var w *runnerWorker
+	metrics.QueueDepth.Add(1, p.Name)
+	select {
+	case w = <-p.idle:
+		metrics.QueueDepth.Add(-1, p.Name)
+	case <-ctx.Done():
+		metrics.QueueDepth.Add(-1, p.Name)
+		return nil, ctx.Err()
+	}
+	if w == nil {
+		var err error
+		if w, err = p.spawn(); err != nil {
+			metrics.SubprocessFailures.Inc("worker")
+			p.idle <- nil
+			return nil, err
+		}
+	}
+
+	stopWatch := watchCancel(ctx, w.cmd)
+	resp, err := w.roundTrip(workerRequest{
+		ID:     atomic.AddUint64(&p.nextID, 1),
+		Action: action,
+		Args:   args,
+	}, onEvent)
+	stopWatch()
+	if err != nil {
+		// The worker's stream is in an unknown state; replace it next time
+		w.kill()
+		p.idle <- nil
+		if ctx.Err() != nil {
+			log.Printf("Runner worker pid %d killed after cancellation", w.cmd.Process.Pid)
+			return nil, ctx.Err()
+		}
+		log.Printf("Runner worker pid %d failed: %v", w.cmd.Process.Pid, err)
+		metrics.SubprocessFailures.Inc("worker")
+		return nil, fmt.Errorf("worker error: %w", err)
+	}
+	p.idle <- w
+
+	if resp.Error != "" {
+		return nil, fmt.Errorf("worker %s failed: %s", action, resp.Error)
+	}
+	return resp.Result, nil
+}
+
+func (w *runnerWorker) roundTrip(req workerRequest, onEvent EventFunc) (*workerResponse, error) {
+	line, err := json.Marshal(req)
+	if err != nil {
+		return nil, err
+	}
+	if _, err := w.stdin.Write(append(line, '\n')); err != nil {
+		return nil, err
+	}
+
+	for {
+		raw, err := w.stdout.ReadBytes('\n')
+		if err != nil {
+			return nil, err
+		}
+		var resp workerResponse
+		if err := json.Unmarshal(raw, &resp); err != nil {
+			return nil, fmt.Errorf("invalid worker response: %w", err)
+		}
+		if resp.ID != req.ID {
+			continue
+		}
+		if resp.Event != nil {
+			if onEvent != nil {
+				onEvent(resp.Event)
+			}
+			continue
+		}
+		return &resp, nil
+	}
+}
+
+// CallWorker runs action on pool, or on a one-shot worker process when pool
+// is nil (RUNNER_WORKERS=0).
+func CallWorker(pool *WorkerPool, action string, args map[string]interface{}, onEvent EventFunc) (map[string]interface{}, error) {
+	if pool != nil {
+		return pool.CallStream(context.Background(), action, args, onEvent)
+	}
+
+	oneShot := &WorkerPool{ScriptPath: filepath.Join("scripts", "worker.py")}
+	w, err := oneShot.spawn("--no-proxy")
+	if err != nil {
+		return nil, err
+	}
+	defer w.kill()
+
+	resp, err := w.roundTrip(workerRequest{ID: 1, Action: action, Args: args}, onEvent)
+	if err != nil {
+		metrics.SubprocessFailures.Inc("worker")
+		return nil, fmt.Errorf("worker error: %w", err)
+	}
+	if resp.Error != "" {
+		return nil, fmt.Errorf("worker %s failed: %s", action, resp.Error)
+	}
+	return resp.Result, nil
+}
+
+// Close stops every running worker.
+func (p *WorkerPool) Close() {
+	for i := 0; i < cap(p.idle); i++ {
+		if w := <-p.idle; w != nil {
+			w.kill()
+		}
+	}
+}
@@ -1,9 +1,11 @@
 #!/usr/bin/env python3
+import argparse
 import json
 import time
 import signal
 import sys
 import os
+import threading
 from datetime import datetime
 from colorama import Fore, Style, init
 from websocket import WebSocketApp
@@ -21,6 +23,17 @@ class TestClient:
         self.project_type = config["project_type"]
         self.commits = config["commits"]
         self.test_command = config.get("test_command", "pytest tests/")
+        self.batch = config.get("batch", False)
+        self.parallelism = config.get("parallelism", 0)
+        self.no_cache = config.get("no_cache", False)
+        # Split each commit's test suite across this many pods
+        self.shards = config.get("shards", 0)
+        # Skip the tests each commit's diff from the last full run cannot affect
+        self.incremental = config.get("incremental", False)
+        # Send every commit at once and let each one supersede the previous
+        self.coalesce = config.get("coalesce", False)
+        # Find the first failing commit between the first (good) and last (bad) commit
+        self.bisect = config.get("bisect", False)
         self.results = []
         self.current_commit = None
         self.start_time = None
@@ -39,24 +52,74 @@ class TestClient:
         self.spinner_idx = (self.spinner_idx + 1) % len(self.spinner)
         return f"{Fore.CYAN}{self.spinner[self.spinner_idx]}"
 
+    def commit_message(self, commit):
+        return {
+            "userId": self.user_id,
+            "chatId": self.chat_id,
+            "repoURL": self.repo_url,
+            "commitHash": commit,
+            "projectType": self.project_type,
+            "testCommand": self.test_command or None,
+            "noCache": self.no_cache,
+            "coalesce": self.coalesce,
+            "shards": self.shards,
+            "incremental": self.incremental
+        }
+
     def send_next(self):
         if self.commits:
             self.current_commit = self.commits.pop(0)
             self.start_time = time.time()
-            msg = {
-                "userId": self.user_id,
-                "chatId": self.chat_id,
-                "repoURL": self.repo_url,
-                "commitHash": self.current_commit,
-                "projectType": self.project_type,
-                "testCommand": self.test_command or None
-            }
-            self.ws.send(json.dumps(msg))
+            self.ws.send(json.dumps(self.commit_message(self.current_commit)))
             print(f"{Fore.WHITE}📤 Sent: {Fore.YELLOW}{self.current_commit[:7]}")
 
+    def send_batch(self):
+        self.start_time = time.time()
+        msg = {
+            "type": "batch",
+            "userId": self.user_id,
+            "chatId": self.chat_id,
+            "repoURL": self.repo_url,
+            "commitHashes": self.commits,
+            "projectType": self.project_type,
+            "testCommand": self.test_command or None,
+            "parallelism": self.parallelism,
+            "noCache": self.no_cache
+        }
+        self.ws.send(json.dumps(msg))
+        print(f"{Fore.WHITE}📤 Sent batch: {Fore.YELLOW}{len(self.commits)} commits")
+        self.commits = []
+
+    def send_bisect(self):
+        self.start_time = time.time()
+        good, bad = self.commits[0], self.commits[-1]
+        msg = {
+            "type": "bisect",
+            "userId": self.user_id,
+            "chatId": self.chat_id,
+            "repoURL": self.repo_url,
+            "goodCommit": good,
+            "badCommit": bad,
+            "projectType": self.project_type,
+            "testCommand": self.test_command or None,
+            "parallelism": self.parallelism,
+            "noCache": self.no_cache
+        }
+        self.ws.send(json.dumps(msg))
+        print(f"{Fore.WHITE}📤 Sent bisect: {Fore.GREEN}{good[:7]}{Fore.WHITE}..{Fore.RED}{bad[:7]}")
+        self.commits = []
+
     def on_open(self, ws):
         print(f"{Fore.GREEN}✅ Connected to server")
-        self.send_next()
+        if self.bisect:
+            self.send_bisect()
+        elif self.batch:
+            self.send_batch()
+        elif self.coalesce:
+            while self.commits:
+                self.send_next()
+        else:
+            self.send_next()
 
     def on_message(self, ws, message):
         response_time = time.time() - self.start_time
@@ -64,6 +127,39 @@ class TestClient:
             response = json.loads(message)
             status = response.get("type", "unknown")
 
+            # Progress frames arrive while the run is still in progress
+            if status in ("step", "output", "queued"):
+                self.print_progress(response, response_time)
+                return
+
+            if status == "cancelled":
+                payload = response["payload"]
+                print(f"{Fore.YELLOW}⏭  {payload.get('commit', '')[:7]} cancelled: "
+                      f"{Style.RESET_ALL}{payload.get('reason', '')}")
+                self.results.append({"commit": payload.get("commit", self.current_commit),
+                                     "status": status, "time": response_time, "response": response})
+                self.send_next()
+                return
+
+            if status == "bisect_round":
+                payload = response["payload"]
+                print(f"\n{Fore.WHITE}─── Bisect round {payload['round']}: {payload['remaining']} candidates "
+                      f"between {payload['good'][:7]} and {payload['bad'][:7]}, testing "
+                      f"{', '.join(commit[:7] for commit in payload['testing'])}")
+                return
+            if status == "bisect_summary":
+                self.print_bisect(response["payload"], response_time)
+                return
+
+            if status in ("batch_result", "bisect_result"):
+                self.record_batch_result(response["payload"], response_time)
+                return
+            if status == "batch_summary":
+                print(f"\n{Fore.WHITE}─── Batch finished in {response_time:.2f}s "
+                      f"({response['payload'].get('passed', 0)} passed, "
+                      f"{response['payload'].get('failed', 0)} failed) {'─'*30}")
+                return
+
             # Store result
             self.results.append(
                 {
@@ -88,6 +184,49 @@ class TestClient:
             print(f"{Fore.RED}❌ Invalid JSON response")
             print(f"{Fore.WHITE}Raw message: {message}")
 
+    def record_batch_result(self, item, elapsed):
+        result = item.get("result") or {}
+        status = "test_results" if result.get("status") == "passed" else "error"
+        self.results.append(
+            {
+                "commit": item["commit"],
+                "status": status,
+                "time": result.get("duration", elapsed),
+                "response": {"test_results": result},
+            }
+        )
+        color = Fore.GREEN if status == "test_results" else Fore.RED
+        print(f"{color}● {item['commit'][:7]} on {item.get('pod', '?')}: "
+              f"{result.get('status', item.get('error', 'error'))} ({elapsed:.2f}s)")
+
+    def print_bisect(self, payload, elapsed):
+        bisect = payload.get("bisect") or {}
+        print(f"\n{Fore.WHITE}─── Bisect finished in {elapsed:.2f}s: {bisect.get('commits', 0)} commits, "
+              f"{bisect.get('rounds', 0)} rounds, {bisect.get('tested', 0)} runs, "
+              f"{bisect.get('reused', 0)} cached {'─'*20}")
+        if bisect.get("first_bad"):
+            print(f"{Fore.RED}✗ First bad commit: {Fore.YELLOW}{bisect['first_bad']} "
+                  f"{Fore.WHITE}(last good {bisect.get('good', '')[:7]})")
+            self.print_response({"type": "error", "payload": {"test_results": bisect.get("result")}})
+        else:
+            print(f"{Fore.YELLOW}⚠ Runs errored; the first bad commit is one of: "
+                  f"{', '.join(commit[:7] for commit in bisect.get('candidates', []))}")
+
+    def print_progress(self, response, elapsed):
+        payload = response.get("payload", {})
+        if response["type"] == "step":
+            print(f"{self.show_spinner()} {Fore.WHITE}[{elapsed:6.2f}s] "
+                  f"{Fore.YELLOW}{payload.get('step', '')}: {Style.RESET_ALL}{payload.get('description', '')}")
+            return
+        if response["type"] == "queued":
+            print(f"{self.show_spinner()} {Fore.WHITE}[{elapsed:6.2f}s] "
+                  f"{Fore.YELLOW}queued: {Style.RESET_ALL}position {payload.get('position')}")
+            return
+
+        color = Fore.RED if payload.get("stream") == "stderr" else Style.DIM
+        for line in payload.get("data", "").rstrip("\n").split("\n"):
+            print(f"{color}  │ {line}")
+
     def print_response(self, response):
         status_color = (
             Fore.GREEN if response.get("type") == "test_results" else Fore.RED
@@ -136,12 +275,30 @@ class TestClient:
                     f"{Fore.YELLOW}{result['time']:>5.2f}s")
             print(line)
             
+            # Single runs arrive as a frame with a payload, batch results without
+            response = result.get("response", {})
+            test_results = response.get("payload", response).get("test_results") or {}
+
             # Print commit message if available
-            if "commit_message" in result.get("response", {}).get("test_results", {}):
-                msg = result["response"]["test_results"]["commit_message"]
+            if "commit_message" in test_results:
+                msg = test_results["commit_message"]
                 truncated = (msg[:68] + '...') if len(msg) > 71 else msg.ljust(71)
                 print(f"{Fore.MAGENTA}│   {Fore.WHITE}📝 {truncated}")
 
+            selection = test_results.get("selection")
+            if selection:
+                skipped = len(selection.get("skipped", []))
+                print(f"{Fore.MAGENTA}│   {Fore.WHITE}🎯 {selection['mode']} run, {skipped} skipped: "
+                      f"{selection['reason'][:50]}")
+
+            # Per-test failures and slowdowns against the parent commit
+            for test in test_results.get("tests", []):
+                if test["outcome"] in ("failed", "error"):
+                    print(f"{Fore.MAGENTA}│   {Fore.RED}✗ {test['id'][:72]}")
+            for regression in test_results.get("regressions", []):
+                print(f"{Fore.MAGENTA}│   {Fore.YELLOW}🐢 {regression['id'][:50]} "
+                      f"{regression['parent_duration']:.2f}s → {regression['duration']:.2f}s")
+
         # Footer
         print(f"{Fore.MAGENTA}╰{'─'*78}╯")
         print(f"{Fore.YELLOW}✨ Test session completed - {total} runs in {total_time:.2f}s ✨")
@@ -166,7 +323,8 @@ class TestClient:
         self.print_summary()  # Only one call to print_summary
         sys.exit(0)
 
-    def load_config(self):
+    @staticmethod
+    def load_config():
         config_path = os.path.join(os.path.dirname(__file__), "..", "config.json")
         try:
             with open(config_path) as f:
@@ -180,6 +338,209 @@ class TestClient:
             sys.exit(1)
 
 
+# Benchmark phases as (name, start mark, end mark); marks are step ids plus
+# "sent" and "done". Phases whose marks never arrive (cached results) are skipped.
+PHASES = [
+    ("namespace", "sent", "setup"),
+    ("pod_ready", "setup", "setup_complete"),
+    ("checkout", "setup_complete", "dependencies"),
+    ("install", "dependencies", "test_execution"),
+    ("test", "test_execution", "done"),
+    ("total", "sent", "done"),
+]
+HISTOGRAM_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250]
+
+
+class BenchmarkClient(TestClient):
+    """One simulated chat: sends its commits back to back and times every phase"""
+
+    def __init__(self, config, index, commits, no_cache):
+        self._config = dict(config, commits=list(commits), no_cache=no_cache, batch=False,
+                            chat_id=f"{config['chat_id']}-bench{index}",
+                            user_id=f"{config['user_id']}-bench{index}")
+        super().__init__()
+        self.index = index
+        self.runs = []
+        self.marks = {}
+
+    def load_config(self):
+        return self._config
+
+    def send_next(self):
+        if not self.commits:
+            self.ws.close()
+            return
+        self.current_commit = self.commits.pop(0)
+        self.marks = {"sent": time.monotonic()}
+        self.ws.send(json.dumps(self.commit_message(self.current_commit)))
+
+    def on_open(self, ws):
+        self.send_next()
+
+    def on_message(self, ws, message):
+        now = time.monotonic()
+        response = json.loads(message)
+        kind = response.get("type")
+        if kind == "step":
+            # Retries repeat steps; the first occurrence starts the phase
+            self.marks.setdefault(response["payload"].get("step"), now)
+            return
+        if kind == "queued":
+            self.marks.setdefault("queued", now)
+            return
+        if kind in ("output", "batch_result"):
+            return
+
+        self.marks["done"] = now
+        test_results = response.get("payload", {}).get("test_results") or {}
+        phases = {}
+        for name, start, end in PHASES:
+            if start in self.marks and end in self.marks:
+                phases[name] = round(self.marks[end] - self.marks[start], 4)
+        self.runs.append({
+            "user": self.index,
+            "commit": self.current_commit,
+            "status": test_results.get("status", kind),
+            "cached": bool(test_results.get("cached")),
+            "queued": "queued" in self.marks,
+            "busy": bool(response.get("payload", {}).get("busy")),
+            "phases": phases
+        })
+        self.send_next()
+
+    def on_error(self, ws, error):
+        if self.current_commit and "done" not in self.marks:
+            self.runs.append({"user": self.index, "commit": self.current_commit,
+                              "status": "error", "error": str(error), "phases": {}})
+
+    def on_close(self, ws, status, msg):
+        pass
+
+    def run(self):
+        self.ws = WebSocketApp(self.ws_url, on_open=self.on_open, on_message=self.on_message,
+                               on_error=self.on_error, on_close=self.on_close)
+        self.ws.run_forever()
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of sorted samples"""
+    if not samples:
+        return None
+    rank = max(1, -(-len(samples) * pct // 100))
+    return samples[int(rank) - 1]
+
+
+def phase_stats(samples):
+    samples = sorted(samples)
+    histogram = {}
+    for bound in HISTOGRAM_BUCKETS + [float("inf")]:
+        label = f"<={bound}" if bound != float("inf") else f">{HISTOGRAM_BUCKETS[-1]}"
+        histogram[label] = sum(1 for s in samples if s <= bound) - sum(histogram.values())
+    return {
+        "count": len(samples),
+        "min": samples[0],
+        "mean": round(sum(samples) / len(samples), 4),
+        "p50": percentile(samples, 50),
+        "p95": percentile(samples, 95),
+        "p99": percentile(samples, 99),
+        "max": samples[-1],
+        "histogram": histogram
+    }
+
+
+def run_benchmark(args):
+    """Drive N concurrent chats against the server and report per-phase latency"""
+    config = TestClient.load_config()
+    bench = config.get("bench", {})
+    users = args.users or bench.get("users", 10)
+    streams = bench.get("streams") or [config["commits"]]
+    repeat = args.repeat or bench.get("repeat", 1)
+    no_cache = not args.use_cache
+
+    clients = [BenchmarkClient(config, i, streams[i % len(streams)] * repeat, no_cache) for i in range(users)]
+    print(f"\n{Fore.CYAN}🏁 Benchmark: {users} chats x {len(clients[0].commits)} commits "
+          f"against {config['ws_url']}{' (result cache bypassed)' if no_cache else ''}")
+
+    started = time.monotonic()
+    threads = []
+    for client in clients:
+        thread = threading.Thread(target=client.run, daemon=True)
+        thread.start()
+        threads.append(thread)
+        time.sleep(args.ramp)
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    runs = [run for client in clients for run in client.runs]
+    report = {
+        "label": args.label,
+        "started_at": datetime.utcnow().isoformat() + "Z",
+        "ws_url": config["ws_url"],
+        "users": users,
+        "runs_total": len(runs),
+        "errors": sum(1 for run in runs if run["status"] == "error"),
+        "cached": sum(1 for run in runs if run.get("cached")),
+        "queued": sum(1 for run in runs if run.get("queued")),
+        "busy": sum(1 for run in runs if run.get("busy")),
+        "duration": round(elapsed, 2),
+        "throughput_per_min": round(len(runs) / elapsed * 60, 2) if elapsed else 0,
+        "phases": {},
+        "runs": runs
+    }
+    for name, _, _ in PHASES:
+        samples = [run["phases"][name] for run in runs if name in run["phases"]]
+        if samples:
+            report["phases"][name] = phase_stats(samples)
+
+    print_benchmark(report)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"{Fore.GREEN}💾 Saved {args.output}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare_benchmarks(json.load(f), report)
+
+
+def print_benchmark(report):
+    print(f"\n{Fore.CYAN}📊 {report['runs_total']} runs in {report['duration']:.2f}s "
+          f"({report['throughput_per_min']}/min, {report['errors']} errors, {report['cached']} cached, "
+          f"{report.get('queued', 0)} queued, {report.get('busy', 0)} refused as busy)")
+    print(f"{Fore.WHITE}{'phase':<12}{'count':>7}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}")
+    for name, stats in report["phases"].items():
+        print(f"{Fore.YELLOW}{name:<12}{Fore.WHITE}{stats['count']:>7}"
+              f"{stats['p50']:>9.3f}s{stats['p95']:>9.3f}s{stats['p99']:>9.3f}s{stats['max']:>9.3f}s")
+
+
+def compare_benchmarks(baseline, report):
+    print(f"\n{Fore.CYAN}⚖️  Compared with {baseline.get('label') or baseline.get('started_at')}")
+    for name, stats in report["phases"].items():
+        before = baseline.get("phases", {}).get(name)
+        if not before:
+            continue
+        cells = []
+        for key in ("p50", "p95", "p99"):
+            change = (stats[key] - before[key]) / before[key] * 100 if before[key] else 0
+            color = Fore.GREEN if change <= 0 else Fore.RED
+            cells.append(f"{key} {before[key]:.3f}s→{stats[key]:.3f}s {color}{change:+.1f}%{Fore.WHITE}")
+        print(f"{Fore.YELLOW}{name:<12}{Fore.WHITE}" + "  ".join(cells))
+
+
 if __name__ == "__main__":
-    client = TestClient()
-    client.run()
+    parser = argparse.ArgumentParser(description="WebSocket test client")
+    parser.add_argument("--bench", action="store_true", help="Run the load benchmark instead of the interactive client")
+    parser.add_argument("--users", type=int, default=0, help="Concurrent simulated chats (default: bench.users or 10)")
+    parser.add_argument("--repeat", type=int, default=0, help="Times each chat sends its commit stream")
+    parser.add_argument("--ramp", type=float, default=0.1, help="Seconds between starting chats")
+    parser.add_argument("--use-cache", action="store_true", help="Allow cached results instead of forcing reruns")
+    parser.add_argument("--label", default="", help="Name stored with the benchmark report")
+    parser.add_argument("--output", help="Write the benchmark report as JSON")
+    parser.add_argument("--compare", help="Earlier benchmark JSON to compare against")
+    args = parser.parse_args()
+
+    if args.bench:
+        run_benchmark(args)
+    else:
+        client = TestClient()
+        client.run()
@@ -0,0 +1,294 @@
+#!/usr/bin/env python3
+"""Stateful kubectl stand-in for running the server and benchmarks without a cluster
+
+Point KUBECTL at this script. Namespaces, deployments and labels live in
+$FAKE_KUBE_ROOT/state.json. `kubectl exec` runs the shell command locally,
+with /app/ and /tmp/im- paths mapped into a directory per pod, so the real
+runner pipeline (git, venvs, the test command) runs against the host.
+
+Latency is configurable per verb with FAKE_KUBE_DELAYS, e.g.
+"get=0.05,exec=0.3,apply=0.2", and new pods only become Ready
+FAKE_KUBE_POD_START seconds after their deployment is created or scaled up.
+"""
+import fcntl
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+ROOT = os.environ.get("FAKE_KUBE_ROOT", "/tmp/fake-kube")
+STATE = os.path.join(ROOT, "state.json")
+POD_START = float(os.environ.get("FAKE_KUBE_POD_START", "0"))
+WATCH_INTERVAL = 0.2
+
+
+def parse_delays(spec: str) -> Dict[str, float]:
+    delays = {}
+    for entry in spec.split(","):
+        verb, _, seconds = entry.partition("=")
+        if seconds:
+            delays[verb.strip()] = float(seconds)
+    return delays
+
+
+DELAYS = parse_delays(os.environ.get("FAKE_KUBE_DELAYS", ""))
+
+
+def load() -> Dict[str, Any]:
+    try:
+        with open(STATE) as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"namespaces": {}, "deployments": {}}
+
+
+def save(state: Dict[str, Any]):
+    with open(STATE + ".tmp", "w") as f:
+        json.dump(state, f)
+    os.replace(STATE + ".tmp", STATE)
+
+
+def fail(message: str, code: int = 1):
+    sys.stderr.write(message + "\n")
+    sys.exit(code)
+
+
+def pods(state: Dict[str, Any], namespace: str, ready_only: bool = False) -> List[str]:
+    """Pod names of the namespace's test-pod deployment"""
+    deployment = state["deployments"].get(namespace)
+    if not deployment:
+        return []
+    names = []
+    for i, started in enumerate(deployment["started"][:deployment["replicas"]]):
+        if not ready_only or time.time() >= started + POD_START:
+            names.append(f"test-pod-{namespace[-6:]}-{i}")
+    return names
+
+
+def scale(state: Dict[str, Any], namespace: str, replicas: int):
+    deployment = state["deployments"].setdefault(namespace, {"replicas": 0, "started": []})
+    deployment["replicas"] = replicas
+    while len(deployment["started"]) < replicas:
+        deployment["started"].append(time.time())
+    del deployment["started"][replicas:]
+
+
+def match_labels(labels: Dict[str, str], selector: str) -> bool:
+    for term in selector.split(","):
+        key, _, value = term.partition("=")
+        if labels.get(key) != value:
+            return False
+    return True
+
+
+def opt(args: List[str], name: str) -> Optional[str]:
+    if name in args:
+        return args[args.index(name) + 1]
+    for arg in args:
+        if arg.startswith(name + "="):
+            return arg.split("=", 1)[1]
+    return None
+
+
+def exec_in_pod(namespace: str, args: List[str]):
+    split = args.index("--")
+    command = args[split + 1:]
+    pod = [a for a in args[1:split] if not a.startswith("-")][0]
+    if pod not in pods(load(), namespace):
+        fail(f'Error from server (NotFound): pods "{pod}" not found')
+
+    pod_root = os.path.join(ROOT, "pods", pod)
+    os.makedirs(pod_root, exist_ok=True)
+
+    def localize(text: str) -> str:
+        return text.replace("/app/", pod_root + "/").replace("/tmp/im-", pod_root + "/tmp-im-")
+
+    stdin = None
+    if command[:2] == ["sh", "-s"]:
+        stdin = localize(sys.stdin.read()).encode()
+    command = [localize(c) for c in command]
+
+    # Relay output the way the kubectl stream does: killing this process ends
+    # the stream while the command keeps running "in the pod"
+    proc = subprocess.Popen(command, stdin=subprocess.PIPE if stdin is not None else None,
+                            stdout=subprocess.PIPE)
+    if stdin is not None:
+        def feed():
+            try:
+                proc.stdin.write(stdin)
+                proc.stdin.close()
+            except OSError:
+                pass
+        threading.Thread(target=feed, daemon=True).start()
+    out = sys.stdout.buffer
+    for chunk in iter(lambda: os.read(proc.stdout.fileno(), 65536), b""):
+        out.write(chunk)
+        out.flush()
+    sys.exit(proc.wait())
+
+
+def snapshot(kind: str) -> Dict[str, Dict[str, Any]]:
+    state = load()
+    objects = {}
+    if kind in ("namespace", "namespaces"):
+        for name in state["namespaces"]:
+            objects[name] = {"kind": "Namespace", "metadata": {"name": name}, "status": {"phase": "Active"}}
+        return objects
+    for namespace in state["deployments"]:
+        for name in pods(state, namespace, ready_only=True):
+            objects[f"{namespace}/{name}"] = {
+                "kind": "Pod",
+                "metadata": {"name": name, "namespace": namespace, "labels": {"app": "test-pod"}},
+                "status": {"phase": "Running", "conditions": [{"type": "Ready", "status": "True"}]}
+            }
+    return objects
+
+
+def watch(kind: str):
+    """Emit --output-watch-events JSON documents as state.json changes"""
+    seen: Dict[str, Dict[str, Any]] = {}
+    while True:
+        current = snapshot(kind)
+        for key, obj in current.items():
+            if key not in seen:
+                print(json.dumps({"type": "ADDED", "object": obj}, indent=4), flush=True)
+        for key, obj in seen.items():
+            if key not in current:
+                print(json.dumps({"type": "DELETED", "object": obj}, indent=4), flush=True)
+        seen = current
+        time.sleep(WATCH_INTERVAL)
+
+
+def wait_ready(namespace: str, args: List[str], selector: Optional[str]) -> str:
+    names = [a for a in args[args.index("pod") + 1:] if not a.startswith("-") and a != selector]
+    timeout = float((opt(args, "--timeout") or "30s").rstrip("s"))
+    deadline = time.time() + timeout
+    while True:
+        state = load()
+        existing = pods(state, namespace)
+        if not existing or any(n not in existing for n in names):
+            fail("error: no matching resources found")
+        targets = names or existing
+        ready = pods(state, namespace, ready_only=True)
+        if all(n in ready for n in targets):
+            return "".join(f"pod/{n} condition met\n" for n in targets)
+        if time.time() >= deadline:
+            fail(f"error: timed out waiting for the condition on pods/{targets[0]}")
+        time.sleep(WATCH_INTERVAL)
+
+
+def rollout_status(namespace: str, args: List[str]) -> str:
+    timeout = float((opt(args, "--timeout") or "30s").rstrip("s"))
+    deadline = time.time() + timeout
+    while True:
+        deployment = load()["deployments"].get(namespace)
+        if deployment is None:
+            fail('Error from server (NotFound): deployments.apps "test-pod" not found')
+        if len(pods(load(), namespace, ready_only=True)) >= deployment["replicas"]:
+            return 'deployment "test-pod" successfully rolled out\n'
+        if time.time() >= deadline:
+            fail("error: timed out waiting for the condition")
+        time.sleep(WATCH_INTERVAL)
+
+
+def run(state: Dict[str, Any], namespace: Optional[str], args: List[str]) -> str:
+    verb = args[0]
+    kind = args[1] if len(args) > 1 else ""
+    selector = opt(args, "-l")
+    output = opt(args, "-o")
+
+    if verb == "get" and kind in ("namespace", "namespaces"):
+        if len(args) > 2 and not args[2].startswith("-"):
+            if args[2] not in state["namespaces"]:
+                fail(f'Error from server (NotFound): namespaces "{args[2]}" not found')
+            return args[2] + "\n"
+        return " ".join(name for name, meta in state["namespaces"].items()
+                        if not selector or match_labels(meta["labels"], selector))
+    if verb == "create" and kind == "namespace":
+        if args[2] in state["namespaces"]:
+            fail(f'Error from server (AlreadyExists): namespaces "{args[2]}" already exists')
+        state["namespaces"][args[2]] = {"labels": {}}
+        return f"namespace/{args[2]} created\n"
+    if verb == "apply":
+        path = opt(args, "-f")
+        text = sys.stdin.read() if path == "-" else open(path).read()
+        if '"Namespace"' in text:
+            doc = json.loads(text)
+            state["namespaces"][doc["metadata"]["name"]] = {"labels": doc["metadata"].get("labels", {})}
+            return ""
+        if namespace not in state["namespaces"]:
+            fail(f'Error from server (NotFound): namespaces "{namespace}" not found')
+        if "kind: ResourceQuota" in text:
+            return "resourcequota/test-quota created\nlimitrange/test-limits created\n"
+        if namespace not in state["deployments"]:
+            scale(state, namespace, 1)
+        return "deployment.apps/test-pod created\n"
+    if verb == "label":
+        meta = state["namespaces"].get(args[2])
+        if meta is None:
+            fail(f'Error from server (NotFound): namespaces "{args[2]}" not found')
+        for arg in args[3:]:
+            if "=" in arg and not arg.startswith("-"):
+                key, value = arg.split("=", 1)
+                meta["labels"][key] = value
+        return ""
+    if verb == "delete" and kind == "namespace":
+        state["namespaces"].pop(args[2], None)
+        state["deployments"].pop(args[2], None)
+        return ""
+    if verb == "scale":
+        if namespace not in state["deployments"]:
+            fail('Error from server (NotFound): deployments.apps "test-pod" not found')
+        scale(state, namespace, int(opt(args, "--replicas")))
+        return ""
+    if verb == "get" and kind == "deployment":
+        if namespace not in state["deployments"]:
+            fail('Error from server (NotFound): deployments.apps "test-pod" not found')
+        return str(state["deployments"][namespace]["replicas"])
+    if verb == "get" and kind in ("pod", "pods"):
+        names = pods(state, namespace)
+        if output and "items[0]" in output:
+            if not names:
+                fail("error: array index out of bounds")
+            return names[0]
+        return " ".join(names)
+    fail(f"fake kubectl: unsupported command: {' '.join(args)}")
+
+
+def main():
+    os.makedirs(ROOT, exist_ok=True)
+    args = sys.argv[1:]
+    namespace = None
+    if args[:1] == ["-n"]:
+        namespace, args = args[1], args[2:]
+    if not args:
+        fail("fake kubectl: no command")
+
+    time.sleep(DELAYS.get(args[0], 0))
+    if args[0] == "proxy":
+        fail("fake kubectl: proxy is not supported")
+    if args[0] == "exec":
+        exec_in_pod(namespace, args)
+    if args[0] == "get" and "--watch" in args:
+        watch(args[1])
+    if args[0] == "wait":
+        sys.stdout.write(wait_ready(namespace, args, opt(args, "-l")))
+        return
+    if args[:2] == ["rollout", "status"]:
+        sys.stdout.write(rollout_status(namespace, args))
+        return
+
+    with open(os.path.join(ROOT, "lock"), "w") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = load()
+        output = run(state, namespace, args)
+        save(state)
+    if output:
+        sys.stdout.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+import fcntl
+import hashlib
+import os
+import re
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+from kube_client import KubeClient
+from state_store import JsonState
+
+FULL_SHA = re.compile(r"^[0-9a-f]{40}$")
+SHIPPED_PER_POD = 20
+# How often shipped-commit records are checked against the pods that still exist
+SHIPPED_PRUNE_INTERVAL = 600
+# Everything upstream has, except the refs/im/<sha> refs that pin commits
+# shipped to pods, which --prune would otherwise delete on every fetch
+FETCH_REFSPECS = ("+refs/*:refs/*", "^refs/im/*")
+
+
+class GitMirror:
+    """Server-side bare mirrors shared by every namespace testing the same repo
+
+    Each repo URL gets one mirror under GIT_MIRROR_DIR, fetched only when a
+    requested commit is missing. Pods receive a git bundle holding just the
+    commits they have not been sent before, so repeated tests of the same
+    repo never reach the upstream host from the pod.
+    """
+
+    def __init__(self, root: str, max_bundle_bytes: int):
+        self.root = root
+        self.max_bundle_bytes = max_bundle_bytes
+        self.shipped = JsonState("mirror_shipped.json")
+
+    @classmethod
+    def from_env(cls) -> Optional["GitMirror"]:
+        if os.environ.get("GIT_MIRROR", "1") == "0":
+            return None
+        max_mb = int(os.environ.get("GIT_MIRROR_MAX_BUNDLE_MB", "256"))
+        return cls(os.environ.get("GIT_MIRROR_DIR", "repos"), max_mb * 1024 * 1024)
+
+    def path(self, repo_url: str) -> str:
+        name = os.path.basename(repo_url.rstrip("/"))
+        if name.endswith(".git"):
+            name = name[:-4]
+        digest = hashlib.sha1(repo_url.encode()).hexdigest()[:12]
+        return os.path.join(self.root, f"{name}-{digest}.git")
+
+    @contextmanager
+    def lock(self, repo_url: str) -> Iterator[str]:
+        """Serialize clone/fetch/bundle work on one mirror across processes"""
+        path = self.path(repo_url)
+        os.makedirs(self.root, exist_ok=True)
+        with open(path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield path
+
+    def _git(self, path: str, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(["git", "--git-dir", path] + list(args), capture_output=True, text=True)
+
+    def _rev_parse(self, path: str, commit: str) -> str:
+        result = self._git(path, "rev-parse", "--verify", "--quiet", f"{commit}^{{commit}}")
+        return result.stdout.strip() if result.returncode == 0 else ""
+
+    def resolve(self, repo_url: str, commit: str) -> str:
+        """Return the full SHA of commit, cloning or fetching upstream only if needed"""
+        with self.lock(repo_url) as path:
+            if not os.path.isdir(path):
+                subprocess.run(["git", "clone", "--quiet", "--mirror", repo_url, path],
+                               capture_output=True, text=True, check=True)
+
+            # A known full SHA never changes; anything symbolic may have moved upstream
+            if FULL_SHA.match(commit):
+                sha = self._rev_parse(path, commit)
+                if sha:
+                    return sha
+
+            fetch = self._git(path, "fetch", "--quiet", "--prune", "origin", *FETCH_REFSPECS)
+            if fetch.returncode != 0:
+                raise subprocess.CalledProcessError(fetch.returncode, fetch.args, fetch.stdout, fetch.stderr)
+            sha = self._rev_parse(path, commit)
+            if not sha:
+                raise subprocess.CalledProcessError(
+                    1, ["git", "rev-parse", commit], "", f"unknown revision {commit} in {repo_url}")
+            return sha
+
+    def commits_between(self, repo_url: str, good: str, bad: str) -> List[str]:
+        """First-parent commits after good up to and including bad, oldest first"""
+        good_sha = self.resolve(repo_url, good)
+        bad_sha = self.resolve(repo_url, bad)
+        with self.lock(repo_url) as path:
+            if self._git(path, "merge-base", "--is-ancestor", good_sha, bad_sha).returncode != 0:
+                raise ValueError(f"{good} is not an ancestor of {bad}")
+            listed = self._git(path, "rev-list", "--first-parent", "--reverse", f"{good_sha}..{bad_sha}")
+            if listed.returncode != 0:
+                raise subprocess.CalledProcessError(listed.returncode, listed.args, listed.stdout, listed.stderr)
+            return listed.stdout.split()
+
+    def changed_files(self, repo_url: str, base: str, sha: str) -> List[str]:
+        """Paths that differ between two commits already in the mirror"""
+        with self.lock(repo_url) as path:
+            diff = self._git(path, "diff", "--name-only", "--no-renames", base, sha)
+            if diff.returncode != 0:
+                raise subprocess.CalledProcessError(diff.returncode, diff.args, diff.stdout, diff.stderr)
+            return diff.stdout.split("\n")[:-1]
+
+    def shipped_to(self, pod_key: str) -> List[str]:
+        return self.shipped.read().get("pods", {}).get(pod_key, [])
+
+    def mark_shipped(self, pod_key: str, sha: str):
+        with self.shipped.locked() as shipped:
+            pods = shipped.setdefault("pods", {})
+            history = [s for s in pods.get(pod_key, []) if s != sha]
+            pods[pod_key] = ([sha] + history)[:SHIPPED_PER_POD]
+
+    def forget(self, pod_key: str):
+        with self.shipped.locked() as shipped:
+            shipped.get("pods", {}).pop(pod_key, None)
+
+    def prune_shipped(self, kube: KubeClient, force: bool = False) -> List[str]:
+        """Forget pods that no longer exist, at most once per SHIPPED_PRUNE_INTERVAL; returns the forgotten keys
+
+        Pod keys are "<namespace>/<pod>". The namespaces are listed without
+        holding the state lock, so a slow API server never blocks runs.
+        """
+        with self.shipped.locked() as shipped:
+            if not force and time.time() - shipped.get("pruned_at", 0) < SHIPPED_PRUNE_INTERVAL:
+                return []
+            shipped["pruned_at"] = time.time()
+            keys = list(shipped.get("pods", {}))
+
+        live: Dict[str, List[str]] = {}
+        for namespace in sorted({key.split("/", 1)[0] for key in keys}):
+            listed = kube.run(["get", "pods", "-l", "app=test-pod", "-o", "jsonpath={.items[*].metadata.name}"],
+                              namespace=namespace)
+            if listed.returncode != 0:
+                # Unknown is not gone; keep the namespace's records
+                live[namespace] = [key.split("/", 1)[1] for key in keys if key.startswith(namespace + "/")]
+                continue
+            live[namespace] = listed.stdout.split()
+
+        dead = [key for key in keys if key.split("/", 1)[1] not in live[key.split("/", 1)[0]]]
+        if dead:
+            with self.shipped.locked() as shipped:
+                for key in dead:
+                    shipped.get("pods", {}).pop(key, None)
+        return dead
+
+    def bundle(self, repo_url: str, sha: str, have: List[str]) -> Optional[str]:
+        """Write a bundle of sha minus the history in have; None if the pod already has sha
+
+        The caller owns (and must delete) the returned file.
+        """
+        if sha in have:
+            return None
+        with self.lock(repo_url) as path:
+            ref = f"refs/im/{sha}"
+            self._git(path, "update-ref", ref, sha)
+            known = [h for h in have if self._rev_parse(path, h)]
+            fd, bundle_path = tempfile.mkstemp(suffix=".bundle")
+            os.close(fd)
+            create = self._git(path, "bundle", "create", bundle_path, ref, *[f"^{h}" for h in known])
+            if create.returncode != 0:
+                os.unlink(bundle_path)
+                # sha is already an ancestor of something the pod has
+                if "empty bundle" in create.stderr:
+                    return None
+                raise subprocess.CalledProcessError(create.returncode, create.args, create.stdout, create.stderr)
+
+        if os.path.getsize(bundle_path) > self.max_bundle_bytes:
+            os.unlink(bundle_path)
+            raise ValueError(f"bundle for {sha} exceeds GIT_MIRROR_MAX_BUNDLE_MB")
+        return bundle_path
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import subprocess
+import time
+from typing import Any, Dict, List, Optional
+
+from git_mirror import GitMirror
+from state_store import JsonState
+
+# A change to any of these can affect every test, so it forces a full run.
+# conftest.py and __init__.py mostly run at import and collection time,
+# which the profile hook never attributes to a test.
+GLOBAL_FILES = ("requirements.txt", "pyproject.toml", "setup.py", "setup.cfg", "pytest.ini", "tox.ini",
+                "conftest.py", "__init__.py")
+
+
+class ImpactMap:
+    """Which repo files each test executed in the last full run of a repo and test command
+
+    Kept in impact/<repo+command>.json under IM_STATE_DIR. A full run records
+    the map; later runs diff their commit against the one the map was
+    recorded at and skip the tests none of whose files changed. New or
+    changed test files and tests that failed last time still run. A change
+    to a GLOBAL_FILES entry, or to any file no test was seen to use (data
+    files, code run only at import time, new files), runs everything, and
+    every full_every-th run is full again.
+    """
+
+    def __init__(self, repo_url: str, test_cmd: str, full_every: int):
+        digest = hashlib.sha1(f"{repo_url}\0{test_cmd}".encode()).hexdigest()[:12]
+        self.state = JsonState(os.path.join("impact", f"{digest}.json"))
+        self.repo_url = repo_url
+        self.full_every = full_every
+
+    @classmethod
+    def from_env(cls, repo_url: str, test_cmd: str) -> "ImpactMap":
+        return cls(repo_url, test_cmd, int(os.environ.get("IMPACT_FULL_EVERY", "10")))
+
+    def plan(self, mirror: GitMirror, sha: str) -> Dict[str, Any]:
+        """Decide whether sha runs in full or which known tests it can skip"""
+        impact = self.state.read()
+        base = impact.get("base")
+        if not base:
+            return self._full("no coverage map recorded yet")
+        runs = impact.get("incremental_runs", 0)
+        if runs >= self.full_every:
+            return self._full(f"periodic full run after {runs} incremental runs")
+
+        try:
+            changed = mirror.changed_files(self.repo_url, base, sha)
+        except subprocess.CalledProcessError:
+            return self._full(f"could not diff against {base[:12]}")
+        for path in changed:
+            if os.path.basename(path) in GLOBAL_FILES:
+                return self._full(f"{path} changed", base, changed)
+
+        tests = impact.get("tests", {})
+        mapped = {test_id.split("::")[0] for test_id in tests}
+        for files in tests.values():
+            mapped.update(files)
+        for path in changed:
+            if path not in mapped:
+                return self._full(f"{path} changed and no test is known to use it", base, changed)
+
+        changed_set = set(changed)
+        failing = set(impact.get("failing", []))
+        skipped = []
+        for test_id, files in sorted(tests.items()):
+            test_file = test_id.split("::")[0]
+            if changed_set.intersection(files) or test_id in failing or test_file in changed_set:
+                continue
+            skipped.append({"id": test_id,
+                            "reason": f"none of its {len(files)} covered files changed since {base[:12]}"})
+        return {
+            "mode": "incremental",
+            "reason": f"{len(changed)} files changed since {base[:12]}",
+            "base": base,
+            "changed_files": changed,
+            "skipped": skipped,
+            "deselect": [test["id"] for test in skipped]
+        }
+
+    def _full(self, reason: str, base: str = "", changed: Optional[List[str]] = None) -> Dict[str, Any]:
+        plan: Dict[str, Any] = {"mode": "full", "reason": reason}
+        if base:
+            plan["base"] = base
+            plan["changed_files"] = changed or []
+        return plan
+
+    def record_full(self, sha: str, coverage: Dict[str, List[str]], tests: List[Dict[str, Any]]):
+        """Make a full run's coverage the map later commits are diffed against"""
+        with self.state.locked() as impact:
+            impact.clear()
+            impact.update({
+                "base": sha,
+                "at": time.time(),
+                "tests": coverage,
+                "failing": sorted(t["id"] for t in tests if t["outcome"] in ("failed", "error")),
+                "incremental_runs": 0
+            })
+
+    def record_incremental(self, tests: List[Dict[str, Any]]):
+        """Count an incremental run and track which of its tests now fail"""
+        with self.state.locked() as impact:
+            failing = set(impact.get("failing", []))
+            for test in tests:
+                if test["outcome"] in ("failed", "error"):
+                    failing.add(test["id"])
+                else:
+                    failing.discard(test["id"])
+            impact["failing"] = sorted(failing)
+            impact["incremental_runs"] = impact.get("incremental_runs", 0) + 1
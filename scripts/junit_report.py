@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+import hashlib
+import os
+import time
+import xml.etree.ElementTree as ET
+from typing import Any, Dict, List, Optional
+
+from state_store import JsonState
+
+HISTORY_COMMITS = 100
+
+
+def parse_junit(xml_text: str) -> List[Dict[str, Any]]:
+    """Turn a pytest JUnit XML report into compact {id, outcome, duration} records"""
+    root = ET.fromstring(xml_text)
+    tests = []
+    for case in root.iter("testcase"):
+        outcome = "passed"
+        for child in case:
+            if child.tag in ("failure", "error", "skipped"):
+                outcome = "failed" if child.tag == "failure" else child.tag
+                break
+        tests.append({
+            "id": node_id(case.get("classname", ""), case.get("name", ""), case.get("file")),
+            "outcome": outcome,
+            "duration": round(float(case.get("time") or 0), 4)
+        })
+    return tests
+
+
+def node_id(classname: str, name: str, path: Optional[str]) -> str:
+    """Rebuild pytest's node ID ("tests/test_x.py::TestY::test_z") from JUnit attributes"""
+    if not path:
+        return f"{classname}::{name}" if classname else name
+    module = path[:-3].replace("/", ".") if path.endswith(".py") else ""
+    parts = [path]
+    if module and classname.startswith(module + "."):
+        parts += classname[len(module) + 1:].split(".")
+    parts.append(name)
+    return "::".join(parts)
+
+
+def summarize(tests: List[Dict[str, Any]]) -> Dict[str, int]:
+    summary = {"total": len(tests), "passed": 0, "failed": 0, "error": 0, "skipped": 0}
+    for test in tests:
+        summary[test["outcome"]] = summary.get(test["outcome"], 0) + 1
+    return summary
+
+
+class DurationHistory:
+    """Per-test durations of passing tests, per repo and commit SHA
+
+    Kept in durations/<repo>.json under IM_STATE_DIR for the most recent
+    HISTORY_COMMITS commits, so a run can be compared with its parent's.
+    """
+
+    def __init__(self, repo_url: str):
+        digest = hashlib.sha1(repo_url.encode()).hexdigest()[:12]
+        self.state = JsonState(os.path.join("durations", f"{digest}.json"))
+
+    def get(self, sha: str) -> Dict[str, float]:
+        return self.state.read().get(sha, {}).get("tests", {})
+
+    def latest(self) -> Dict[str, float]:
+        """The most recently recorded duration of every test, across all kept commits"""
+        merged: Dict[str, float] = {}
+        for entry in sorted(self.state.read().values(), key=lambda entry: entry["at"]):
+            merged.update(entry["tests"])
+        return merged
+
+    def record(self, sha: str, tests: List[Dict[str, Any]]):
+        durations = {t["id"]: t["duration"] for t in tests if t["outcome"] == "passed"}
+        if not durations:
+            return
+        with self.state.locked() as history:
+            history[sha] = {"at": time.time(), "tests": durations}
+            for old in sorted(history, key=lambda s: history[s]["at"])[:-HISTORY_COMMITS]:
+                del history[old]
+
+
+def find_regressions(tests: List[Dict[str, Any]], baseline: Dict[str, float],
+                     ratio: float, min_delta: float) -> List[Dict[str, Any]]:
+    """Passing tests at least ratio times and min_delta seconds slower than baseline"""
+    regressions = []
+    for test in tests:
+        before = baseline.get(test["id"])
+        if test["outcome"] != "passed" or before is None:
+            continue
+        if test["duration"] >= before * ratio and test["duration"] - before >= min_delta:
+            regressions.append({
+                "id": test["id"],
+                "duration": test["duration"],
+                "parent_duration": before,
+                "ratio": round(test["duration"] / before, 2) if before else None
+            })
+    return sorted(regressions, key=lambda r: r["duration"] - r["parent_duration"], reverse=True)
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+import http.client
+import json
+import os
+import re
+import subprocess
+import threading
+import urllib.parse
+from typing import Any, Dict, List, Optional
+
+# Seconds to wait for kubectl proxy to report its port before giving up on it
+PROXY_START_TIMEOUT = 10.0
+
+
+class KubeClient:
+    """kubectl wrapper that can reuse one pooled API connection via kubectl proxy"""
+
+    def __init__(self, kubectl: Optional[str] = None):
+        self.kubectl = kubectl or os.environ.get("KUBECTL", "kubectl")
+        self._proxy: Optional[subprocess.Popen] = None
+        self._conn: Optional[http.client.HTTPConnection] = None
+        self._host = ""
+        self._port = 0
+        self._lock = threading.Lock()
+
+    def run(self, command: List[str], namespace: Optional[str] = None, check: bool = False,
+            input: Optional[str] = None) -> subprocess.CompletedProcess:
+        """Execute a kubectl command and capture output"""
+        full_command = [self.kubectl]
+        if namespace:
+            full_command += ["-n", namespace]
+        full_command += command
+        return subprocess.run(
+            full_command,
+            input=input,
+            capture_output=True,
+            text=True,
+            check=check
+        )
+
+    def popen(self, command: List[str], namespace: Optional[str] = None, **kwargs) -> subprocess.Popen:
+        """Start a kubectl command whose output is consumed while it runs"""
+        full_command = [self.kubectl]
+        if namespace:
+            full_command += ["-n", namespace]
+        return subprocess.Popen(full_command + command, text=True, **kwargs)
+
+    def start_proxy(self) -> bool:
+        """Start a kubectl proxy and keep one keep-alive connection to it"""
+        if self._proxy is not None:
+            return True
+        try:
+            proc = subprocess.Popen(
+                [self.kubectl, "proxy", "--port=0"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True
+            )
+        except OSError:
+            return False
+
+        # kubectl prints "Starting to serve on 127.0.0.1:<port>" once listening.
+        # Read it on a thread so a proxy that never prints cannot hang startup.
+        lines: List[str] = []
+        reader = threading.Thread(target=lambda: lines.append(proc.stdout.readline()), daemon=True)
+        reader.start()
+        reader.join(PROXY_START_TIMEOUT)
+        match = re.search(r"on ([\d.]+|\[[^\]]+\]|localhost):(\d+)", lines[0]) if lines else None
+        if not match:
+            proc.kill()
+            proc.wait()
+            return False
+
+        self._proxy = proc
+        self._host, self._port = match.group(1), int(match.group(2))
+        return True
+
+    def close(self):
+        """Shut down the proxy and its connection"""
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+        if self._proxy is not None:
+            self._proxy.terminate()
+            self._proxy.wait()
+            self._proxy = None
+
+    def _request(self, method: str, path: str, body: Optional[Dict[str, Any]] = None):
+        """Issue a REST call over the pooled connection, reconnecting once on failure"""
+        payload = json.dumps(body) if body is not None else None
+        headers = {"Content-Type": "application/json"} if payload else {}
+        with self._lock:
+            for attempt in range(2):
+                if self._conn is None:
+                    self._conn = http.client.HTTPConnection(self._host, self._port, timeout=30)
+                try:
+                    self._conn.request(method, path, body=payload, headers=headers)
+                    response = self._conn.getresponse()
+                    data = response.read().decode()
+                    try:
+                        return response.status, json.loads(data) if data else {}
+                    except ValueError:
+                        return response.status, {"message": data.strip()}
+                except (http.client.HTTPException, OSError):
+                    self._conn.close()
+                    self._conn = None
+                    if attempt:
+                        raise
+
+    def _rest_result(self, args: List[str], status: int, body: Dict[str, Any], stdout: str,
+                     check: bool) -> subprocess.CompletedProcess:
+        """Shape a REST response like the equivalent kubectl invocation"""
+        if 200 <= status < 300:
+            return subprocess.CompletedProcess(args, 0, stdout, "")
+        reason = body.get("reason", "Unknown")
+        stderr = f"Error from server ({reason}): {body.get('message', '')}"
+        if check:
+            raise subprocess.CalledProcessError(1, args, "", stderr)
+        return subprocess.CompletedProcess(args, 1, "", stderr)
+
+    def get_namespace(self, namespace: str, check: bool = False) -> subprocess.CompletedProcess:
+        """Check whether a namespace exists"""
+        args = [self.kubectl, "get", "namespace", namespace]
+        if self._proxy is None:
+            return self.run(args[1:], check=check)
+        status, body = self._request("GET", f"/api/v1/namespaces/{namespace}")
+        return self._rest_result(args, status, body, namespace, check)
+
+    def create_namespace(self, namespace: str, check: bool = False) -> subprocess.CompletedProcess:
+        """Create a namespace"""
+        args = [self.kubectl, "create", "namespace", namespace]
+        if self._proxy is None:
+            return self.run(args[1:], check=check)
+        status, body = self._request("POST", "/api/v1/namespaces", {
+            "apiVersion": "v1",
+            "kind": "Namespace",
+            "metadata": {"name": namespace}
+        })
+        return self._rest_result(args, status, body, f"namespace/{namespace} created", check)
+
+    def rollout_status(self, namespace: str, deployment: str = "test-pod",
+                       timeout: str = "180s") -> subprocess.CompletedProcess:
+        """Wait until every replica of a deployment exists and is ready
+
+        Unlike `kubectl wait -l`, this does not fail when it runs before the
+        pods of a just-scaled deployment have been created.
+        """
+        return self.run(["rollout", "status", f"deployment/{deployment}", f"--timeout={timeout}"],
+                        namespace=namespace)
+
+    def get_pod_name(self, namespace: str, selector: str, check: bool = False) -> subprocess.CompletedProcess:
+        """Return the name of the first pod matching a label selector"""
+        args = [self.kubectl, "-n", namespace, "get", "pod", "-l", selector,
+                "-o", "jsonpath={.items[0].metadata.name}"]
+        if self._proxy is None:
+            return self.run(args[3:], namespace=namespace, check=check)
+        status, body = self._request("GET", f"/api/v1/namespaces/{namespace}/pods?labelSelector={urllib.parse.quote(selector)}")
+        items = body.get("items") or []
+        if 200 <= status < 300 and not items:
+            status, body = 404, {"reason": "NotFound", "message": f"no pods match {selector}"}
+        name = items[0]["metadata"]["name"] if items else ""
+        return self._rest_result(args, status, body, name, check)
@@ -1,93 +1,218 @@
 #!/usr/bin/env python3
 import json
 import os
-import subprocess
 import sys
+import time
 from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
 
-def main():
-    try:
-        if len(sys.argv) != 4:
-            print(json.dumps({
-                "status": "error",
-                "message": "Required arguments: chatID userID projectType"
-            }))
-            sys.exit(1)
+from kube_client import KubeClient
+from namespace_lifecycle import MANAGED_BY, MANAGED_LABEL, NamespaceLifecycle, apply_quota
+from pool_manager import PoolManager
+from state_store import JsonState
 
-        chat_id, user_id, project_type = sys.argv[1], sys.argv[2], sys.argv[3].lower()
-        namespace = f"im-{chat_id}-{user_id}".lower()
-        yaml_path = f"deployments/templates/{project_type}/test-pod.yaml"
+# A lease not released within this long belongs to a run that died with its
+# worker and no longer holds replicas
+POD_LEASE_TTL = 6 * 3600
 
-        # Validate YAML file exists
-        if not os.path.exists(yaml_path):
-            print(json.dumps({
-                "status": "error",
-                "message": f"Missing deployment template for {project_type}",
-                "details": f"Could not find {yaml_path}"
-            }))
-            sys.exit(1)
 
-        timestamp = datetime.utcnow().isoformat() + "Z"
+def handle_namespace(chat_id: str, user_id: str, project_type: str,
+                     kube: Optional[KubeClient] = None,
+                     pool: Optional[PoolManager] = None,
+                     lifecycle: Optional[NamespaceLifecycle] = None) -> Tuple[Dict[str, Any], int]:
+    """Ensure the chat/user namespace exists, returning the JSON result and exit code
 
-        # Check namespace existence
-        check = subprocess.run(
-            ["kubectl", "get", "namespace", namespace],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+    A namespace the lifecycle reaper scaled to zero is scaled back up
+    ("rewarmed"); one it deleted is simply created again.
+    """
+    kube = kube or KubeClient()
+    project_type = project_type.lower()
+    namespace = f"im-{chat_id}-{user_id}".lower()
+    yaml_path = f"deployments/templates/{project_type}/test-pod.yaml"
 
-        # Only log errors if the check wasn't a normal "not found" case
-        if check.returncode != 0 and "NotFound" not in check.stderr:
-            sys.stderr.write(f"kubectl check error: {check.stderr.strip()}\n")
+    # Validate YAML file exists
+    if not os.path.exists(yaml_path):
+        return {
+            "status": "error",
+            "message": f"Missing deployment template for {project_type}",
+            "details": f"Could not find {yaml_path}"
+        }, 1
 
-        if check.returncode == 0:
-            print(json.dumps({
-                "status": "exists",
+    timestamp = datetime.utcnow().isoformat() + "Z"
+
+    # A namespace leased from the warm pool stands in for the chat/user one
+    leased = pool.lookup(namespace) if pool else None
+    if leased:
+        return {
+            "status": "exists",
+            "namespace": leased,
+            "timestamp": timestamp
+        }, 0
+
+    # Check namespace existence
+    check = kube.get_namespace(namespace)
+
+    # Only log errors if the check wasn't a normal "not found" case
+    if check.returncode != 0 and "NotFound" not in check.stderr:
+        sys.stderr.write(f"kubectl check error: {check.stderr.strip()}\n")
+
+    if check.returncode == 0:
+        if lifecycle and lifecycle.touch(namespace, project_type):
+            error = lifecycle.rewarm(namespace)
+            if error:
+                return {"status": "error", "message": error, "namespace": namespace}, 1
+            return {
+                "status": "rewarmed",
                 "namespace": namespace,
+                "project_type": project_type,
                 "timestamp": timestamp
-            }))
-            sys.exit(0)
+            }, 0
+        return {
+            "status": "exists",
+            "namespace": namespace,
+            "timestamp": timestamp
+        }, 0
 
-        # Create namespace
-        create = subprocess.run(
-            ["kubectl", "create", "namespace", namespace],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+    # Prefer a pre-provisioned, already-ready namespace over a cold start
+    leased = pool.lease(namespace, project_type) if pool else None
+    if leased:
+        return {
+            "status": "leased",
+            "namespace": leased,
+            "project_type": project_type,
+            "timestamp": timestamp
+        }, 0
 
-        if create.returncode != 0:
-            print(json.dumps({
-                "status": "error", 
-                "message": create.stderr.strip(),
-                "namespace": namespace
-            }))
-            sys.exit(1)
+    # Create namespace
+    create = kube.create_namespace(namespace)
+
+    if create.returncode != 0:
+        return {
+            "status": "error",
+            "message": create.stderr.strip(),
+            "namespace": namespace
+        }, 1
+
+    # Mark it as ours so the idle reaper may scale it down and delete it
+    labelled = kube.run(["label", "namespace", namespace, "--overwrite", f"{MANAGED_LABEL}={MANAGED_BY}"])
+    if labelled.returncode != 0:
+        sys.stderr.write(f"failed to label {namespace}: {labelled.stderr.strip()}\n")
+
+    # Cap what the namespace may use before anything is scheduled in it
+    quota_error = apply_quota(kube, namespace, project_type)
+    if quota_error:
+        return {
+            "status": "error",
+            "message": quota_error,
+            "namespace": namespace
+        }, 1
+
+    # Deploy project-specific pod
+    deploy = kube.run(["apply", "-f", yaml_path], namespace=namespace)
+
+    if deploy.returncode != 0:
+        return {
+            "status": "error",
+            "message": deploy.stderr.strip(),
+            "namespace": namespace
+        }, 1
+
+    if lifecycle:
+        lifecycle.touch(namespace, project_type)
+    return {
+        "status": "created",
+        "namespace": namespace,
+        "project_type": project_type,
+        "timestamp": timestamp
+    }, 0
+
+
+def pod_leases(namespace: str) -> JsonState:
+    """Replicas held per run in namespace, kept apart from other namespaces so scaling one never waits on another"""
+    return JsonState(os.path.join("pod_leases", f"{namespace}.json"))
+
+
+def scale_test_pods(namespace: str, replicas: int, kube: Optional[KubeClient] = None,
+                    lease: str = "") -> Dict[str, Any]:
+    """Grow the test-pod deployment to at least `replicas` and list its ready pods
+
+    With a lease (the run's ID) the replicas are held for that run until
+    release_test_pods, which shrinks the deployment back to what the
+    remaining leases need. A failed scale releases the lease itself.
+    """
+    kube = kube or KubeClient()
+    with pod_leases(namespace).locked() as leases:
+        current = kube.run(["get", "deployment", "test-pod", "-o", "jsonpath={.spec.replicas}"],
+                           namespace=namespace)
+        if current.returncode != 0:
+            return {"status": "error", "message": current.stderr.strip(), "namespace": namespace}
+        if lease:
+            leases[lease] = {"replicas": replicas, "at": time.time()}
+        if int(current.stdout.strip() or 0) < replicas:
+            scale = kube.run(["scale", "deployment", "test-pod", f"--replicas={replicas}"], namespace=namespace)
+            if scale.returncode != 0:
+                leases.pop(lease, None)
+                return {"status": "error", "message": scale.stderr.strip(), "namespace": namespace}
+
+    def failed(message: str) -> Dict[str, Any]:
+        # The caller only releases leases it was granted; give the replicas back now
+        if lease:
+            release_test_pods(namespace, lease, kube=kube)
+        return {"status": "error", "message": message, "namespace": namespace}
 
-        # Deploy project-specific pod
-        deploy = subprocess.run(
-            ["kubectl", "apply", "-n", namespace, "-f", yaml_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
+    # New pods do not exist yet right after the scale; wait for the rollout
+    # before waiting on the pods themselves
+    rollout = kube.rollout_status(namespace)
+    if rollout.returncode != 0:
+        return failed(rollout.stderr.strip())
 
-        if deploy.returncode != 0:
+    # "pod/<name> condition met" per ready pod
+    wait = kube.run(["wait", "--for=condition=Ready", "pod", "-l", "app=test-pod", "--timeout=180s"],
+                    namespace=namespace)
+    pods = [line.split()[0].split("/", 1)[-1] for line in wait.stdout.splitlines() if "condition met" in line]
+    if not pods:
+        return failed(wait.stderr.strip() or "no ready test pods")
+
+    return {"status": "ready", "namespace": namespace, "pods": pods}
+
+
+def release_test_pods(namespace: str, lease: str, kube: Optional[KubeClient] = None) -> Dict[str, Any]:
+    """Drop a run's lease and scale the deployment down to the most any remaining lease needs (at least 1)"""
+    kube = kube or KubeClient()
+    now = time.time()
+    with pod_leases(namespace).locked() as leases:
+        leases.pop(lease, None)
+        for held, entry in list(leases.items()):
+            if now - entry["at"] >= POD_LEASE_TTL:
+                del leases[held]
+        target = max([1] + [entry["replicas"] for entry in leases.values()])
+        current = kube.run(["get", "deployment", "test-pod", "-o", "jsonpath={.spec.replicas}"],
+                           namespace=namespace)
+        if current.returncode != 0:
+            return {"status": "error", "message": current.stderr.strip(), "namespace": namespace}
+        # A deployment the reaper scaled to zero stays there
+        if int(current.stdout.strip() or 0) > target:
+            scale = kube.run(["scale", "deployment", "test-pod", f"--replicas={target}"], namespace=namespace)
+            if scale.returncode != 0:
+                return {"status": "error", "message": scale.stderr.strip(), "namespace": namespace}
+    return {"status": "ok", "namespace": namespace, "replicas": target}
+
+
+def main():
+    try:
+        if len(sys.argv) != 4:
             print(json.dumps({
                 "status": "error",
-                "message": deploy.stderr.strip(),
-                "namespace": namespace
+                "message": "Required arguments: chatID userID projectType"
             }))
             sys.exit(1)
 
-        print(json.dumps({
-            "status": "created",
-            "namespace": namespace,
-            "project_type": project_type,
-            "timestamp": timestamp
-        }))
-        sys.exit(0)
+        kube = KubeClient()
+        result, code = handle_namespace(sys.argv[1], sys.argv[2], sys.argv[3],
+                                        kube=kube, pool=PoolManager.from_env(kube),
+                                        lifecycle=NamespaceLifecycle.from_env(kube))
+        print(json.dumps(result))
+        sys.exit(code)
 
     except Exception as e:
         print(json.dumps({
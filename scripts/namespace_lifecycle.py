@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from kube_client import KubeClient
+from state_store import JsonState
+
+POOL_PREFIX = "im-pool-"
+# Set on the chat namespaces namespace_handler creates; the reaper leaves
+# every other namespace alone
+MANAGED_LABEL = "backend.im/managed-by"
+MANAGED_BY = "namespace-handler"
+
+
+def apply_quota(kube: KubeClient, namespace: str, project_type: str,
+                templates_dir: str = "deployments/templates") -> Optional[str]:
+    """Apply the template's ResourceQuota/LimitRange, if it has one; returns an error message on failure"""
+    quota_path = os.path.join(templates_dir, project_type, "quota.yaml")
+    if not os.path.exists(quota_path):
+        return None
+    applied = kube.run(["apply", "-f", quota_path], namespace=namespace)
+    return applied.stderr.strip() if applied.returncode != 0 else None
+
+
+class NamespaceLifecycle:
+    """Scales idle chat/user namespaces to zero and deletes long-idle ones
+
+    Last-used times live in namespaces.json under IM_STATE_DIR and are
+    refreshed whenever a namespace is looked up or tested in. After
+    idle_ttl seconds the test-pod deployment is scaled to zero; the next
+    message scales it back up (rewarm). After delete_ttl the namespace is
+    deleted and the next message creates it again. Only namespaces carrying
+    MANAGED_LABEL are reaped; warm pool namespaces are left to the
+    PoolManager. kubectl is never called while namespaces.json is locked.
+    """
+
+    def __init__(self, kube: KubeClient, idle_ttl: float, delete_ttl: float):
+        self.kube = kube
+        self.idle_ttl = idle_ttl
+        self.delete_ttl = delete_ttl
+        self.state = JsonState("namespaces.json")
+
+    @classmethod
+    def from_env(cls, kube: KubeClient) -> Optional["NamespaceLifecycle"]:
+        if os.environ.get("NAMESPACE_REAPER", "0") != "1":
+            return None
+        return cls(kube, float(os.environ.get("NAMESPACE_IDLE_TTL", "1800")),
+                   float(os.environ.get("NAMESPACE_DELETE_TTL", "86400")))
+
+    def touch(self, namespace: str, project_type: str = "") -> bool:
+        """Record use of namespace, returning True if it had been scaled to zero"""
+        if namespace.startswith(POOL_PREFIX):
+            return False
+        with self.state.locked() as namespaces:
+            entry = namespaces.setdefault(namespace, {})
+            entry["last_used"] = time.time()
+            if project_type:
+                entry["project_type"] = project_type
+            return entry.pop("scaled_down", False)
+
+    def rewarm(self, namespace: str) -> Optional[str]:
+        """Scale a reaped test deployment back to one replica and wait for its pod; returns an error message on failure"""
+        scale = self.kube.run(["scale", "deployment", "test-pod", "--replicas=1"], namespace=namespace)
+        if scale.returncode != 0:
+            return scale.stderr.strip()
+        # `kubectl wait -l` fails outright if it runs before the pod exists
+        rollout = self.kube.rollout_status(namespace)
+        if rollout.returncode != 0:
+            return rollout.stderr.strip()
+        return None
+
+    def forget(self, namespace: str):
+        with self.state.locked() as namespaces:
+            namespaces.pop(namespace, None)
+
+    def reap(self) -> Dict[str, Any]:
+        """Scale down idle namespaces and delete long-idle ones"""
+        report: Dict[str, Any] = {"status": "ok", "scaled_down": [], "deleted": [], "tracked": 0}
+        managed = self._managed_namespaces()
+        if managed is None:
+            report["status"] = "error"
+            return report
+        self._adopt(managed)
+
+        # Claim the work under the lock, then call kubectl without it. A
+        # namespace is marked scaled_down before it is scaled, so a message
+        # arriving meanwhile rewarms it.
+        now = time.time()
+        to_delete, to_scale = [], []
+        with self.state.locked() as namespaces:
+            for namespace, entry in list(namespaces.items()):
+                idle = now - entry.get("last_used", now)
+                if namespace not in managed:
+                    if idle >= self.delete_ttl:
+                        # Gone, or never ours to reap
+                        del namespaces[namespace]
+                elif idle >= self.delete_ttl:
+                    to_delete.append(namespace)
+                elif idle >= self.idle_ttl and not entry.get("scaled_down"):
+                    entry["scaled_down"] = True
+                    to_scale.append((namespace, entry.get("last_used")))
+
+        deleted, failed, vanished = [], [], []
+        for namespace in to_delete:
+            result = self.kube.run(["delete", "namespace", namespace, "--wait=false"])
+            if result.returncode == 0 or "NotFound" in result.stderr:
+                deleted.append(namespace)
+            else:
+                sys.stderr.write(f"reaper: failed to delete {namespace}: {result.stderr.strip()}\n")
+        for namespace, _ in to_scale:
+            result = self.kube.run(["scale", "deployment", "test-pod", "--replicas=0"], namespace=namespace)
+            if result.returncode == 0:
+                report["scaled_down"].append(namespace)
+            elif "NotFound" in result.stderr:
+                # Deleted behind our back
+                vanished.append(namespace)
+            else:
+                failed.append(namespace)
+                sys.stderr.write(f"reaper: failed to scale down {namespace}: {result.stderr.strip()}\n")
+
+        touched = []
+        with self.state.locked() as namespaces:
+            for namespace in deleted + vanished:
+                namespaces.pop(namespace, None)
+            for namespace, last_used in to_scale:
+                entry = namespaces.get(namespace)
+                if entry is None:
+                    continue
+                if namespace in failed:
+                    entry.pop("scaled_down", None)
+                elif entry.get("last_used") != last_used and not entry.get("scaled_down"):
+                    # Used (and its scaled_down flag consumed) while we were
+                    # scaling it down; the pod it expects must come back
+                    touched.append(namespace)
+            report["tracked"] = len(namespaces)
+        report["deleted"] = deleted
+
+        for namespace in touched:
+            error = self.rewarm(namespace)
+            if error:
+                sys.stderr.write(f"reaper: failed to rewarm {namespace}: {error}\n")
+        return report
+
+    def _managed_namespaces(self) -> Optional[List[str]]:
+        """Chat namespaces carrying MANAGED_LABEL, or None if they cannot be listed"""
+        listed = self.kube.run(["get", "namespaces", "-l", f"{MANAGED_LABEL}={MANAGED_BY}",
+                                "-o", "jsonpath={.items[*].metadata.name}"])
+        if listed.returncode != 0:
+            sys.stderr.write(f"reaper: failed to list namespaces: {listed.stderr.strip()}\n")
+            return None
+        return [name for name in listed.stdout.split() if not name.startswith(POOL_PREFIX)]
+
+    def _adopt(self, existing: List[str]):
+        """Start the idle clock for chat namespaces created before tracking began"""
+        namespaces = self.state.read()
+        untracked = [name for name in existing if name not in namespaces]
+        if not untracked:
+            return
+        now = time.time()
+        with self.state.locked() as namespaces:
+            for name in untracked:
+                namespaces.setdefault(name, {"last_used": now})
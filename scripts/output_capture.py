@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+import gzip
+import os
+import re
+import shutil
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from state_store import STATE_DIR
+
+RUN_ID = re.compile(r"^[0-9a-f]{8,64}$")
+STREAMS = ("stdout", "stderr")
+
+
+class BoundedCapture:
+    """Keeps the first head_bytes and last tail_bytes of a stream in memory
+
+    Sizes are UTF-8 encoded bytes, cut at character boundaries. Everything
+    written is also appended to an optional gzip artifact, so the inline copy
+    can stay small however much a test suite prints.
+    """
+
+    def __init__(self, head_bytes: int, tail_bytes: int, artifact_path: Optional[str] = None):
+        self.head_bytes = head_bytes
+        self.tail_bytes = tail_bytes
+        self.total = 0
+        self._head: list = []
+        self._head_size = 0
+        self._tail: Deque[Tuple[str, int]] = deque()
+        self._tail_size = 0
+        self.artifact_path = artifact_path
+        self._artifact = gzip.open(artifact_path, "wt", encoding="utf-8", compresslevel=6) \
+            if artifact_path else None
+
+    def write(self, text: str):
+        if not text:
+            return
+        data = text.encode("utf-8", errors="replace")
+        self.total += len(data)
+        if self._artifact is not None:
+            self._artifact.write(text)
+
+        # Once anything has gone to the tail the head is closed, even if a
+        # character too wide for its last bytes left room
+        if not self._tail and self._head_size < self.head_bytes:
+            head = data[:self.head_bytes - self._head_size].decode("utf-8", errors="ignore")
+            self._head.append(head)
+            used = len(head.encode("utf-8", errors="replace"))
+            self._head_size += used
+            text, data = text[len(head):], data[used:]
+            if not text:
+                return
+
+        self._tail.append((text, len(data)))
+        self._tail_size += len(data)
+        while self._tail and self._tail_size - self._tail[0][1] >= self.tail_bytes:
+            self._tail_size -= self._tail.popleft()[1]
+
+    @property
+    def truncated(self) -> bool:
+        return self.total > self._head_size + min(self._tail_size, self.tail_bytes)
+
+    def text(self) -> str:
+        """Head and tail joined by a marker noting how much was left out"""
+        head = "".join(self._head)
+        tail = "".join(text for text, _ in self._tail)
+        tail_size = self._tail_size
+        if tail_size > self.tail_bytes:
+            data = tail.encode("utf-8", errors="replace")[tail_size - self.tail_bytes:]
+            tail = data.decode("utf-8", errors="ignore")
+            tail_size = len(tail.encode("utf-8", errors="replace"))
+        omitted = self.total - self._head_size - tail_size
+        if omitted <= 0:
+            return head + tail
+        return f"{head}\n... [{omitted} bytes omitted, full log in artifact] ...\n{tail}"
+
+    def close(self):
+        if self._artifact is not None:
+            self._artifact.close()
+            self._artifact = None
+
+
+class ArtifactStore:
+    """Gzipped full test logs under ARTIFACT_DIR/<run id>/<stream>.log.gz
+
+    The server serves them at /artifacts/<run id>/<stream>; the oldest runs
+    are deleted once the store grows past ARTIFACT_MAX_MB.
+    """
+
+    def __init__(self, root: str, max_bytes: int):
+        self.root = root
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def from_env(cls) -> "ArtifactStore":
+        root = os.environ.get("ARTIFACT_DIR", os.path.join(STATE_DIR, "artifacts"))
+        return cls(root, int(os.environ.get("ARTIFACT_MAX_MB", "1024")) * 1024 * 1024)
+
+    def capture(self, run_id: str, stream: str, head_bytes: int, tail_bytes: int) -> BoundedCapture:
+        if not RUN_ID.match(run_id) or stream not in STREAMS:
+            return BoundedCapture(head_bytes, tail_bytes)
+        run_dir = os.path.join(self.root, run_id)
+        os.makedirs(run_dir, exist_ok=True)
+        return BoundedCapture(head_bytes, tail_bytes, os.path.join(run_dir, f"{stream}.log.gz"))
+
+    def describe(self, run_id: str, captures: Dict[str, BoundedCapture]) -> Dict[str, Any]:
+        """Summary for the result: sizes and where to fetch each full log"""
+        info: Dict[str, Any] = {"run_id": run_id}
+        for stream, capture in captures.items():
+            info[stream] = {
+                "size": capture.total,
+                "truncated": capture.truncated,
+                "url": f"/artifacts/{run_id}/{stream}" if capture.artifact_path else ""
+            }
+        return info
+
+    def prune(self):
+        """Delete whole runs, oldest first, until the store fits its budget"""
+        try:
+            runs = [os.path.join(self.root, name) for name in os.listdir(self.root)]
+        except FileNotFoundError:
+            return
+        sized = []
+        total = 0
+        for run_dir in runs:
+            try:
+                size = sum(entry.stat().st_size for entry in os.scandir(run_dir))
+                sized.append((os.path.getmtime(run_dir), size, run_dir))
+                total += size
+            except OSError:
+                continue
+        for _, size, run_dir in sorted(sized):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(run_dir, ignore_errors=True)
+            total -= size
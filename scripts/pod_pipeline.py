@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+import base64
+import os
+import shlex
+from typing import IO, Any, Dict, List, Optional, Tuple, Union
+
+# Helpers shipped ahead of every pipeline. Step output is kept in a log file
+# and only replayed (as @@ERR@@ lines) when the step fails, so plain stdout
+# lines always belong to the test command. The test command's stderr is
+# framed as @@ERR@@ lines as it is written. Scratch files live in $IM_TMP,
+# private to the run, so concurrent runs on one pod never share them.
+PRELUDE = r"""
+im_step() { printf '@@STEP@@ %s %s %s\n' "$1" "$(date +%s%3N)" "$2"; }
+im_run() {
+    im_id=$1
+    sh -c "$2" >"$IM_TMP/step.log" 2>&1
+    im_rc=$?
+    if [ $im_rc -ne 0 ]; then
+        sed 's/^/@@ERR@@ /' "$IM_TMP/step.log"
+        printf '@@FAIL@@ %s %s\n' "$im_id" "$im_rc"
+        exit $im_rc
+    fi
+}
+im_err() { while IFS= read -r im_line || [ -n "$im_line" ]; do printf '@@ERR@@ %s\n' "$im_line"; done; }
+"""
+
+DEPS_ROOT = "/app/.deps"
+
+# pytest (any template) writes a JUnit report that is streamed back gzipped
+# and base64-encoded as @@JUNIT@@ lines; other test commands simply send none
+JUNIT_SETUP = ('rm -f {dir}/junit.xml; export PYTEST_ADDOPTS="${{PYTEST_ADDOPTS:-}} '
+               '--junitxml={dir}/junit.xml -o junit_family=xunit1"')
+JUNIT_EMIT = "[ -f {dir}/junit.xml ] && gzip -c {dir}/junit.xml | base64 | sed 's/^/@@JUNIT@@ /'"
+
+# The test command's stdout goes straight out on fd 3 while its stderr is
+# piped through im_err; its exit code comes back on fd 4
+TEST_TEMPLATE = """{junit_setup}
+exec 3>&1
+im_rc=$( {{ {{ ({command}) 2>&1 1>&3 3>&- 4>&-; echo $? >&4; }} | im_err >&3 3>&-; }} 4>&1 )
+exec 3>&-
+{junit_emit}
+{cover_emit}
+printf '@@END@@ {step_id} %s\\n' "$im_rc"
+exit $im_rc"""
+
+# A sharded run loads pytest_shard.py into pytest as "im_shard", keeping only
+# this pod's share of the collected tests
+SHARD_PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pytest_shard.py")
+SHARD_SETUP = ('export IM_SHARD={index}/{count} IM_SHARD_DURATIONS={dir}/durations.json '
+               'PYTHONPATH="{dir}${{PYTHONPATH:+:$PYTHONPATH}}" '
+               'PYTEST_ADDOPTS="${{PYTEST_ADDOPTS:-}} -p im_shard"')
+
+# An incremental run loads pytest_impact.py as "im_impact", which skips the
+# tests the plan deselects or, on a full run, records the repo files each
+# test executes; that map is streamed back like the JUnit report, as @@COVER@@
+IMPACT_PLUGIN = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pytest_impact.py")
+IMPACT_SETUP = ('rm -f {dir}/coverage.json; export IM_IMPACT={dir}/plan.json IM_IMPACT_COVERAGE={dir}/coverage.json '
+                'PYTHONPATH="{dir}${{PYTHONPATH:+:$PYTHONPATH}}" '
+                'PYTEST_ADDOPTS="${{PYTEST_ADDOPTS:-}} -p im_impact"')
+COVER_EMIT = "[ -f {dir}/coverage.json ] && gzip -c {dir}/coverage.json | base64 | sed 's/^/@@COVER@@ /'"
+
+# A cancelled run is stopped in the pod through the pid file its script
+# writes: the process tree under that pid is found by walking /proc, which
+# needs nothing beyond the shell, and is sent SIGTERM, then SIGKILL.
+KILL_TEMPLATE = r"""
+im_pid=$(cat {pid_file} 2>/dev/null) || exit 0
+im_tree() {{
+    echo "$1"
+    for im_proc in /proc/[0-9]*; do
+        [ "$(sed 's/.*) //' "$im_proc/stat" 2>/dev/null | cut -d' ' -f2)" = "$1" ] && im_tree "${{im_proc#/proc/}}"
+    done
+}}
+im_pids=$(im_tree "$im_pid")
+kill -TERM $im_pids 2>/dev/null
+sleep {grace}
+kill -KILL $im_pids 2>/dev/null
+rm -rf {run_dir}
+exit 0
+"""
+
+DEPS_TEMPLATE = r"""
+# The interpreter and base image are part of the key: a venv only works with the Python it was built for
+export IM_DEPS_HASH=$(cd {repo_dir} && {{ python -VV 2>&1; cat /etc/os-release requirements.txt pyproject.toml 2>/dev/null; }} | sha256sum | cut -c1-16)
+export IM_DEPS_ENV={root}/$IM_DEPS_HASH
+mkdir -p {root}
+if [ -f "$IM_DEPS_ENV/.ready" ]; then
+    touch "$IM_DEPS_ENV/.ready"
+    printf '@@DEPS@@ %s hit 0 %s %s\n' "$IM_DEPS_HASH" "$(cat "$IM_DEPS_ENV/.install_ms" 2>/dev/null || echo 0)" "$IM_DEPS_ENV"
+else
+    im_start=$(date +%s%3N)
+    im_run {step_id} {install}
+    im_ms=$(( $(date +%s%3N) - im_start ))
+    echo "$im_ms" > "$IM_DEPS_ENV/.install_ms"
+    touch "$IM_DEPS_ENV/.ready"
+    printf '@@DEPS@@ %s miss %s 0 %s\n' "$IM_DEPS_HASH" "$im_ms" "$IM_DEPS_ENV"
+    # Evict least recently used environments until they fit under the size cap;
+    # the shared .pip wheel cache is not counted, as evicting environments cannot shrink it
+    while [ "$(du -sk {root}/*/ 2>/dev/null | awk '{{kb += $1}} END {{print kb + 0}}')" -gt {cap_kb} ]; do
+        im_victim=$(ls -1tr {root}/*/.ready 2>/dev/null | grep -v "/$IM_DEPS_HASH/" | head -n 1)
+        [ -z "$im_victim" ] && break
+        rm -rf "$(dirname "$im_victim")"
+    done
+fi
+export VIRTUAL_ENV="$IM_DEPS_ENV" PATH="$IM_DEPS_ENV/bin:$PATH"
+"""
+
+
+class PipelineScript:
+    """Builds one shell script that runs every setup and test step inside the pod"""
+
+    def __init__(self, run_id: str):
+        # The run's scratch directory in the pod, removed when the script exits
+        self.tmp = run_dir(run_id)
+        # Plain script lines, or (dest, path) pairs for files streamed into the pod
+        self.lines: List[Union[str, Tuple[str, str]]] = [
+            f"IM_TMP={self.tmp}; mkdir -p \"$IM_TMP\"; trap 'rm -rf \"$IM_TMP\"' EXIT", PRELUDE]
+        self.commands: Dict[str, str] = {}  # step id -> command, for error attribution
+
+    def track(self, pid_file: str):
+        """Record the script's pid in pid_file (see run_pid_file) for kill_script while it runs"""
+        self.lines.append(track_command(pid_file))
+
+    def step(self, step_id: str, description: str):
+        self.lines.append(f"im_step {step_id} {shlex.quote(description)}")
+
+    def run(self, step_id: str, command: str):
+        self.commands[step_id] = command
+        self.lines.append(f"im_run {step_id} {shlex.quote(command)}")
+
+    def raw(self, text: str):
+        self.lines.append(text)
+
+    def emit(self, kind: str, shell_expr: str):
+        """Stream a marker whose payload is evaluated in the pod"""
+        self.lines.append(f"printf '@@{kind}@@ %s\\n' \"{shell_expr}\"")
+
+    def test(self, step_id: str, command: str):
+        """Run the test command with stdout streamed live and stderr framed as @@ERR@@ lines, also live"""
+        self.commands[step_id] = command
+        self.lines.append(TEST_TEMPLATE.format(
+            junit_setup=JUNIT_SETUP.format(dir=self.tmp),
+            command=command,
+            junit_emit=JUNIT_EMIT.format(dir=self.tmp),
+            cover_emit=COVER_EMIT.format(dir=f"{self.tmp}/impact"),
+            step_id=step_id
+        ))
+
+    def shard(self, index: int, count: int, durations_path: str):
+        """Make the following pytest run keep only shard index of count, planned from durations_path"""
+        shard_dir = f"{self.tmp}/shard"
+        self.raw(f"mkdir -p {shard_dir}")
+        self.attach(f"{shard_dir}/im_shard.py", SHARD_PLUGIN)
+        self.attach(f"{shard_dir}/durations.json", durations_path)
+        self.raw(SHARD_SETUP.format(index=index, count=count, dir=shard_dir))
+
+    def impact(self, plan_path: str):
+        """Make the following pytest run follow the incremental selection plan in plan_path"""
+        impact_dir = f"{self.tmp}/impact"
+        self.raw(f"mkdir -p {impact_dir}")
+        self.attach(f"{impact_dir}/im_impact.py", IMPACT_PLUGIN)
+        self.attach(f"{impact_dir}/plan.json", plan_path)
+        self.raw(IMPACT_SETUP.format(dir=impact_dir))
+
+    def revision(self, repo_dir: str):
+        """Stream "@@REV@@ <HEAD sha> <parent sha>" for the checked-out commit"""
+        self.emit("REV", f"$(cd {repo_dir} && git rev-parse HEAD) "
+                         f"$(cd {repo_dir} && git rev-parse -q --verify HEAD^ 2>/dev/null)")
+
+    def dependencies(self, step_id: str, repo_dir: str, cap_mb: int):
+        """Install requirements into a virtualenv cached per requirements hash
+
+        Environments live under DEPS_ROOT keyed by a hash of the Python
+        version, the base image's os-release, requirements.txt and
+        pyproject.toml. They share one pip wheel cache and are evicted
+        least-recently-used once together they exceed cap_mb. The
+        outcome is streamed as "@@DEPS@@ <hash> <hit|miss> <install_ms> <saved_ms> <env>".
+        """
+        install = (
+            'rm -rf "$IM_DEPS_ENV" && python -m venv --system-site-packages "$IM_DEPS_ENV" && '
+            f'cd {repo_dir} && "$IM_DEPS_ENV/bin/pip" install --quiet '
+            f'--cache-dir {DEPS_ROOT}/.pip -r requirements.txt'
+        )
+        self.commands[step_id] = install
+        self.raw(DEPS_TEMPLATE.format(
+            root=DEPS_ROOT,
+            repo_dir=repo_dir,
+            cap_kb=cap_mb * 1024,
+            step_id=step_id,
+            install=shlex.quote(install)
+        ))
+
+    def attach(self, dest: str, path: str):
+        """Ship a local file into the pod as a base64 heredoc written to dest"""
+        self.lines.append((dest, path))
+
+    def render(self) -> str:
+        return "\n".join(line for line in self.lines if isinstance(line, str)) + "\n"
+
+    def write_to(self, stream: IO[str]):
+        """Write the script, streaming attachments without holding them in memory"""
+        for line in self.lines:
+            if isinstance(line, str):
+                stream.write(line + "\n")
+                continue
+            dest, path = line
+            stream.write(f"base64 -d > {shlex.quote(dest)} <<'IM_ATTACHMENT'\n")
+            with open(path, "rb") as f:
+                # 57 raw bytes encode to one 76-character base64 line
+                while True:
+                    chunk = f.read(57 * 1024)
+                    if not chunk:
+                        break
+                    stream.write(base64.encodebytes(chunk).decode())
+            stream.write("IM_ATTACHMENT\n")
+
+
+def run_dir(run_id: str) -> str:
+    return f"/tmp/im-run-{run_id}"
+
+
+def run_pid_file(run_id: str) -> str:
+    return f"{run_dir(run_id)}/pid"
+
+
+def track_command(pid_file: str) -> str:
+    """Shell line that records the current shell's pid until it exits, then removes the run's directory"""
+    directory = shlex.quote(os.path.dirname(pid_file))
+    return f"mkdir -p {directory} && echo $$ > {shlex.quote(pid_file)}; trap 'rm -rf {directory}' EXIT"
+
+
+def kill_script(pid_file: str, grace: int = 2) -> str:
+    """Script that stops the process tree recorded in pid_file, if still running, and removes the run's directory"""
+    return KILL_TEMPLATE.format(pid_file=shlex.quote(pid_file), run_dir=shlex.quote(os.path.dirname(pid_file)),
+                                grace=grace)
+
+
+def parse_dependency_cache(payload: str) -> Dict[str, Any]:
+    """Decode a @@DEPS@@ payload into the result's dependency_cache entry"""
+    deps_hash, outcome, install_ms, saved_ms, env = payload.split(" ", 4)
+    return {
+        "hash": deps_hash,
+        "hit": outcome == "hit",
+        "env": env,
+        "install_seconds": round(int(install_ms) / 1000, 2),
+        "saved_seconds": round(int(saved_ms) / 1000, 2)
+    }
+
+
+def parse_marker(line: str) -> Optional[Tuple[str, str]]:
+    """Split a "@@KIND@@ payload" line, returning None for plain output"""
+    if not line.startswith("@@"):
+        return None
+    end = line.find("@@", 2)
+    if end < 0:
+        return None
+    payload = line[end + 2:].rstrip("\n")
+    return line[2:end], payload[1:] if payload.startswith(" ") else payload
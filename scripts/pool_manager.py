@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+import json
+import os
+import secrets
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from kube_client import KubeClient
+from namespace_lifecycle import apply_quota
+from state_store import JsonState
+
+POOL_LABEL = "backend.im/pool"
+STATE_LABEL = "backend.im/state"
+OWNER_LABEL = "backend.im/owner"
+
+
+def parse_pool_sizes(spec: str, project_types: List[str]) -> Dict[str, int]:
+    """Read WARM_POOL_SIZE: either one count for every template or "fastapi=2,django=1\""""
+    spec = spec.strip()
+    if not spec:
+        return {}
+    if spec.isdigit():
+        return {project_type: int(spec) for project_type in project_types}
+    sizes = {}
+    for entry in spec.split(","):
+        project_type, _, count = entry.partition("=")
+        if count.strip().isdigit():
+            sizes[project_type.strip().lower()] = int(count)
+    return sizes
+
+
+class PoolManager:
+    """Keeps pre-provisioned, ready test namespaces per project template
+
+    Pooled namespaces are named im-pool-<type>-<suffix> and labelled with
+    their pool and state (warming, ready, leased). A chat/user namespace
+    that does not exist yet leases a ready one instead of waiting for a
+    fresh deployment; leases live in leases.json under IM_STATE_DIR.
+    kubectl is never called while leases.json is locked.
+    """
+
+    def __init__(self, kube: KubeClient, sizes: Dict[str, int], idle_ttl: float,
+                 templates_dir: str = "deployments/templates"):
+        self.kube = kube
+        self.sizes = sizes
+        self.idle_ttl = idle_ttl
+        self.templates_dir = templates_dir
+        self.leases = JsonState("leases.json")
+
+    @classmethod
+    def from_env(cls, kube: KubeClient) -> Optional["PoolManager"]:
+        templates_dir = "deployments/templates"
+        project_types = sorted(os.listdir(templates_dir)) if os.path.isdir(templates_dir) else []
+        sizes = parse_pool_sizes(os.environ.get("WARM_POOL_SIZE", ""), project_types)
+        if not any(sizes.values()):
+            return None
+        return cls(kube, sizes, float(os.environ.get("WARM_POOL_IDLE_TTL", "3600")), templates_dir)
+
+    def lookup(self, owner: str) -> Optional[str]:
+        """Return the namespace leased to owner, refreshing its last-used time"""
+        if owner not in self.leases.read():
+            return None
+        with self.leases.locked() as leases:
+            lease = leases.get(owner)
+            if lease is None:
+                return None
+            lease["last_used"] = time.time()
+            return lease["namespace"]
+
+    def lease(self, owner: str, project_type: str) -> Optional[str]:
+        """Hand a ready pooled namespace to owner, or None if the pool is empty
+
+        The namespace is claimed in leases.json first and labelled after
+        the lock is released, so a slow kubectl never holds up other leases.
+        """
+        if not self.sizes.get(project_type):
+            return None
+        for namespace in self._pooled(project_type, "ready"):
+            now = time.time()
+            with self.leases.locked() as leases:
+                if owner in leases:
+                    # Leased by a concurrent request for the same owner
+                    return leases[owner]["namespace"]
+                if any(lease["namespace"] == namespace for lease in leases.values()):
+                    continue
+                leases[owner] = {
+                    "namespace": namespace,
+                    "project_type": project_type,
+                    "leased_at": now,
+                    "last_used": now
+                }
+            labelled = self.kube.run([
+                "label", "namespace", namespace, "--overwrite",
+                f"{STATE_LABEL}=leased", f"{OWNER_LABEL}={owner}"
+            ])
+            if labelled.returncode == 0:
+                return namespace
+            with self.leases.locked() as leases:
+                if leases.get(owner, {}).get("namespace") == namespace:
+                    del leases[owner]
+        return None
+
+    def release(self, namespace: str):
+        """Forget any lease pointing at namespace (e.g. after it was deleted)"""
+        with self.leases.locked() as leases:
+            for owner in [o for o, lease in leases.items() if lease["namespace"] == namespace]:
+                del leases[owner]
+
+    def maintain(self) -> Dict[str, Any]:
+        """Promote warmed namespaces, refill every pool and reclaim idle leases"""
+        report: Dict[str, Any] = {"status": "ok", "created": [], "ready": [], "reclaimed": []}
+
+        for project_type, size in self.sizes.items():
+            warming = self._pooled(project_type, "warming")
+            for namespace in warming:
+                if self._pods_ready(namespace):
+                    self._set_state(namespace, "ready")
+                    report["ready"].append(namespace)
+
+            pooled = len(warming) + len(self._pooled(project_type, "ready"))
+            for _ in range(size - pooled):
+                namespace = self._provision(project_type)
+                if namespace:
+                    report["created"].append(namespace)
+
+        # Idle leases are deleted outright; the pool refills with a fresh
+        # namespace. They are dropped from leases.json before kubectl runs.
+        now = time.time()
+        with self.leases.locked() as leases:
+            idle = {owner: lease for owner, lease in leases.items() if now - lease["last_used"] >= self.idle_ttl}
+            for owner in idle:
+                del leases[owner]
+
+        failed = {}
+        for owner, lease in idle.items():
+            deleted = self.kube.run(["delete", "namespace", lease["namespace"], "--wait=false"])
+            if deleted.returncode == 0 or "NotFound" in deleted.stderr:
+                report["reclaimed"].append(lease["namespace"])
+            else:
+                sys.stderr.write(f"warm pool: failed to delete {lease['namespace']}: {deleted.stderr.strip()}\n")
+                failed[owner] = lease
+        if failed:
+            # Keep the leases so the next pass retries, unless the owner took a new one meanwhile
+            with self.leases.locked() as leases:
+                for owner, lease in failed.items():
+                    leases.setdefault(owner, lease)
+
+        return report
+
+    def _pooled(self, project_type: str, state: str) -> List[str]:
+        result = self.kube.run([
+            "get", "namespaces", "-l", f"{POOL_LABEL}={project_type},{STATE_LABEL}={state}",
+            "-o", "jsonpath={.items[*].metadata.name}"
+        ])
+        return result.stdout.split() if result.returncode == 0 else []
+
+    def _pods_ready(self, namespace: str) -> bool:
+        wait = self.kube.run(["wait", "--for=condition=Ready", "pod", "-l", "app=test-pod", "--timeout=1s"],
+                             namespace=namespace)
+        return wait.returncode == 0 and "condition met" in wait.stdout
+
+    def _set_state(self, namespace: str, state: str):
+        self.kube.run(["label", "namespace", namespace, "--overwrite", f"{STATE_LABEL}={state}"])
+
+    def _provision(self, project_type: str) -> Optional[str]:
+        namespace = f"im-pool-{project_type}-{secrets.token_hex(3)}"
+        manifest = {
+            "apiVersion": "v1",
+            "kind": "Namespace",
+            "metadata": {
+                "name": namespace,
+                "labels": {POOL_LABEL: project_type, STATE_LABEL: "warming"}
+            }
+        }
+        create = self.kube.run(["apply", "-f", "-"], input=json.dumps(manifest))
+        if create.returncode != 0:
+            sys.stderr.write(f"warm pool: failed to create {namespace}: {create.stderr.strip()}\n")
+            return None
+
+        quota_error = apply_quota(self.kube, namespace, project_type, self.templates_dir)
+        if quota_error:
+            sys.stderr.write(f"warm pool: failed to apply quota to {namespace}: {quota_error}\n")
+            self.kube.run(["delete", "namespace", namespace, "--wait=false"])
+            return None
+
+        yaml_path = os.path.join(self.templates_dir, project_type, "test-pod.yaml")
+        deploy = self.kube.run(["apply", "-f", yaml_path], namespace=namespace)
+        if deploy.returncode != 0:
+            sys.stderr.write(f"warm pool: failed to deploy {namespace}: {deploy.stderr.strip()}\n")
+            self.kube.run(["delete", "namespace", namespace, "--wait=false"])
+            return None
+        return namespace
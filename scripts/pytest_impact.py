@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""pytest plugin for incremental runs
+
+The runner ships this file into the pod and loads it with "-p im_impact".
+IM_IMPACT names the run's plan (see impact_map.py). In "incremental" mode
+the tests listed under "deselect" are skipped. In "full" mode every test
+runs, and the repo files each one executes are written to
+IM_IMPACT_COVERAGE as {test id: [paths relative to the rootdir]}.
+"""
+import json
+import os
+import sys
+import threading
+from typing import Dict, Optional, Set
+
+import pytest
+
+
+class FileRecorder:
+    """Collects the repo files whose Python functions are called, via the profile hook
+
+    Profiling only sees function calls, not every line, so it is much
+    cheaper than line coverage and enough to tell which files a test uses.
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.join(os.path.realpath(root), "")
+        self.files: Set[str] = set()
+        # co_filename -> repo-relative path, or None outside the repo
+        self._paths: Dict[str, Optional[str]] = {}
+
+    def relative(self, filename: str) -> Optional[str]:
+        """filename relative to the root, resolving ".." and symlinks, or None if it is not a repo file"""
+        if filename not in self._paths:
+            # "<frozen os>", "<string>" and the like are not files at all
+            path = os.path.realpath(filename) if not filename.startswith("<") else ""
+            inside = path.startswith(self.root) and "site-packages" not in path
+            self._paths[filename] = path[len(self.root):] if inside else None
+        return self._paths[filename]
+
+    def profile(self, frame, event, arg):
+        if event == "call":
+            path = self.relative(frame.f_code.co_filename)
+            if path:
+                self.files.add(path)
+
+    def start(self):
+        self.files = set()
+        threading.setprofile(self.profile)
+        sys.setprofile(self.profile)
+
+    def stop(self) -> Set[str]:
+        sys.setprofile(None)
+        threading.setprofile(None)
+        return self.files
+
+
+def pytest_configure(config):
+    try:
+        with open(os.environ["IM_IMPACT"]) as f:
+            config._im_impact = json.load(f)
+    except (KeyError, OSError, ValueError):
+        config._im_impact = None
+    config._im_impact_coverage = {}
+    config._im_impact_recorder = None
+    config._im_impact_empty = False
+
+
+@pytest.hookimpl(tryfirst=True)
+def pytest_collection_modifyitems(session, config, items):
+    plan = config._im_impact
+    if not plan or plan.get("mode") != "incremental":
+        return
+    skip = set(plan.get("deselect", []))
+    selected = [item for item in items if item.nodeid not in skip]
+    deselected = [item for item in items if item.nodeid in skip]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+    items[:] = selected
+    config._im_impact_empty = bool(deselected) and not selected
+
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_protocol(item, nextitem):
+    plan = item.config._im_impact
+    if not plan or plan.get("mode") != "full":
+        yield
+        return
+    recorder = item.config._im_impact_recorder
+    if recorder is None:
+        recorder = item.config._im_impact_recorder = FileRecorder(str(item.config.rootpath))
+    recorder.start()
+    try:
+        yield
+    finally:
+        files = recorder.stop()
+    files.add(item.nodeid.split("::")[0])
+    item.config._im_impact_coverage[item.nodeid] = sorted(files)
+
+
+def pytest_sessionfinish(session, exitstatus):
+    config = session.config
+    # Nothing left to run after skipping the unaffected tests is a pass
+    if exitstatus == pytest.ExitCode.NO_TESTS_COLLECTED and config._im_impact_empty:
+        session.exitstatus = pytest.ExitCode.OK
+    if config._im_impact_coverage and os.environ.get("IM_IMPACT_COVERAGE"):
+        with open(os.environ["IM_IMPACT_COVERAGE"], "w") as f:
+            json.dump(config._im_impact_coverage, f)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""pytest plugin that keeps one shard of the collected tests
+
+The sharded runner ships this file into each pod and loads it with
+"-p im_shard". IM_SHARD="<index>/<count>" picks the shard and
+IM_SHARD_DURATIONS names a JSON file of known per-test durations. Every
+shard collects the same tests for the same commit and plans from the same
+durations, so the shards agree on the split without talking to each other.
+"""
+import json
+import os
+from typing import Dict, List
+
+import pytest
+
+
+def plan_shards(test_ids: List[str], durations: Dict[str, float], count: int) -> List[List[str]]:
+    """Split test_ids into count shards of roughly equal expected run time
+
+    Tests are placed longest first on the least loaded shard. Tests without
+    a recorded duration count as the median known one. With no history at
+    all, whole files are placed instead, weighted by their number of tests.
+    """
+    known = sorted(durations[test_id] for test_id in test_ids if test_id in durations)
+    if known:
+        default = known[len(known) // 2]
+        groups = [([test_id], durations.get(test_id, default)) for test_id in test_ids]
+    else:
+        by_file: Dict[str, List[str]] = {}
+        for test_id in test_ids:
+            by_file.setdefault(test_id.split("::")[0], []).append(test_id)
+        groups = [(ids, float(len(ids))) for ids in by_file.values()]
+
+    shards: List[List[str]] = [[] for _ in range(count)]
+    loads = [0.0] * count
+    for ids, weight in sorted(groups, key=lambda group: (-group[1], group[0][0])):
+        target = loads.index(min(loads))
+        shards[target].extend(ids)
+        loads[target] += weight
+    return shards
+
+
+@pytest.hookimpl(trylast=True)
+def pytest_collection_modifyitems(session, config, items):
+    spec = os.environ.get("IM_SHARD")
+    if not spec:
+        return
+    index, count = (int(part) for part in spec.split("/"))
+    try:
+        with open(os.environ["IM_SHARD_DURATIONS"]) as f:
+            durations = json.load(f)
+    except (KeyError, OSError, ValueError):
+        durations = {}
+
+    keep = set(plan_shards([item.nodeid for item in items], durations, count)[index])
+    selected = [item for item in items if item.nodeid in keep]
+    deselected = [item for item in items if item.nodeid not in keep]
+    if deselected:
+        config.hook.pytest_deselected(items=deselected)
+    items[:] = selected
+    config._im_shard_empty = bool(deselected) and not selected
+
+
+def pytest_sessionfinish(session, exitstatus):
+    # A shard the plan left empty has passed, not failed to collect
+    if exitstatus == pytest.ExitCode.NO_TESTS_COLLECTED and getattr(session.config, "_im_shard_empty", False):
+        session.exitstatus = pytest.ExitCode.OK
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+import fcntl
+import json
+import os
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator
+
+STATE_DIR = os.environ.get("IM_STATE_DIR", "state")
+
+
+class JsonState:
+    """JSON document under IM_STATE_DIR shared by every worker process"""
+
+    def __init__(self, name: str):
+        self.path = os.path.join(STATE_DIR, name)
+
+    def read(self) -> Dict[str, Any]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    @contextmanager
+    def locked(self) -> Iterator[Dict[str, Any]]:
+        """Hold an exclusive lock, yield the document and write it back on exit"""
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        with open(self.path + ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            data = self.read()
+            yield data
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
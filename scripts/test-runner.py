@@ -1,20 +1,100 @@
 #!/usr/bin/env python3
 import argparse
+import base64
+import gzip
 import json
+import os
+import secrets
+import shlex
+import signal
 import subprocess
 import sys
+import tempfile
+import threading
 import time
-from typing import Dict, Any, List
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from git_mirror import GitMirror
+from impact_map import ImpactMap
+from junit_report import DurationHistory, find_regressions, parse_junit, summarize
+from kube_client import KubeClient
+from namespace_lifecycle import NamespaceLifecycle
+from output_capture import ArtifactStore, BoundedCapture
+from pod_pipeline import PipelineScript, kill_script, parse_dependency_cache, parse_marker, run_pid_file
+
+OUTPUT_CHUNK_SIZE = 4096
+OUTPUT_FLUSH_INTERVAL = 0.25
+
+
+def write_temp_json(prefix: str, data: Any) -> str:
+    """Write data to a new temporary JSON file and return its path; the caller removes it"""
+    fd, path = tempfile.mkstemp(prefix=prefix, suffix=".json")
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    return path
+
+
+class RunCancelled(Exception):
+    """Raised at the runner's next checkpoint after cancel()"""
+
 
 class TestRunner:
-    def __init__(self, namespace: str, repo_url: str, commit: str, test_cmd: str, project_type: str):
+    def __init__(self, namespace: str, repo_url: str, commit: str, test_cmd: str, project_type: str,
+                 kube: Optional[KubeClient] = None, pipeline: Optional[bool] = None,
+                 on_event: Optional[Callable[[Dict[str, Any]], None]] = None, pod_name: str = "",
+                 pod_ready: bool = False, run_id: str = "",
+                 shard: Optional[Tuple[int, int, str]] = None, incremental: bool = False,
+                 selection: Optional[Dict[str, Any]] = None):
+        self.kube = kube or KubeClient()
+        self.on_event = on_event
+        self._pending_output: Dict[str, List[str]] = {"stdout": [], "stderr": []}
+        self._last_flush = time.monotonic()
+        self._streamed = 0
+        # Only OUTPUT_HEAD_KB + OUTPUT_TAIL_KB of each stream is kept inline;
+        # the full log goes to a gzipped artifact named after the run ID
+        self.run_id = run_id or secrets.token_hex(8)
+        self.artifacts = ArtifactStore.from_env()
+        self.head_bytes = int(os.environ.get("OUTPUT_HEAD_KB", "16")) * 1024
+        self.tail_bytes = int(os.environ.get("OUTPUT_TAIL_KB", "64")) * 1024
+        self.stream_max_bytes = int(os.environ.get("OUTPUT_STREAM_MAX_KB", "1024")) * 1024
+        # A passing test this much slower than on the parent commit is flagged
+        self.regression_ratio = float(os.environ.get("TEST_REGRESSION_RATIO", "1.5"))
+        self.regression_min_seconds = float(os.environ.get("TEST_REGRESSION_MIN_SECONDS", "0.1"))
+        self._revision = ("", "")
+        self._step_started = 0.0
+        # Ship all in-pod steps as one exec unless RUNNER_PIPELINE=0
+        if pipeline is None:
+            pipeline = os.environ.get("RUNNER_PIPELINE", "1") != "0"
+        self.pipeline = pipeline
+        self.deps_cache_mb = int(os.environ.get("DEPS_CACHE_MAX_MB", "2048"))
+        self.mirror = GitMirror.from_env() if pipeline else None
+        self._failed_step = ""
+        self._failure: Optional[subprocess.CalledProcessError] = None
         self.namespace = namespace
         self.repo_url = repo_url
         self.commit = commit
         self.test_cmd = test_cmd
         self.project_type = project_type
-        self.pod_name = ""
+        self.pod_name = pod_name  # run on this pod instead of the first test-pod found
+        self.pod_ready = pod_ready and bool(pod_name)  # the server just saw pod_name Ready
+        self._pod_unreachable = False
+        # (index, count, durations file): run only this share of the pytest suite
+        self.shard = shard
+        # Incremental runs skip the tests the commit's diff cannot affect (see
+        # impact_map.py); shards are handed the plan their parent made
+        self.impact = ImpactMap.from_env(repo_url, test_cmd) if incremental and self.mirror else None
+        self.selection = selection
+        self._plan_file = ""
+        self.coverage: Dict[str, List[str]] = {}
+        # Runs keep the namespace from being reaped as idle
+        self.lifecycle = NamespaceLifecycle.from_env(self.kube)
+        # cancel() may come from a signal handler at any point; it stops the
+        # running kubectl and the run ends at the next checkpoint
+        self.cancelled = False
+        self._proc: Optional[subprocess.Popen] = None
+        self.pid_file = run_pid_file(self.run_id)
         self.result: Dict[str, Any] = {
+            "run_id": self.run_id,
             "commit": commit,
             "status": "unknown",
             "success": False,
@@ -25,86 +105,78 @@ class TestRunner:
                 "kubectl_errors": []
             }
         }
+        if incremental and not self.impact:
+            self.result["selection"] = {"mode": "full", "reason": "needs the pipelined runner and git mirror"}
+
+    def cancel(self):
+        """Stop the run: kill the streaming kubectl exec and skip the remaining steps"""
+        self.cancelled = True
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+
+    def _check_cancelled(self):
+        if self.cancelled:
+            raise RunCancelled()
 
-    def run_kubectl(self, command: List[str], check: bool = True) -> subprocess.CompletedProcess:
+    def _popen(self, command: List[str], **kwargs) -> subprocess.Popen:
+        """Start a kubectl command that cancel() can stop"""
+        self._check_cancelled()
+        self._proc = self.kube.popen(command, namespace=self.namespace, **kwargs)
+        if self.cancelled:
+            self._proc.terminate()
+        return self._proc
+
+    def _stop_in_pod(self):
+        """Kill whatever the cancelled run left running inside the pod"""
+        if not self.pod_name:
+            return
+        stopped = self.kube.run(["exec", self.pod_name, "--", "sh", "-c", kill_script(self.pid_file)],
+                                namespace=self.namespace)
+        if stopped.returncode != 0:
+            self._log(f"could not stop the run in {self.pod_name}: {stopped.stderr.strip()}")
+
+    def run_kubectl(self, command: List[str], check: bool = True, step: str = "") -> subprocess.CompletedProcess:
         """Execute kubectl command and capture output"""
-        full_command = ["kubectl", "-n", self.namespace] + command
+        self._check_cancelled()
         try:
-            result = subprocess.run(
-                full_command,
-                capture_output=True,
-                text=True,
-                check=check
-            )
-            return result
+            return self.kube.run(command, namespace=self.namespace, check=check)
         except subprocess.CalledProcessError as e:
-            # Capture full command with quotes
-            err_cmd = ' '.join([f"'{arg}'" if ' ' in arg else arg for arg in full_command])
-            self.result["output"]["kubectl_errors"].append({
-                "command": err_cmd,
-                "error": e.stderr.strip()
-            })
+            self._record_kubectl_error(e, step)
             raise
 
+    def _record_kubectl_error(self, e: subprocess.CalledProcessError, step: str = ""):
+        """Attribute a failed kubectl call to the result
+
+        step names the in-pod step that failed, as the pipeline reports it;
+        calls that never reached the pod leave it out.
+        """
+        # Capture full command with quotes
+        err_cmd = ' '.join([f"'{arg}'" if ' ' in arg else arg for arg in e.cmd])
+        error = {"command": err_cmd, "error": e.stderr.strip()}
+        if step:
+            error["step"] = step
+        self.result["output"]["kubectl_errors"].append(error)
+
     def execute_test_run(self) -> Dict[str, Any]:
         """Main execution flow returning JSON results"""
-        start_time = time.time()
+        start_time = time.monotonic()
         
         try:
             self.result["steps"] = []
-            
-            # Find existing pod
-            self._add_step("Locating pod", "setup")
-            result = self.run_kubectl(["get", "pod", "-l", "app=test-pod", "-o", "jsonpath={.items[0].metadata.name}"])
-            self.pod_name = result.stdout.strip()
-            
-            # Wait for pod to be fully ready
-            self._add_step("Awaiting pod readiness", "pod_ready")
-            self.run_kubectl(["wait", "--for=condition=Ready", "pod", self.pod_name, "--timeout=180s"])
-            self._add_step("Pod ready", "setup_complete")
-
-            # Check if repo exists
-            self._add_step("Checking repository status", "repo_check")
-            repo_exists = self.run_kubectl(
-                ["exec", self.pod_name, "--", "sh", "-c", "test -d /app/repo/.git && echo exists"],
-                check=False
-            ).stdout.strip() == "exists"
-
-            if repo_exists:
-                # Update existing repo
-                self._add_step("Updating repository", "repo_update")
-                self.run_kubectl(["exec", self.pod_name, "--", "sh", "-c", 
-                                "cd /app/repo && git fetch origin && git reset --hard origin/main"])
+            self._touch_namespace()
+
+            if self.pipeline:
+                self._run_pipeline()
             else:
-                # Clone new repo
-                self._add_step("Cloning repository", "repo_clone")
-                self.run_kubectl(["exec", self.pod_name, "--", "sh", "-c", 
-                                f"git clone '{self.repo_url}' /app/repo"])
-
-            # Checkout specific commit
-            self._add_step("Checking out commit", "commit_checkout")
-            checkout_result = self.run_kubectl(["exec", self.pod_name, "--", "sh", "-c", 
-                              f"cd /app/repo && git checkout {self.commit} && git log -1 --pretty=format:%s"])
-            commit_message = checkout_result.stdout.strip()
-            self.result["commit_message"] = commit_message
-            self._add_step(f"Checked out: {commit_message}", "commit_verified")
-
-            # Install dependencies
-            self._add_step("Installing dependencies", "dependencies")
-            self.run_kubectl(["exec", self.pod_name, "--", "sh", "-c", 
-                            "cd /app/repo && pip install --quiet -r requirements.txt"])
-
-            # Run tests
-            self._add_step("Executing tests", "test_execution")
-            test_cmd = f"cd /app/repo && ({self.test_cmd})"  # Wrap in subshell
-            test_result = self.run_kubectl(["exec", self.pod_name, "--", "sh", "-c", test_cmd])
-            
-            # Capture results
-            self.result["output"]["stdout"] = test_result.stdout
-            self.result["output"]["stderr"] = test_result.stderr
+                self._run_stepwise()
+
             self.result["success"] = True
             self.result["status"] = "passed"
 
+        except RunCancelled:
+            self.result["status"] = "cancelled"
+            self.result["success"] = False
+            self._stop_in_pod()
         except subprocess.CalledProcessError as e:
             self.result["status"] = "failed"
             self.result["success"] = False
@@ -116,17 +188,627 @@ class TestRunner:
             self.result["status"] = "error"
             self.result["output"]["stderr"] = str(e)
         finally:
-            self.result["duration"] = round(time.time() - start_time, 2)
+            self._finish_step()
+            if self._plan_file:
+                os.unlink(self._plan_file)
+            if self.lifecycle:
+                self.lifecycle.touch(self.namespace, self.project_type)
+            elapsed = time.monotonic() - start_time
+            self.result["duration"] = round(elapsed, 2)
+            self.result["duration_ms"] = round(elapsed * 1000, 1)
         
         return self.result
 
-    def _add_step(self, description: str, step_id: str):
-        """Track execution steps"""
-        self.result["steps"].append({
+    def _touch_namespace(self):
+        """Mark the namespace used, scaling it back up if it was reaped since the server last looked"""
+        if not self.lifecycle or not self.lifecycle.touch(self.namespace, self.project_type):
+            return
+        self._log(f"namespace {self.namespace} was scaled down while idle, scaling it back up")
+        error = self.lifecycle.rewarm(self.namespace)
+        if error:
+            self._log(f"could not scale {self.namespace} back up: {error}")
+        # The pod the server named is gone; wait for its replacement
+        self.pod_name, self.pod_ready = "", False
+
+    def _run_stepwise(self):
+        """Run each setup and test step as its own kubectl call"""
+        # Find existing pod
+        self._add_step("Locating pod", "setup")
+        if not self.pod_name:
+            try:
+                result = self.kube.get_pod_name(self.namespace, "app=test-pod", check=True)
+            except subprocess.CalledProcessError as e:
+                self._record_kubectl_error(e)
+                raise
+            self.pod_name = result.stdout.strip()
+        
+        # Wait for pod to be fully ready
+        self._add_step("Awaiting pod readiness", "pod_ready")
+        self.run_kubectl(["wait", "--for=condition=Ready", "pod", self.pod_name, "--timeout=180s"])
+        self._add_step("Pod ready", "setup_complete")
+
+        # Check if repo exists
+        self._add_step("Checking repository status", "repo_check")
+        repo_exists = self.run_kubectl(
+            ["exec", self.pod_name, "--", "sh", "-c", "test -d /app/repo/.git && echo exists"],
+            check=False
+        ).stdout.strip() == "exists"
+
+        if repo_exists:
+            # Update existing repo
+            self._add_step("Updating repository", "repo_update")
+            self.run_kubectl(["exec", self.pod_name, "--", "sh", "-c", self._repo_update_command()],
+                             step="repo_update")
+        else:
+            # Clone new repo
+            self._add_step("Cloning repository", "repo_clone")
+            self.run_kubectl(["exec", self.pod_name, "--", "sh", "-c", 
+                            f"git clone '{self.repo_url}' /app/repo"], step="repo_clone")
+
+        # Checkout specific commit
+        self._add_step("Checking out commit", "commit_checkout")
+        checkout_result = self.run_kubectl(["exec", self.pod_name, "--", "sh", "-c", 
+                          f"cd /app/repo && git checkout {self.commit} && git log -1 --pretty=format:%s"],
+                          step="commit_checkout")
+        commit_message = checkout_result.stdout.strip()
+        self.result["commit_message"] = commit_message
+        self._add_step(f"Checked out: {commit_message}", "commit_verified")
+
+        # Install dependencies, reusing the pod's cached environment when unchanged
+        self._add_step("Installing dependencies", "dependencies")
+        deps = PipelineScript(self.run_id)
+        deps.revision("/app/repo")
+        deps.dependencies("dependencies", "/app/repo", self.deps_cache_mb)
+        deps_result = self.run_kubectl(["exec", self.pod_name, "--", "sh", "-c", deps.render()], step="dependencies")
+        for line in deps_result.stdout.splitlines():
+            marker = parse_marker(line)
+            if marker and marker[0] == "DEPS":
+                self.result["dependency_cache"] = parse_dependency_cache(marker[1])
+            elif marker and marker[0] == "REV":
+                self._set_revision(marker[1])
+        deps_env = self.result.get("dependency_cache", {}).get("env")
+
+        # Run tests
+        self._add_step("Executing tests", "test_execution")
+        script = PipelineScript(self.run_id)
+        script.track(self.pid_file)
+        script.raw("cd /app/repo")
+        if deps_env:
+            script.raw(f"export PATH={shlex.quote(deps_env)}/bin:$PATH")
+        script.test("test_execution", self.test_cmd)
+        exec_cmd = ["exec", self.pod_name, "--", "sh", "-c", script.render()]
+        captures = self._open_captures()
+        with tempfile.TemporaryFile(mode="w+") as stderr_file:
+            proc = self._popen(exec_cmd, stdout=subprocess.PIPE, stderr=stderr_file)
+            junit: List[str] = []
+            for line in proc.stdout:
+                marker = parse_marker(line)
+                if marker is None:
+                    captures["stdout"].write(line)
+                    self._stream_output("stdout", line)
+                elif marker[0] == "ERR":
+                    captures["stderr"].write(marker[1] + "\n")
+                    self._stream_output("stderr", marker[1] + "\n")
+                elif marker[0] == "JUNIT":
+                    junit.append(marker[1])
+            proc.wait()
+            stderr_file.seek(0)
+            for chunk in iter(lambda: stderr_file.read(OUTPUT_CHUNK_SIZE), ""):
+                captures["stderr"].write(chunk)
+                self._stream_output("stderr", chunk)
+        self._flush_output()
+
+        # Capture results
+        stdout, stderr = self._close_captures(captures)
+        self.result["output"]["stdout"] = stdout
+        self.result["output"]["stderr"] = stderr
+        self._check_cancelled()
+        self._report_tests(junit)
+        if proc.returncode != 0:
+            error = subprocess.CalledProcessError(
+                proc.returncode, [self.kube.kubectl, "-n", self.namespace] + exec_cmd, stdout, stderr)
+            self._record_kubectl_error(error, "test_execution")
+            raise error
+
+    def _run_pipeline(self):
+        """Run every in-pod step through a single streamed kubectl exec"""
+        self._add_step("Locating pod", "setup")
+        if self.pod_ready:
+            errors_before = len(self.result["output"]["kubectl_errors"])
+            try:
+                self._add_step("Pod ready", "setup_complete")
+                self._run_pipeline_on_pod()
+                return
+            except subprocess.CalledProcessError:
+                if not self._pod_unreachable:
+                    raise
+                # The server's view of the pod was stale; find a ready one and retry
+                del self.result["output"]["kubectl_errors"][errors_before:]
+                self.pod_name = ""
+
+        # One wait both confirms readiness and names the pod
+        self._add_step("Awaiting pod readiness", "pod_ready")
+        target = [self.pod_name] if self.pod_name else ["-l", "app=test-pod"]
+        ready = self.run_kubectl(["wait", "--for=condition=Ready", "pod"] + target + ["--timeout=180s"])
+        self.pod_name = ready.stdout.split()[0].split("/", 1)[-1]
+        self._add_step("Pod ready", "setup_complete")
+        self._run_pipeline_on_pod()
+
+    def _run_pipeline_on_pod(self):
+        """Ship the checkout and test steps to self.pod_name"""
+        if self.mirror is None:
+            self._exec_pipeline(self._pipeline_script())
+            return
+
+        # Resolve the commit against the shared mirror, touching upstream only if it is missing
+        self._add_step("Syncing repository mirror", "mirror_sync")
+        try:
+            sha = self.mirror.resolve(self.repo_url, self.commit)
+        except subprocess.CalledProcessError as e:
+            self._record_kubectl_error(e)
+            raise
+        if self.impact and self.selection is None:
+            self.selection = self.impact.plan(self.mirror, sha)
+            self._log(f"{self.selection['mode']} run: {self.selection['reason']}")
+
+        pod_key = f"{self.namespace}/{self.pod_name}"
+        have = self.mirror.shipped_to(pod_key)
+        while True:
+            try:
+                bundle = self.mirror.bundle(self.repo_url, sha, have)
+            except ValueError as e:
+                # Too large to ship inline; let the pod fetch from upstream
+                self._log(f"{e}, cloning from upstream instead")
+                self._exec_pipeline(self._pipeline_script())
+                return
+
+            errors_before = len(self.result["output"]["kubectl_errors"])
+            try:
+                self._exec_pipeline(self._pipeline_script(sha, bundle))
+                break
+            except subprocess.CalledProcessError:
+                if not self._failed_step:
+                    # The exec itself broke; nothing was checked out
+                    raise
+                if self._failed_step not in ("repo_update", "commit_checkout"):
+                    break
+                if not have:
+                    raise
+                # The pod lost commits shipped earlier (e.g. it was recycled); resend in full
+                del self.result["output"]["kubectl_errors"][errors_before:]
+                self.mirror.forget(pod_key)
+                have = []
+            finally:
+                if bundle:
+                    os.unlink(bundle)
+        self.mirror.mark_shipped(pod_key, sha)
+        self.mirror.prune_shipped(self.kube)
+
+        # Re-raise a test/dependency failure now that the checkout is recorded
+        if self._failed_step:
+            raise self._failure
+
+    def _exec_pipeline(self, script: PipelineScript):
+        """Ship script to the pod in one kubectl exec and parse its streamed markers"""
+        self._failed_step = ""
+        self._pod_unreachable = False
+        exec_cmd = ["exec", "-i", self.pod_name, "--", "sh", "-s"]
+        kubectl_stderr = tempfile.TemporaryFile()
+        proc = self._popen(exec_cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=kubectl_stderr)
+
+        # Feed the script from a thread so a chatty pod cannot deadlock us
+        def feed():
+            try:
+                script.write_to(proc.stdin)
+                proc.stdin.close()
+            except OSError:
+                pass
+        threading.Thread(target=feed, daemon=True).start()
+
+        captures = self._open_captures()
+        failed_step, failed_rc, test_rc = "", 0, None
+        junit: List[str] = []
+        cover: List[str] = []
+        started = False
+        for line in proc.stdout:
+            marker = parse_marker(line)
+            started = True
+            if marker is None:
+                captures["stdout"].write(line)
+                self._stream_output("stdout", line)
+                continue
+            kind, payload = marker
+            if kind == "STEP":
+                step_id, timestamp, description = payload.split(" ", 2)
+                self._add_step(description, step_id, int(timestamp) / 1000)
+            elif kind == "MSG":
+                self.result["commit_message"] = payload
+                self._add_step(f"Checked out: {payload}", "commit_verified")
+            elif kind == "DEPS":
+                self.result["dependency_cache"] = parse_dependency_cache(payload)
+            elif kind == "REV":
+                self._set_revision(payload)
+            elif kind == "JUNIT":
+                junit.append(payload)
+            elif kind == "COVER":
+                cover.append(payload)
+            elif kind == "ERR":
+                captures["stderr"].write(payload + "\n")
+                if test_rc is None and not failed_step:
+                    self._stream_output("stderr", payload + "\n")
+            elif kind == "FAIL":
+                failed_step, rc = payload.split()
+                failed_rc = int(rc)
+            elif kind == "END":
+                test_rc = int(payload.split()[1])
+        proc.wait()
+        self._flush_output()
+
+        stdout, stderr = self._close_captures(captures)
+        if self.cancelled:
+            self.result["output"]["stdout"] = stdout
+            self.result["output"]["stderr"] = stderr
+            raise RunCancelled()
+        self._read_coverage(cover)
+        self._report_tests(junit)
+        if failed_step or (test_rc is not None and test_rc != 0):
+            step_id = failed_step or "test_execution"
+            self.result["output"]["kubectl_errors"].append({
+                "command": script.commands[step_id],
+                "step": step_id,
+                "error": stderr.strip()
+            })
+            self._failed_step = step_id
+            self._failure = subprocess.CalledProcessError(
+                failed_rc or test_rc, script.commands[step_id], stdout, stderr)
+            raise self._failure
+        if test_rc is None:
+            # The exec itself broke before the script finished
+            self._pod_unreachable = not started
+            # Anything the pod wrote to stderr lands here too; keep only the end
+            kubectl_stderr.seek(max(0, kubectl_stderr.seek(0, os.SEEK_END) - self.tail_bytes))
+            error = subprocess.CalledProcessError(
+                proc.returncode or 1, [self.kube.kubectl, "-n", self.namespace] + exec_cmd,
+                stdout, kubectl_stderr.read().decode(errors="replace"))
+            self._record_kubectl_error(error)
+            raise error
+
+        # Capture results
+        self.result["output"]["stdout"] = stdout
+        self.result["output"]["stderr"] = stderr
+
+    def _repo_update_command(self) -> str:
+        """Fetch upstream into an existing /app/repo
+
+        A repo the mirror path initialised has no origin remote, so point
+        origin at the upstream URL before fetching.
+        """
+        url = shlex.quote(self.repo_url)
+        return (f"cd /app/repo && (git remote set-url origin {url} 2>/dev/null || git remote add origin {url}) "
+                f"&& git fetch origin && git reset --hard origin/main")
+
+    def _pipeline_script(self, sha: str = "", bundle: Optional[str] = None) -> PipelineScript:
+        """Build the in-pod step sequence mirroring _run_stepwise
+
+        With a mirror-resolved sha the pod gets its objects from bundle (or
+        already has them) and never contacts the upstream host.
+        """
+        script = PipelineScript(self.run_id)
+        script.track(self.pid_file)
+        script.step("repo_check", "Checking repository status")
+        if sha:
+            script.raw("[ -d /app/repo/.git ] || git init -q /app/repo")
+            if bundle:
+                script.step("repo_update", "Fetching commit from mirror")
+                script.attach(f"{script.tmp}/commit.bundle", bundle)
+                script.run("repo_update", f"cd /app/repo && git fetch -q {script.tmp}/commit.bundle "
+                                          f"refs/im/{sha}:refs/im/{sha}")
+        else:
+            script.raw("if [ -d /app/repo/.git ]; then")
+            script.step("repo_update", "Updating repository")
+            script.run("repo_update", self._repo_update_command())
+            script.raw("else")
+            script.step("repo_clone", "Cloning repository")
+            script.run("repo_clone", f"git clone {shlex.quote(self.repo_url)} /app/repo")
+            script.raw("fi")
+
+        script.step("commit_checkout", "Checking out commit")
+        script.run("commit_checkout", f"cd /app/repo && git checkout -q --force {shlex.quote(sha or self.commit)}")
+        script.emit("MSG", "$(cd /app/repo && git log -1 --pretty=format:%s)")
+        script.revision("/app/repo")
+
+        script.step("dependencies", "Installing dependencies")
+        script.dependencies("dependencies", "/app/repo", self.deps_cache_mb)
+
+        script.step("test_execution", "Executing tests")
+        script.raw("cd /app/repo")
+        if self.shard:
+            script.shard(*self.shard)
+        if self.selection:
+            if not self._plan_file:
+                self._plan_file = write_temp_json("im-impact-", self.selection)
+            script.impact(self._plan_file)
+        script.test("test_execution", self.test_cmd)
+        return script
+
+    def _set_revision(self, payload: str):
+        head, _, parent = payload.partition(" ")
+        self._revision = (head.strip(), parent.strip())
+
+    def _report_tests(self, junit: List[str]):
+        """Add per-test results from the JUnit report and flag slowdowns against the parent commit"""
+        if not junit:
+            return
+        try:
+            tests = parse_junit(gzip.decompress(base64.b64decode("".join(junit))).decode())
+        except (ValueError, OSError, SyntaxError) as e:
+            self._log(f"ignoring unreadable JUnit report: {e}")
+            return
+        self.result["tests"] = tests
+        self.result["test_summary"] = summarize(tests)
+        # A shard's tests are compared and recorded once all shards are merged
+        if not self.shard:
+            self._compare_history(self.result, tests)
+            self._record_impact(self.result, tests, self.coverage)
+
+    def _read_coverage(self, cover: List[str]):
+        if not cover:
+            return
+        try:
+            self.coverage = json.loads(gzip.decompress(base64.b64decode("".join(cover))))
+        except (ValueError, OSError) as e:
+            self._log(f"ignoring unreadable coverage map: {e}")
+
+    def _record_impact(self, result: Dict[str, Any], tests: List[Dict[str, Any]],
+                       coverage: Dict[str, List[str]]):
+        """Report which tests the selection skipped and update the map for later runs"""
+        if not self.impact or not self.selection:
+            return
+        result["selection"] = {key: value for key, value in self.selection.items() if key != "deselect"}
+        if self.selection["mode"] == "incremental":
+            self.impact.record_incremental(tests)
+        elif coverage and self._revision[0]:
+            self.impact.record_full(self._revision[0], coverage, tests)
+
+    def _compare_history(self, result: Dict[str, Any], tests: List[Dict[str, Any]]):
+        """Flag tests slower than on the parent commit and record this commit's durations"""
+        head, parent = self._revision
+        if not head:
+            return
+        history = DurationHistory(self.repo_url)
+        if parent:
+            result["parent_commit"] = parent
+            result["regressions"] = find_regressions(
+                tests, history.get(parent), self.regression_ratio, self.regression_min_seconds)
+        history.record(head, tests)
+
+    def _open_captures(self) -> Dict[str, BoundedCapture]:
+        return {stream: self.artifacts.capture(self.run_id, stream, self.head_bytes, self.tail_bytes)
+                for stream in ("stdout", "stderr")}
+
+    def _close_captures(self, captures: Dict[str, BoundedCapture]) -> Tuple[str, str]:
+        """Finish the artifacts, record where they are and return the inline text"""
+        for capture in captures.values():
+            capture.close()
+        self.result["artifacts"] = self.artifacts.describe(self.run_id, captures)
+        self.artifacts.prune()
+        return captures["stdout"].text(), captures["stderr"].text()
+
+    def _add_step(self, description: str, step_id: str, timestamp: Optional[float] = None):
+        """Track execution steps
+
+        timestamp (epoch seconds, from the pod for pipeline steps) is only for
+        display; durations come from the local monotonic clock, and each step
+        lasts until the next one starts.
+        """
+        self._finish_step()
+        if timestamp is None:
+            timestamp = time.time()
+        step = {
             "step": step_id,
             "description": description,
-            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
-        })
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(timestamp)) +
+                         f".{int(timestamp * 1000) % 1000:03d}Z"
+        }
+        self.result["steps"].append(step)
+        self._step_started = time.monotonic()
+        self._emit({"type": "step", **step})
+
+    def _finish_step(self):
+        """Close the running step, adding its duration to the per-step timings"""
+        steps = self.result.get("steps")
+        if not steps or "duration_ms" in steps[-1]:
+            return
+        duration_ms = round((time.monotonic() - self._step_started) * 1000, 1)
+        steps[-1]["duration_ms"] = duration_ms
+        timings = self.result.setdefault("timings", {})
+        timings[steps[-1]["step"]] = round(timings.get(steps[-1]["step"], 0) + duration_ms, 1)
+
+    def _emit(self, event: Dict[str, Any]):
+        """Forward a progress event to the listener, if any"""
+        if self.on_event is not None:
+            self.on_event({"commit": self.commit, "run_id": self.run_id, **event})
+
+    def _log(self, message: str):
+        sys.stderr.write(f"[run {self.run_id}] {message}\n")
+
+    def _stream_output(self, stream: str, text: str):
+        """Buffer test output and flush it as chunks of at most ~4KB or 250ms"""
+        if self.on_event is None or not text:
+            return
+        # Past the streaming budget the client gets one notice instead of the rest
+        if self._streamed >= self.stream_max_bytes:
+            return
+        self._streamed += len(text)
+        if self._streamed >= self.stream_max_bytes:
+            text += f"\n... [live output stopped after {self.stream_max_bytes // 1024}KB, " \
+                    f"see artifact {self.run_id}] ...\n"
+        pending = self._pending_output[stream]
+        pending.append(text)
+        if sum(len(chunk) for chunk in pending) >= OUTPUT_CHUNK_SIZE or \
+                time.monotonic() - self._last_flush >= OUTPUT_FLUSH_INTERVAL:
+            self._flush_output()
+
+    def _flush_output(self):
+        for stream, pending in self._pending_output.items():
+            if pending:
+                self._emit({"type": "output", "stream": stream, "data": "".join(pending)})
+                pending.clear()
+        self._last_flush = time.monotonic()
+
+class ShardedTestRunner:
+    """Runs one commit's pytest suite split across several pods and merges the results
+
+    Each pod gets its own TestRunner that checks out the commit and keeps
+    only its shard of the collected tests (see pytest_shard.py). Shards are
+    balanced by the repo's recorded per-test durations, or by tests per file
+    when the repo has no history yet. Sharding needs the pipeline; with
+    RUNNER_PIPELINE=0 the suite runs unsharded on the first pod.
+    """
+
+    def __init__(self, namespace: str, repo_url: str, commit: str, test_cmd: str, project_type: str,
+                 pods: List[str], kube: Optional[KubeClient] = None,
+                 on_event: Optional[Callable[[Dict[str, Any]], None]] = None, run_id: str = "",
+                 incremental: bool = False):
+        self.repo_url = repo_url
+        self.commit = commit
+        self.pods = pods
+        self.on_event = on_event
+        self.run_id = run_id or secrets.token_hex(8)
+        # Shards stream from their own threads
+        self._emit_lock = threading.Lock()
+        fd, self.durations_file = tempfile.mkstemp(prefix="im-shard-", suffix=".json")
+        os.close(fd)
+        self.shards = [
+            TestRunner(namespace, repo_url, commit, test_cmd, project_type, kube=kube,
+                       on_event=self._forwarder(index) if on_event else None, pod_name=pod,
+                       run_id=self.shard_run_id(index), shard=(index, len(pods), self.durations_file),
+                       incremental=incremental)
+            for index, pod in enumerate(pods)
+        ]
+        if not self.shards[0].pipeline:
+            self.shards = [TestRunner(namespace, repo_url, commit, test_cmd, project_type, kube=kube,
+                                      on_event=on_event, pod_name=pods[0], run_id=self.run_id,
+                                      incremental=incremental)]
+
+    def shard_run_id(self, index: int) -> str:
+        """The run ID of one shard: still lowercase hex of at most 64 characters, so its artifacts are kept"""
+        return f"{self.run_id[:62]}{index:02x}"
+
+    def _forwarder(self, index: int) -> Callable[[Dict[str, Any]], None]:
+        def forward(event: Dict[str, Any]):
+            with self._emit_lock:
+                self.on_event({**event, "run_id": self.run_id, "shard": index})
+        return forward
+
+    def cancel(self):
+        for shard in self.shards:
+            shard.cancel()
+
+    def execute_test_run(self) -> Dict[str, Any]:
+        if len(self.shards) == 1 and not self.shards[0].shard:
+            os.unlink(self.durations_file)
+            return self.shards[0].execute_test_run()
+
+        start_time = time.monotonic()
+        try:
+            # Every shard plans from this one snapshot, so they agree on the split
+            with open(self.durations_file, "w") as f:
+                json.dump(DurationHistory(self.repo_url).latest(), f)
+            self._plan_selection()
+            results: List[Dict[str, Any]] = [{} for _ in self.shards]
+
+            def run(index: int):
+                shard = self.shards[index]
+                try:
+                    results[index] = shard.execute_test_run()
+                except Exception as e:
+                    # Keep the other shards' results; report this one as an error
+                    message = f"shard {index} crashed: {type(e).__name__}: {e}"
+                    shard.result.update(status="error", success=False, message=message)
+                    shard.result["output"]["stderr"] += message + "\n"
+                    results[index] = shard.result
+            threads = [threading.Thread(target=run, args=(index,)) for index in range(len(self.shards))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            os.unlink(self.durations_file)
+        return self._merge(results, time.monotonic() - start_time)
+
+    def _plan_selection(self):
+        """Make one incremental selection plan for all shards, so none runs a test another skipped"""
+        first = self.shards[0]
+        if not first.impact:
+            return
+        try:
+            sha = first.mirror.resolve(self.repo_url, self.commit)
+        except subprocess.CalledProcessError:
+            # Every shard will fail to resolve it too, and report why
+            return
+        selection = first.impact.plan(first.mirror, sha)
+        for shard in self.shards:
+            shard.selection = selection
+
+    def _merge(self, results: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+        """Combine the shards' results into one, as if the suite had run in a single pod"""
+        statuses = [result["status"] for result in results]
+        status = next((s for s in ("cancelled", "error", "failed") if s in statuses), "passed")
+        merged: Dict[str, Any] = {
+            "run_id": self.run_id,
+            "commit": self.commit,
+            "status": status,
+            "success": status == "passed",
+            "duration": round(elapsed, 2),
+            "duration_ms": round(elapsed * 1000, 1),
+            "output": {"stdout": "", "stderr": "", "kubectl_errors": []},
+            "shards": []
+        }
+        for key in ("commit_message", "dependency_cache"):
+            if key in results[0]:
+                merged[key] = results[0][key]
+
+        count = len(results)
+        for index, result in enumerate(results):
+            header = f"===== shard {index + 1}/{count} on {self.pods[index]} =====\n"
+            for stream in ("stdout", "stderr"):
+                if result["output"][stream]:
+                    merged["output"][stream] += header + result["output"][stream]
+            merged["output"]["kubectl_errors"] += [{**error, "shard": index}
+                                                   for error in result["output"]["kubectl_errors"]]
+            merged["shards"].append({
+                "index": index,
+                "pod": self.pods[index],
+                "run_id": result["run_id"],
+                "status": result["status"],
+                "duration": result["duration"],
+                "tests": len(result.get("tests", [])),
+                "artifacts": result.get("artifacts")
+            })
+
+        # The slowest shard's steps are the run's critical path
+        slowest = max(results, key=lambda result: result["duration"])
+        merged["steps"] = slowest.get("steps", [])
+        timings: Dict[str, float] = {}
+        for result in results:
+            for step, ms in result.get("timings", {}).items():
+                timings[step] = max(timings.get(step, 0), ms)
+        merged["timings"] = timings
+
+        tests = sorted((test for result in results for test in result.get("tests", [])),
+                       key=lambda test: test["id"])
+        if tests:
+            merged["tests"] = tests
+            merged["test_summary"] = summarize(tests)
+            if status in ("passed", "failed"):
+                self.shards[0]._compare_history(merged, tests)
+                coverage: Dict[str, List[str]] = {}
+                for shard in self.shards:
+                    coverage.update(shard.coverage)
+                self.shards[0]._record_impact(merged, tests, coverage)
+        return merged
+
 
 def main():
     parser = argparse.ArgumentParser(description='Single Commit Test Runner')
@@ -134,19 +816,57 @@ def main():
     parser.add_argument('-r', '--repo-url', required=True, help='Git repository URL')
     parser.add_argument('-c', '--commit', required=True, help='Commit hash to test')
     parser.add_argument('-t', '--test-cmd', default='pytest tests/', help='Test command')
+    parser.add_argument('-p', '--project-type', default='fastapi', help='Project template type')
+    parser.add_argument('--pod', default='', help='Run on this pod instead of the first test-pod')
+    parser.add_argument('--pod-ready', action='store_true',
+                        help='The --pod was just seen Ready; skip waiting for it')
+    parser.add_argument('--run-id', default='', help='Name for the output artifacts (default: random)')
+    parser.add_argument('--pods', default='',
+                        help='Comma-separated pods to split the pytest suite across')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Skip tests the diff from the last full run cannot affect (pytest only)')
+    parser.add_argument('--stream', action='store_true',
+                        help='Print progress events and the result as JSON lines')
     
     args = parser.parse_args()
+
+    def print_event(event: Dict[str, Any]):
+        print(json.dumps({"event": event}), flush=True)
     
-    runner = TestRunner(
-        namespace=args.namespace,
-        repo_url=args.repo_url,
-        commit=args.commit,
-        test_cmd=args.test_cmd,
-        project_type="fastapi"  # Default to fastapi for now
-    )
+    pods = [pod for pod in args.pods.split(",") if pod]
+    if len(pods) > 1:
+        runner = ShardedTestRunner(
+            namespace=args.namespace,
+            repo_url=args.repo_url,
+            commit=args.commit,
+            test_cmd=args.test_cmd,
+            project_type=args.project_type,
+            pods=pods,
+            on_event=print_event if args.stream else None,
+            run_id=args.run_id,
+            incremental=args.incremental
+        )
+    else:
+        runner = TestRunner(
+            namespace=args.namespace,
+            repo_url=args.repo_url,
+            commit=args.commit,
+            test_cmd=args.test_cmd,
+            project_type=args.project_type,
+            on_event=print_event if args.stream else None,
+            pod_name=args.pod,
+            pod_ready=args.pod_ready,
+            run_id=args.run_id,
+            incremental=args.incremental
+        )
+    # The server sends SIGTERM to cancel; the result still reports what ran
+    signal.signal(signal.SIGTERM, lambda signum, frame: runner.cancel())
     
     result = runner.execute_test_run()
-    print(json.dumps(result, indent=2))
+    if args.stream:
+        print(json.dumps({"result": result}), flush=True)
+    else:
+        print(json.dumps(result, indent=2))
 
 if __name__ == '__main__':
     main()
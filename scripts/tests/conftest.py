@@ -0,0 +1,27 @@
+import os
+import sys
+
+import pytest
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, SCRIPTS_DIR)
+
+import state_store  # noqa: E402
+
+
+@pytest.fixture
+def state_dir(tmp_path, monkeypatch):
+    """Point every JsonState at a fresh IM_STATE_DIR"""
+    path = tmp_path / "state"
+    monkeypatch.setattr(state_store, "STATE_DIR", str(path))
+    return path
+
+
+@pytest.fixture
+def fake_kube(tmp_path, monkeypatch):
+    """A KubeClient backed by scripts/fake_kubectl.py with its own cluster state"""
+    from kube_client import KubeClient
+    monkeypatch.setenv("FAKE_KUBE_ROOT", str(tmp_path / "fake-kube"))
+    monkeypatch.setenv("FAKE_KUBE_POD_START", "0")
+    os.makedirs(tmp_path / "fake-kube")
+    return KubeClient(os.path.join(SCRIPTS_DIR, "fake_kubectl.py"))
@@ -0,0 +1,65 @@
+import time
+
+import pytest
+
+
+@pytest.fixture
+def deployed(fake_kube):
+    fake_kube.run(["create", "namespace", "im-chat-user"])
+    # Applying any manifest gives the fake cluster a one-replica test-pod deployment
+    fake_kube.run(["apply", "-f", "/dev/null"], namespace="im-chat-user")
+    return fake_kube
+
+
+def pod_names(kube, namespace="im-chat-user"):
+    return kube.run(["get", "pods", "-l", "app=test-pod"], namespace=namespace).stdout.split()
+
+
+def test_namespaces(fake_kube):
+    assert fake_kube.get_namespace("im-chat-user").returncode != 0
+    assert fake_kube.create_namespace("im-chat-user").returncode == 0
+    assert "AlreadyExists" in fake_kube.create_namespace("im-chat-user").stderr
+    assert fake_kube.get_namespace("im-chat-user").returncode == 0
+
+    fake_kube.run(["label", "namespace", "im-chat-user", "--overwrite", "backend.im/pool=fastapi"])
+    assert fake_kube.run(["get", "namespaces", "-l", "backend.im/pool=fastapi"]).stdout == "im-chat-user"
+    assert fake_kube.run(["get", "namespaces", "-l", "backend.im/pool=go"]).stdout == ""
+
+    fake_kube.run(["delete", "namespace", "im-chat-user", "--wait=false"])
+    assert fake_kube.get_namespace("im-chat-user").returncode != 0
+
+
+def test_scale_wait_and_rollout(deployed):
+    assert len(pod_names(deployed)) == 1
+    deployed.run(["scale", "deployment", "test-pod", "--replicas=3"], namespace="im-chat-user")
+    assert deployed.rollout_status("im-chat-user").returncode == 0
+
+    wait = deployed.run(["wait", "--for=condition=Ready", "pod", "-l", "app=test-pod", "--timeout=5s"],
+                        namespace="im-chat-user")
+    assert wait.stdout.count("condition met") == 3
+
+    deployed.run(["scale", "deployment", "test-pod", "--replicas=0"], namespace="im-chat-user")
+    wait = deployed.run(["wait", "--for=condition=Ready", "pod", "-l", "app=test-pod", "--timeout=5s"],
+                        namespace="im-chat-user")
+    assert "no matching resources found" in wait.stderr
+
+
+def test_pods_become_ready_after_the_start_delay(deployed, monkeypatch):
+    monkeypatch.setenv("FAKE_KUBE_POD_START", "0.5")
+    deployed.run(["scale", "deployment", "test-pod", "--replicas=2"], namespace="im-chat-user")
+    start = time.monotonic()
+    assert deployed.rollout_status("im-chat-user").returncode == 0
+    assert time.monotonic() - start >= 0.3
+
+
+def test_exec_maps_pod_paths(deployed):
+    pod = pod_names(deployed)[0]
+    deployed.run(["exec", pod, "--", "sh", "-c", "mkdir -p /app/repo && echo hi > /app/repo/file"],
+                 namespace="im-chat-user")
+    read = deployed.run(["exec", pod, "--", "sh", "-s"], namespace="im-chat-user",
+                        input="cat /app/repo/file; exit 4\n")
+
+    assert read.stdout == "hi\n"
+    assert read.returncode == 4
+    missing = deployed.run(["exec", "test-pod-none", "--", "true"], namespace="im-chat-user")
+    assert "NotFound" in missing.stderr
@@ -0,0 +1,126 @@
+import os
+import subprocess
+
+import pytest
+
+from git_mirror import SHIPPED_PER_POD, GitMirror
+
+
+def git(repo, *args) -> str:
+    return subprocess.run(["git", "-C", str(repo)] + list(args), capture_output=True, text=True,
+                          check=True).stdout.strip()
+
+
+def commit(repo, name, content) -> str:
+    (repo / name).write_text(content)
+    git(repo, "add", name)
+    git(repo, "commit", "-q", "-m", f"{name}: {content}")
+    return git(repo, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    repo = tmp_path / "upstream"
+    repo.mkdir()
+    git(repo, "init", "-q", "-b", "main")
+    git(repo, "config", "user.email", "dev@example.com")
+    git(repo, "config", "user.name", "dev")
+    return repo
+
+
+@pytest.fixture
+def mirror(tmp_path, state_dir):
+    return GitMirror(str(tmp_path / "mirrors"), 64 * 1024 * 1024)
+
+
+def test_resolve_clones_once_and_fetches_new_commits(upstream, mirror):
+    first = commit(upstream, "a.py", "1")
+    assert mirror.resolve(str(upstream), "main") == first
+    assert mirror.resolve(str(upstream), first) == first
+
+    second = commit(upstream, "a.py", "2")
+    assert mirror.resolve(str(upstream), second) == second
+    assert mirror.resolve(str(upstream), "main") == second
+
+
+def test_resolve_unknown_commit_raises(upstream, mirror):
+    commit(upstream, "a.py", "1")
+    with pytest.raises(subprocess.CalledProcessError):
+        mirror.resolve(str(upstream), "0" * 40)
+
+
+def test_shipped_commits_survive_a_pruning_fetch(upstream, mirror):
+    commit(upstream, "a.py", "1")
+    git(upstream, "checkout", "-q", "-b", "topic")
+    shipped = commit(upstream, "b.py", "topic")
+    mirror.resolve(str(upstream), "topic")
+    bundle = mirror.bundle(str(upstream), shipped, [])
+    os.unlink(bundle)
+
+    # The branch disappears upstream; the pinned commit must not go with it
+    git(upstream, "checkout", "-q", "main")
+    git(upstream, "branch", "-q", "-D", "topic")
+    commit(upstream, "a.py", "2")
+    mirror.resolve(str(upstream), "main")
+
+    path = mirror.path(str(upstream))
+    assert git(path, "rev-parse", f"refs/im/{shipped}") == shipped
+    assert subprocess.run(["git", "--git-dir", path, "rev-parse", "--verify", "-q", "refs/heads/topic"],
+                          capture_output=True).returncode != 0
+
+
+def test_bundle_holds_only_commits_the_pod_lacks(upstream, mirror, tmp_path):
+    first = commit(upstream, "a.py", "1")
+    second = commit(upstream, "a.py", "2")
+    mirror.resolve(str(upstream), "main")
+
+    assert mirror.bundle(str(upstream), first, [first]) is None
+    assert mirror.bundle(str(upstream), first, [second]) is None
+
+    bundle = mirror.bundle(str(upstream), second, [first])
+    try:
+        heads = git(tmp_path, "bundle", "list-heads", bundle)
+        assert heads == f"{second} refs/im/{second}"
+        verify = subprocess.run(["git", "bundle", "verify", bundle], cwd=mirror.path(str(upstream)),
+                                capture_output=True, text=True)
+        assert first in verify.stdout + verify.stderr
+    finally:
+        os.unlink(bundle)
+
+
+def test_commits_between_and_changed_files(upstream, mirror):
+    good = commit(upstream, "a.py", "1")
+    middle = commit(upstream, "b.py", "1")
+    bad = commit(upstream, "a.py", "2")
+
+    assert mirror.commits_between(str(upstream), good, bad) == [middle, bad]
+    assert mirror.changed_files(str(upstream), good, bad) == ["a.py", "b.py"]
+    with pytest.raises(ValueError):
+        mirror.commits_between(str(upstream), bad, good)
+
+
+def test_shipped_history_is_capped(mirror):
+    for i in range(SHIPPED_PER_POD + 5):
+        mirror.mark_shipped("ns/pod", f"{i:040x}")
+    mirror.mark_shipped("ns/pod", f"{3:040x}")
+
+    shipped = mirror.shipped_to("ns/pod")
+    assert len(shipped) == SHIPPED_PER_POD
+    assert shipped[0] == f"{3:040x}"
+
+
+def test_prune_shipped_forgets_only_gone_pods(mirror, fake_kube):
+    fake_kube.run(["create", "namespace", "im-live"])
+    # Applying any manifest gives the fake cluster a one-replica test-pod deployment
+    fake_kube.run(["apply", "-f", "/dev/null"], namespace="im-live")
+    live_pod = fake_kube.run(["get", "pods", "-o", "name"], namespace="im-live").stdout.split()[0]
+
+    mirror.mark_shipped(f"im-live/{live_pod}", "a" * 40)
+    mirror.mark_shipped("im-live/test-pod-old", "b" * 40)
+    mirror.mark_shipped("im-gone/test-pod-0", "c" * 40)
+
+    assert sorted(mirror.prune_shipped(fake_kube, force=True)) == ["im-gone/test-pod-0", "im-live/test-pod-old"]
+    assert mirror.shipped_to(f"im-live/{live_pod}") == ["a" * 40]
+    # Throttled until SHIPPED_PRUNE_INTERVAL has passed
+    mirror.mark_shipped("im-gone/test-pod-0", "c" * 40)
+    assert mirror.prune_shipped(fake_kube) == []
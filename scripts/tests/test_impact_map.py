@@ -0,0 +1,97 @@
+import os
+import runpy
+
+import pytest
+
+from impact_map import ImpactMap
+from pytest_impact import FileRecorder
+
+BASE = "b" * 40
+
+
+class StubMirror:
+    """Stands in for GitMirror.changed_files with a fixed diff"""
+
+    def __init__(self, changed):
+        self.changed = changed
+
+    def changed_files(self, repo_url, base, sha):
+        return self.changed
+
+
+@pytest.fixture
+def impact(state_dir):
+    impact = ImpactMap("https://example.com/repo.git", "pytest tests/", full_every=3)
+    impact.record_full(BASE, {
+        "tests/test_calc.py::test_add": ["src/calc.py", "tests/test_calc.py"],
+        "tests/test_calc.py::test_sub": ["src/calc.py", "tests/test_calc.py"],
+        "tests/test_io.py::test_read": ["src/io.py", "tests/test_io.py"],
+        "tests/test_io.py::test_flaky": ["src/io.py", "tests/test_io.py"],
+    }, [{"id": "tests/test_io.py::test_flaky", "outcome": "failed"}])
+    return impact
+
+
+def plan(impact, *changed):
+    return impact.plan(StubMirror(list(changed)), "c" * 40)
+
+
+def test_first_run_is_full(state_dir):
+    assert ImpactMap("repo", "pytest", 3).plan(StubMirror([]), "c" * 40)["mode"] == "full"
+
+
+def test_unaffected_tests_are_skipped(impact):
+    selection = plan(impact, "src/calc.py")
+
+    assert selection["mode"] == "incremental"
+    # test_flaky failed last time, so it runs although src/io.py did not change
+    assert selection["deselect"] == ["tests/test_io.py::test_read"]
+
+
+def test_tests_in_a_changed_test_file_run(impact):
+    assert plan(impact, "tests/test_io.py")["deselect"] == [
+        "tests/test_calc.py::test_add", "tests/test_calc.py::test_sub"]
+
+
+@pytest.mark.parametrize("path", ["requirements.txt", "tests/conftest.py", "src/__init__.py"])
+def test_global_files_force_a_full_run(impact, path):
+    selection = plan(impact, "src/calc.py", path)
+    assert selection["mode"] == "full"
+    assert path in selection["reason"]
+
+
+@pytest.mark.parametrize("path", ["src/settings.json", "src/plugins.py", "tests/test_new.py"])
+def test_files_no_test_is_known_to_use_force_a_full_run(impact, path):
+    selection = plan(impact, path)
+    assert selection["mode"] == "full"
+    assert selection["changed_files"] == [path]
+
+
+def test_periodic_full_run(impact):
+    for _ in range(3):
+        impact.record_incremental([])
+    assert "periodic" in plan(impact, "src/calc.py")["reason"]
+
+
+def test_incremental_runs_track_failing_tests(impact):
+    impact.record_incremental([{"id": "tests/test_io.py::test_flaky", "outcome": "passed"},
+                               {"id": "tests/test_calc.py::test_add", "outcome": "failed"}])
+    assert plan(impact, "src/io.py")["deselect"] == ["tests/test_calc.py::test_sub"]
+
+
+def test_recorder_normalizes_paths_into_the_root(tmp_path):
+    repo = tmp_path / "repo"
+    (repo / "src").mkdir(parents=True)
+    (repo / "tests").mkdir()
+    (repo / "src" / "calc.py").write_text("def add(a, b):\n    return a + b\n")
+    os.symlink(repo, tmp_path / "link")
+    add = runpy.run_path(os.path.join(str(repo), "tests", "..", "src", "calc.py"))["add"]
+
+    # The rootdir may be reached through a symlink, the code through ".."
+    recorder = FileRecorder(str(tmp_path / "link"))
+    recorder.start()
+    try:
+        add(1, 2)
+        os.path.join("a", "b")
+    finally:
+        files = recorder.stop()
+    assert files == {"src/calc.py"}
@@ -0,0 +1,72 @@
+from junit_report import DurationHistory, find_regressions, node_id, parse_junit, summarize
+
+REPORT = """<?xml version="1.0" encoding="utf-8"?>
+<testsuites>
+  <testsuite name="pytest" tests="6">
+    <testcase classname="tests.test_calc" name="test_add" file="tests/test_calc.py" time="0.012"/>
+    <testcase classname="tests.test_calc.TestDiv" name="test_zero" file="tests/test_calc.py" time="0.5">
+      <failure message="assert 1 == 2">AssertionError</failure>
+    </testcase>
+    <testcase classname="tests.test_io" name="test_read" file="tests/test_io.py" time="0.1">
+      <error message="fixture 'db' not found"/>
+    </testcase>
+    <testcase classname="tests.test_io" name="test_write" file="tests/test_io.py" time="0">
+      <skipped message="needs a disk"/>
+    </testcase>
+    <testcase classname="tests.test_io" name="test_flush[a-b]" file="tests/test_io.py" time="0.00004">
+      <system-out>flushed</system-out>
+    </testcase>
+    <testcase classname="tests.test_misc" name="test_untimed"/>
+  </testsuite>
+</testsuites>
+"""
+
+
+def test_parse_junit_outcomes_and_ids():
+    tests = parse_junit(REPORT)
+
+    assert tests == [
+        {"id": "tests/test_calc.py::test_add", "outcome": "passed", "duration": 0.012},
+        {"id": "tests/test_calc.py::TestDiv::test_zero", "outcome": "failed", "duration": 0.5},
+        {"id": "tests/test_io.py::test_read", "outcome": "error", "duration": 0.1},
+        {"id": "tests/test_io.py::test_write", "outcome": "skipped", "duration": 0.0},
+        {"id": "tests/test_io.py::test_flush[a-b]", "outcome": "passed", "duration": 0.0},
+        {"id": "tests.test_misc::test_untimed", "outcome": "passed", "duration": 0.0},
+    ]
+    assert summarize(tests) == {"total": 6, "passed": 3, "failed": 1, "error": 1, "skipped": 1}
+
+
+def test_node_id_without_a_file():
+    assert node_id("", "test_top", None) == "test_top"
+    assert node_id("tests.test_calc.TestDiv", "test_zero", "tests/test_calc.py") == \
+        "tests/test_calc.py::TestDiv::test_zero"
+
+
+def test_regressions_against_the_parent_commit():
+    parent = {"t::slow": 1.0, "t::noise": 0.01, "t::steady": 1.0, "t::broken": 1.0, "t::slower": 2.0}
+    tests = [
+        {"id": "t::slow", "outcome": "passed", "duration": 2.0},
+        # Doubled, but by less than min_delta
+        {"id": "t::noise", "outcome": "passed", "duration": 0.05},
+        {"id": "t::steady", "outcome": "passed", "duration": 1.2},
+        # Failing tests are not timing regressions
+        {"id": "t::broken", "outcome": "failed", "duration": 9.0},
+        {"id": "t::slower", "outcome": "passed", "duration": 6.0},
+        {"id": "t::new", "outcome": "passed", "duration": 5.0},
+    ]
+
+    regressions = find_regressions(tests, parent, ratio=1.5, min_delta=0.1)
+    assert [r["id"] for r in regressions] == ["t::slower", "t::slow"]
+    assert regressions[1] == {"id": "t::slow", "duration": 2.0, "parent_duration": 1.0, "ratio": 2.0}
+
+
+def test_history_keeps_passing_durations_per_commit(state_dir):
+    history = DurationHistory("https://example.com/repo.git")
+    history.record("a" * 40, parse_junit(REPORT))
+    history.record("b" * 40, [{"id": "tests/test_calc.py::test_add", "outcome": "passed", "duration": 0.02}])
+    history.record("c" * 40, [{"id": "t::x", "outcome": "failed", "duration": 1.0}])
+
+    assert history.get("a" * 40) == {"tests/test_calc.py::test_add": 0.012, "tests/test_io.py::test_flush[a-b]": 0.0,
+                                     "tests.test_misc::test_untimed": 0.0}
+    assert history.get("c" * 40) == {}
+    assert history.latest()["tests/test_calc.py::test_add"] == 0.02
@@ -0,0 +1,39 @@
+import os
+import time
+
+import kube_client
+from kube_client import KubeClient
+
+
+def stub_kubectl(tmp_path, proxy_script):
+    """A kubectl whose `proxy` runs proxy_script and whose other verbs print their arguments"""
+    path = tmp_path / "kubectl"
+    path.write_text(f'#!/bin/sh\nif [ "$1" = proxy ]; then\n{proxy_script}\nfi\necho "$@"\n')
+    os.chmod(path, 0o755)
+    return KubeClient(str(path))
+
+
+def test_proxy_port_is_read_from_its_banner(tmp_path):
+    kube = stub_kubectl(tmp_path, "echo 'Starting to serve on 127.0.0.1:40123'; exec sleep 60")
+    try:
+        assert kube.start_proxy()
+        assert (kube._host, kube._port) == ("127.0.0.1", 40123)
+    finally:
+        kube.close()
+
+
+def test_silent_proxy_times_out_and_falls_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(kube_client, "PROXY_START_TIMEOUT", 0.5)
+    kube = stub_kubectl(tmp_path, "exec sleep 60")
+
+    start = time.monotonic()
+    assert not kube.start_proxy()
+    assert time.monotonic() - start < 5
+    assert kube._proxy is None
+    assert kube.run(["get", "pods"]).stdout.strip() == "get pods"
+
+
+def test_proxy_that_exits_falls_back(tmp_path):
+    kube = stub_kubectl(tmp_path, "echo 'error: listen tcp: address already in use' >&2; exit 1")
+    assert not kube.start_proxy()
+    assert kube._proxy is None
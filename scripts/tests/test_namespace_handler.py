@@ -0,0 +1,85 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+from kube_client import KubeClient
+from namespace_handler import handle_namespace, pod_leases, release_test_pods, scale_test_pods
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def namespace(fake_kube, state_dir, monkeypatch):
+    # Templates are looked up relative to the repo root, as the server runs there
+    monkeypatch.chdir(REPO_ROOT)
+    result, code = handle_namespace("chat", "user", "fastapi", kube=fake_kube)
+    assert code == 0, result
+    return result["namespace"]
+
+
+def replicas(kube, namespace):
+    return int(kube.run(["get", "deployment", "test-pod", "-o", "jsonpath={.spec.replicas}"],
+                        namespace=namespace).stdout)
+
+
+def test_scale_lists_every_ready_pod(fake_kube, namespace):
+    result = scale_test_pods(namespace, 3, kube=fake_kube, lease="run1")
+
+    assert result["status"] == "ready"
+    assert len(result["pods"]) == 3
+    assert pod_leases(namespace).read()["run1"]["replicas"] == 3
+
+
+def test_release_scales_down_to_what_other_leases_hold(fake_kube, namespace):
+    scale_test_pods(namespace, 4, kube=fake_kube, lease="big")
+    scale_test_pods(namespace, 2, kube=fake_kube, lease="small")
+
+    assert release_test_pods(namespace, "big", kube=fake_kube)["replicas"] == 2
+    assert replicas(fake_kube, namespace) == 2
+    assert release_test_pods(namespace, "small", kube=fake_kube)["replicas"] == 1
+    assert replicas(fake_kube, namespace) == 1
+    assert pod_leases(namespace).read() == {}
+
+
+def test_release_ignores_expired_leases(fake_kube, namespace):
+    scale_test_pods(namespace, 3, kube=fake_kube, lease="crashed")
+    with pod_leases(namespace).locked() as leases:
+        leases["crashed"]["at"] = time.time() - 7 * 3600
+    scale_test_pods(namespace, 2, kube=fake_kube, lease="live")
+
+    assert release_test_pods(namespace, "live", kube=fake_kube)["replicas"] == 1
+    assert replicas(fake_kube, namespace) == 1
+
+
+def test_release_leaves_a_scaled_to_zero_deployment(fake_kube, namespace):
+    scale_test_pods(namespace, 2, kube=fake_kube, lease="run1")
+    fake_kube.run(["scale", "deployment", "test-pod", "--replicas=0"], namespace=namespace)
+
+    release_test_pods(namespace, "run1", kube=fake_kube)
+    assert replicas(fake_kube, namespace) == 0
+
+
+def test_scale_reports_a_missing_deployment(fake_kube, state_dir):
+    fake_kube.run(["create", "namespace", "im-empty"])
+    result = scale_test_pods("im-empty", 2, kube=fake_kube, lease="run1")
+
+    assert result["status"] == "error"
+    assert "NotFound" in result["message"]
+
+
+def test_failed_wait_gives_the_replicas_back(fake_kube, namespace):
+    scale_test_pods(namespace, 2, kube=fake_kube, lease="other")
+
+    class WaitFails(KubeClient):
+        def run(self, command, *args, **kwargs):
+            if command[0] == "wait":
+                return subprocess.CompletedProcess(command, 1, "", "error: timed out waiting for the condition")
+            return super().run(command, *args, **kwargs)
+
+    result = scale_test_pods(namespace, 4, kube=WaitFails(fake_kube.kubectl), lease="run1")
+    assert result["status"] == "error"
+    assert "timed out" in result["message"]
+    assert list(pod_leases(namespace).read()) == ["other"]
+    assert replicas(fake_kube, namespace) == 2
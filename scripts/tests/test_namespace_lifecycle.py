@@ -0,0 +1,99 @@
+import os
+import subprocess
+import time
+
+import pytest
+
+from kube_client import KubeClient
+from namespace_handler import handle_namespace
+from namespace_lifecycle import NamespaceLifecycle
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def lifecycle(fake_kube, state_dir, monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    return NamespaceLifecycle(fake_kube, idle_ttl=60, delete_ttl=3600)
+
+
+def idle_for(lifecycle, namespace, seconds):
+    with lifecycle.state.locked() as namespaces:
+        namespaces[namespace]["last_used"] = time.time() - seconds
+
+
+def replicas(kube, namespace):
+    return int(kube.run(["get", "deployment", "test-pod"], namespace=namespace).stdout)
+
+
+def test_reaper_is_opt_in(fake_kube, monkeypatch):
+    monkeypatch.delenv("NAMESPACE_REAPER", raising=False)
+    assert NamespaceLifecycle.from_env(fake_kube) is None
+    monkeypatch.setenv("NAMESPACE_REAPER", "1")
+    assert NamespaceLifecycle.from_env(fake_kube) is not None
+
+
+def test_idle_namespace_is_scaled_down_and_rewarmed(fake_kube, lifecycle):
+    result, _ = handle_namespace("chat", "user", "fastapi", kube=fake_kube, lifecycle=lifecycle)
+    namespace = result["namespace"]
+    assert lifecycle.reap()["scaled_down"] == []
+
+    idle_for(lifecycle, namespace, 120)
+    assert lifecycle.reap()["scaled_down"] == [namespace]
+    assert replicas(fake_kube, namespace) == 0
+
+    result, code = handle_namespace("chat", "user", "fastapi", kube=fake_kube, lifecycle=lifecycle)
+    assert (code, result["status"]) == (0, "rewarmed")
+    # rewarm returns once the pod exists, so a `kubectl wait -l` cannot miss it
+    wait = fake_kube.run(["wait", "--for=condition=Ready", "pod", "-l", "app=test-pod", "--timeout=1s"],
+                         namespace=namespace)
+    assert "condition met" in wait.stdout
+
+
+def test_long_idle_namespace_is_deleted(fake_kube, lifecycle):
+    result, _ = handle_namespace("chat", "user", "fastapi", kube=fake_kube, lifecycle=lifecycle)
+    namespace = result["namespace"]
+    idle_for(lifecycle, namespace, 7200)
+
+    report = lifecycle.reap()
+    assert report["deleted"] == [namespace]
+    assert report["tracked"] == 0
+    assert fake_kube.get_namespace(namespace).returncode != 0
+
+
+def test_unlabelled_namespaces_are_left_alone(fake_kube, lifecycle):
+    fake_kube.create_namespace("im-someone-else")
+    fake_kube.run(["apply", "-f", "/dev/null"], namespace="im-someone-else")
+    lifecycle.touch("im-someone-else")
+    idle_for(lifecycle, "im-someone-else", 120)
+
+    report = lifecycle.reap()
+    assert report["scaled_down"] == []
+    assert replicas(fake_kube, "im-someone-else") == 1
+
+
+def test_labelled_namespaces_are_adopted(fake_kube, lifecycle):
+    result, _ = handle_namespace("chat", "user", "fastapi", kube=fake_kube)
+    assert lifecycle.state.read() == {}
+
+    assert lifecycle.reap()["tracked"] == 1
+    assert result["namespace"] in lifecycle.state.read()
+
+
+def test_failed_scale_down_is_retried(fake_kube, lifecycle):
+    result, _ = handle_namespace("chat", "user", "fastapi", kube=fake_kube, lifecycle=lifecycle)
+    namespace = result["namespace"]
+    idle_for(lifecycle, namespace, 120)
+
+    class ScaleFails(KubeClient):
+        def run(self, command, *args, **kwargs):
+            if command[0] == "scale":
+                return subprocess.CompletedProcess(command, 1, "", "connection refused")
+            return super().run(command, *args, **kwargs)
+
+    lifecycle.kube = ScaleFails(fake_kube.kubectl)
+    assert lifecycle.reap()["scaled_down"] == []
+    assert not lifecycle.state.read()[namespace].get("scaled_down")
+
+    lifecycle.kube = fake_kube
+    assert lifecycle.reap()["scaled_down"] == [namespace]
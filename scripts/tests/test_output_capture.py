@@ -0,0 +1,94 @@
+import gzip
+import os
+
+from output_capture import ArtifactStore, BoundedCapture
+
+
+def test_short_output_is_kept_whole():
+    capture = BoundedCapture(10, 10)
+    capture.write("hello ")
+    capture.write("world")
+
+    assert capture.text() == "hello world"
+    assert not capture.truncated
+    assert capture.total == 11
+
+
+def test_long_output_keeps_head_and_tail():
+    capture = BoundedCapture(5, 5)
+    for chunk in ("01234", "56789", "abcde", "fghij"):
+        capture.write(chunk)
+
+    assert capture.truncated
+    assert capture.text().startswith("01234\n... [10 bytes omitted")
+    assert capture.text().endswith("\nfghij")
+
+
+def test_tail_is_cut_inside_a_chunk():
+    capture = BoundedCapture(2, 3)
+    capture.write("ab" + "x" * 100 + "xyz")
+
+    assert capture.text().startswith("ab\n... [100 bytes omitted")
+    assert capture.text().endswith("\nxyz")
+
+
+def test_limits_count_encoded_bytes():
+    capture = BoundedCapture(5, 4)
+    capture.write("h\u00e9\u00e9")  # 5 bytes
+    capture.write("\u20ac" * 10)  # 30 bytes
+    capture.write("ok\u00e9")  # 4 bytes
+
+    head, _, tail = capture.text().partition("\n... [")
+    assert head == "h\u00e9\u00e9"
+    # The last 4 bytes would start inside the euro sign; the partial character is dropped
+    assert tail.endswith("\nok\u00e9")
+    assert capture.total == 39
+    assert "[30 bytes omitted" in capture.text()
+
+
+def test_a_wide_character_closes_the_head():
+    capture = BoundedCapture(2, 10)
+    capture.write("a")
+    capture.write("\u20ac")
+    capture.write("b")
+
+    assert capture.text() == "a\u20acb"
+    assert capture.total == 5
+
+
+def test_artifact_holds_everything(tmp_path):
+    store = ArtifactStore(str(tmp_path), 1024 * 1024)
+    capture = store.capture("0123456789abcdef", "stdout", 4, 4)
+    text = "".join(f"line {i}\n" for i in range(1000))
+    capture.write(text)
+    capture.close()
+
+    with gzip.open(tmp_path / "0123456789abcdef" / "stdout.log.gz", "rt") as f:
+        assert f.read() == text
+    assert store.describe("0123456789abcdef", {"stdout": capture}) == {
+        "run_id": "0123456789abcdef",
+        "stdout": {"size": len(text), "truncated": True, "url": "/artifacts/0123456789abcdef/stdout"}
+    }
+
+
+def test_invalid_run_ids_get_no_artifact(tmp_path):
+    store = ArtifactStore(str(tmp_path), 1024 * 1024)
+    for run_id in ("../escape", "0123456789abcdef-1", "ABCDEF0123", "abc"):
+        capture = store.capture(run_id, "stdout", 4, 4)
+        capture.write("output")
+        assert capture.artifact_path is None
+        assert store.describe(run_id, {"stdout": capture})["stdout"]["url"] == ""
+    assert store.capture("0123456789abcdef", "junit", 4, 4).artifact_path is None
+    assert os.listdir(tmp_path) == []
+
+
+def test_prune_deletes_oldest_runs_first(tmp_path):
+    store = ArtifactStore(str(tmp_path), 2500)
+    for written, run_id in enumerate(("aaaaaaaa", "bbbbbbbb", "cccccccc")):
+        run_dir = tmp_path / run_id
+        run_dir.mkdir()
+        (run_dir / "stdout.log.gz").write_bytes(b"x" * 1000)
+        os.utime(run_dir, (1000 + written * 100, 1000 + written * 100))
+
+    store.prune()
+    assert sorted(os.listdir(tmp_path)) == ["bbbbbbbb", "cccccccc"]
@@ -0,0 +1,95 @@
+import io
+import os
+import secrets
+import subprocess
+
+from pod_pipeline import PipelineScript, parse_dependency_cache, parse_marker, run_dir, run_pid_file
+
+
+def run_script(script: PipelineScript) -> subprocess.CompletedProcess:
+    """Run a pipeline the way the pod does, with sh reading it on stdin"""
+    stream = io.StringIO()
+    script.write_to(stream)
+    return subprocess.run(["sh", "-s"], input=stream.getvalue(), capture_output=True, text=True)
+
+
+def markers(stdout: str):
+    return [parse_marker(line) for line in stdout.splitlines() if parse_marker(line)]
+
+
+def test_parse_marker():
+    assert parse_marker("@@STEP@@ repo_update 1700000000000 Updating\n") == \
+        ("STEP", "repo_update 1700000000000 Updating")
+    assert parse_marker("@@ERR@@ ") == ("ERR", "")
+    assert parse_marker("@@ERR@@  indented") == ("ERR", " indented")
+    assert parse_marker("@@END@@") == ("END", "")
+
+
+def test_parse_marker_ignores_plain_output():
+    assert parse_marker("tests/test_a.py .. [100%]\n") is None
+    assert parse_marker("@@ not a marker") is None
+
+
+def test_parse_dependency_cache():
+    assert parse_dependency_cache("abc123 hit 0 4200 /app/.deps/with space") == {
+        "hash": "abc123",
+        "hit": True,
+        "env": "/app/.deps/with space",
+        "install_seconds": 0.0,
+        "saved_seconds": 4.2
+    }
+
+
+def test_steps_and_test_output_stream_in_order():
+    script = PipelineScript(secrets.token_hex(8))
+    script.step("setup", "Preparing")
+    script.run("setup", "echo hidden")
+    script.test("test_execution", "echo out; echo err >&2; exit 3")
+    result = run_script(script)
+
+    assert result.returncode == 3
+    kinds = [kind for kind, _ in markers(result.stdout)]
+    assert kinds == ["STEP", "ERR", "END"]
+    assert ("ERR", "err") in markers(result.stdout)
+    assert ("END", "test_execution 3") in markers(result.stdout)
+    assert "out" in result.stdout.splitlines()
+    # A passing step's own output is not replayed
+    assert "hidden" not in result.stdout
+
+
+def test_failed_step_replays_its_log_and_stops():
+    script = PipelineScript(secrets.token_hex(8))
+    script.run("repo_update", "echo fetching; exit 5")
+    script.test("test_execution", "echo never")
+    result = run_script(script)
+
+    assert result.returncode == 5
+    assert markers(result.stdout) == [("ERR", "fetching"), ("FAIL", "repo_update 5")]
+    assert script.commands["repo_update"] == "echo fetching; exit 5"
+
+
+def test_attachments_are_written_into_the_run_directory(tmp_path):
+    source = tmp_path / "payload.bin"
+    source.write_bytes(os.urandom(200_000))
+    script = PipelineScript(secrets.token_hex(8))
+    script.attach(f"{script.tmp}/payload.bin", str(source))
+    script.raw(f"sha256sum {script.tmp}/payload.bin")
+    result = run_script(script)
+
+    assert result.returncode == 0, result.stderr
+    expected = subprocess.run(["sha256sum", str(source)], capture_output=True, text=True).stdout.split()[0]
+    assert result.stdout.split()[0] == expected
+
+
+def test_scratch_directory_is_per_run_and_removed():
+    run_id = secrets.token_hex(8)
+    script = PipelineScript(run_id)
+    script.track(run_pid_file(run_id))
+    script.raw('echo "tmp=$IM_TMP"; test -f "$IM_TMP/pid" && echo tracked')
+    result = run_script(script)
+
+    assert script.tmp == run_dir(run_id)
+    assert f"tmp={run_dir(run_id)}" in result.stdout
+    assert "tracked" in result.stdout
+    assert not os.path.exists(run_dir(run_id))
+    assert PipelineScript(secrets.token_hex(8)).tmp != script.tmp
@@ -0,0 +1,130 @@
+import fcntl
+import os
+import subprocess
+import time
+
+import pytest
+
+from kube_client import KubeClient
+from pool_manager import OWNER_LABEL, POOL_LABEL, STATE_LABEL, PoolManager, parse_pool_sizes
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class LockCheckingKube(KubeClient):
+    """Fails the test if kubectl is called while leases.json is locked"""
+
+    def __init__(self, kubectl, lock_path):
+        super().__init__(kubectl)
+        self.lock_path = lock_path
+
+    def run(self, command, *args, **kwargs):
+        if os.path.exists(self.lock_path):
+            with open(self.lock_path) as lock:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    pytest.fail(f"kubectl {command[0]} ran under the leases.json lock")
+                fcntl.flock(lock, fcntl.LOCK_UN)
+        return super().run(command, *args, **kwargs)
+
+
+@pytest.fixture
+def pool(fake_kube, state_dir, monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    kube = LockCheckingKube(fake_kube.kubectl, str(state_dir / "leases.json.lock"))
+    pool = PoolManager(kube, {"fastapi": 2}, idle_ttl=60)
+    pool.maintain()
+    pool.maintain()
+    return pool
+
+
+def leased_to(kube, owner):
+    listed = kube.run(["get", "namespaces", "-l", f"{STATE_LABEL}=leased,{OWNER_LABEL}={owner}"])
+    return listed.stdout.split()
+
+
+def test_parse_pool_sizes():
+    assert parse_pool_sizes("2", ["fastapi", "django"]) == {"fastapi": 2, "django": 2}
+    assert parse_pool_sizes("FastAPI=3, django=x", ["fastapi"]) == {"fastapi": 3}
+    assert parse_pool_sizes("", ["fastapi"]) == {}
+
+
+def test_maintain_warms_then_promotes(fake_kube, state_dir, monkeypatch):
+    monkeypatch.chdir(REPO_ROOT)
+    pool = PoolManager(fake_kube, {"fastapi": 2}, idle_ttl=60)
+
+    first = pool.maintain()
+    assert len(first["created"]) == 2 and first["ready"] == []
+    second = pool.maintain()
+    assert sorted(second["ready"]) == sorted(first["created"]) and second["created"] == []
+    assert sorted(pool._pooled("fastapi", "ready")) == sorted(first["created"])
+
+
+def test_lease_hands_out_each_ready_namespace_once(pool):
+    ready = sorted(pool._pooled("fastapi", "ready"))
+
+    leased = sorted([pool.lease("im-a", "fastapi"), pool.lease("im-b", "fastapi")])
+    assert leased == ready
+    assert pool.lease("im-c", "fastapi") is None
+    assert pool.lease("im-d", "django") is None
+    assert leased_to(pool.kube, "im-a") == [pool.lookup("im-a")]
+    assert pool._pooled("fastapi", "ready") == []
+
+
+def test_lease_skips_a_namespace_another_lease_claimed(pool):
+    claimed, other = sorted(pool._pooled("fastapi", "ready"))
+    # Claimed in leases.json but not yet labelled by the other worker
+    with pool.leases.locked() as leases:
+        leases["im-other"] = {"namespace": claimed, "project_type": "fastapi",
+                              "leased_at": time.time(), "last_used": time.time()}
+
+    assert pool.lease("im-a", "fastapi") == other
+
+
+def test_failed_label_drops_the_claim(pool):
+    class LabelFails(LockCheckingKube):
+        def run(self, command, *args, **kwargs):
+            if command[0] == "label":
+                return subprocess.CompletedProcess(command, 1, "", "connection refused")
+            return super().run(command, *args, **kwargs)
+
+    pool.kube = LabelFails(pool.kube.kubectl, pool.kube.lock_path)
+    assert pool.lease("im-a", "fastapi") is None
+    assert pool.leases.read() == {}
+
+
+def test_release_forgets_the_lease(pool):
+    namespace = pool.lease("im-a", "fastapi")
+    pool.release(namespace)
+    assert pool.lookup("im-a") is None
+
+
+def test_maintain_reclaims_idle_leases_and_refills(pool):
+    idle = pool.lease("im-a", "fastapi")
+    busy = pool.lease("im-b", "fastapi")
+    with pool.leases.locked() as leases:
+        leases["im-a"]["last_used"] = time.time() - 120
+
+    report = pool.maintain()
+    assert report["reclaimed"] == [idle]
+    assert len(report["created"]) == 2
+    assert pool.lookup("im-a") is None and pool.lookup("im-b") == busy
+    namespaces = pool.kube.run(["get", "namespaces", "-l", f"{POOL_LABEL}=fastapi"]).stdout.split()
+    assert idle not in namespaces
+
+
+def test_failed_reclaim_keeps_the_lease(pool):
+    class DeleteFails(LockCheckingKube):
+        def run(self, command, *args, **kwargs):
+            if command[0] == "delete":
+                return subprocess.CompletedProcess(command, 1, "", "connection refused")
+            return super().run(command, *args, **kwargs)
+
+    namespace = pool.lease("im-a", "fastapi")
+    with pool.leases.locked() as leases:
+        leases["im-a"]["last_used"] = time.time() - 120
+    pool.kube = DeleteFails(pool.kube.kubectl, pool.kube.lock_path)
+
+    assert pool.maintain()["reclaimed"] == []
+    assert pool.leases.read()["im-a"]["namespace"] == namespace
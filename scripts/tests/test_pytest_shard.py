@@ -0,0 +1,116 @@
+import os
+import subprocess
+import sys
+
+from output_capture import RUN_ID
+from pytest_shard import plan_shards
+from worker import load_test_runner
+
+SCRIPTS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+ShardedTestRunner = load_test_runner().ShardedTestRunner
+
+
+def test_plan_balances_by_duration():
+    durations = {"t::a": 10.0, "t::b": 6.0, "t::c": 5.0, "t::d": 4.0, "t::e": 1.0}
+    shards = plan_shards(list(durations), durations, 2)
+
+    assert sorted(sum(shards, [])) == sorted(durations)
+    # Longest first onto the least loaded shard: 10+4 against 6+5+1
+    loads = [sum(durations[test_id] for test_id in shard) for shard in shards]
+    assert loads == [14.0, 12.0]
+
+
+def test_plan_counts_unknown_tests_as_the_median():
+    durations = {"t::a": 1.0, "t::b": 2.0, "t::c": 9.0}
+    shards = plan_shards(["t::a", "t::b", "t::c", "t::new"], durations, 2)
+
+    assert shards == [["t::c"], ["t::b", "t::new", "t::a"]]
+
+
+def test_plan_without_history_keeps_files_together():
+    test_ids = ["a.py::1", "a.py::2", "a.py::3", "b.py::1", "c.py::1", "c.py::2"]
+    shards = plan_shards(test_ids, {}, 2)
+
+    assert shards == [["a.py::1", "a.py::2", "a.py::3"], ["c.py::1", "c.py::2", "b.py::1"]]
+
+
+def test_plan_is_deterministic_and_allows_empty_shards():
+    test_ids = ["t::a", "t::b"]
+    assert plan_shards(test_ids, {"t::a": 1.0}, 3) == plan_shards(list(reversed(test_ids)), {"t::a": 1.0}, 3)
+    assert plan_shards(test_ids, {}, 3)[2] == []
+
+
+def test_plugin_runs_each_test_in_exactly_one_shard(tmp_path):
+    (tmp_path / "test_one.py").write_text("def test_a(): pass\ndef test_b(): pass\n")
+    (tmp_path / "test_two.py").write_text("def test_c(): pass\n")
+    env = {**os.environ, "PYTHONPATH": SCRIPTS_DIR, "IM_SHARD_DURATIONS": str(tmp_path / "none.json")}
+
+    ran = []
+    for index in range(4):
+        result = subprocess.run([sys.executable, "-m", "pytest", "-q", "-rA", "-p", "pytest_shard",
+                                 "-p", "no:cacheprovider"],
+                                cwd=tmp_path, env={**env, "IM_SHARD": f"{index}/4"}, capture_output=True, text=True)
+        # The fourth shard gets nothing and still passes
+        assert result.returncode == 0, result.stdout
+        ran += [line.split()[1] for line in result.stdout.splitlines() if line.startswith("PASSED")]
+    assert sorted(ran) == ["test_one.py::test_a", "test_one.py::test_b", "test_two.py::test_c"]
+
+
+def shard_result(run_id, status):
+    return {
+        "run_id": run_id,
+        "status": status,
+        "duration": 1.0,
+        "output": {"stdout": f"{run_id}\n", "stderr": "", "kubectl_errors": []},
+        "artifacts": {"run_id": run_id, "stdout": {"url": f"/artifacts/{run_id}/stdout"}}
+    }
+
+
+def test_merge_lists_every_shards_artifacts():
+    runner = ShardedTestRunner.__new__(ShardedTestRunner)
+    runner.run_id, runner.commit, runner.pods = "0123456789abcdef", "abc", ["pod-0", "pod-1", "pod-2"]
+    run_ids = [runner.shard_run_id(index) for index in range(3)]
+    assert all(RUN_ID.match(run_id) for run_id in run_ids)
+    assert len(set(run_ids)) == 3
+
+    merged = runner._merge([shard_result(run_ids[0], "passed"), shard_result(run_ids[1], "failed"),
+                            shard_result(run_ids[2], "passed")], 2.0)
+    assert merged["status"] == "failed"
+    assert [shard["artifacts"]["run_id"] for shard in merged["shards"]] == run_ids
+    assert merged["output"]["stdout"].count("===== shard") == 3
+
+
+def test_shard_run_ids_stay_within_the_artifact_pattern():
+    runner = ShardedTestRunner.__new__(ShardedTestRunner)
+    runner.run_id = "f" * 64
+    assert RUN_ID.match(runner.shard_run_id(255))
+
+
+class StubShard:
+    """Stands in for a shard's TestRunner; crashes instead of returning when told to"""
+    shard = (0, 2, "")
+    impact = None
+
+    def __init__(self, run_id, status, crash=False):
+        self.result = shard_result(run_id, status)
+        self.crash = crash
+
+    def execute_test_run(self):
+        if self.crash:
+            raise KeyError("selection")
+        return self.result
+
+
+def test_a_crashed_shard_is_an_error_and_keeps_the_others(state_dir):
+    runner = ShardedTestRunner.__new__(ShardedTestRunner)
+    runner.run_id, runner.commit, runner.pods = "0123456789abcdef", "abc", ["pod-0", "pod-1"]
+    runner.repo_url, runner.durations_file = "https://example.com/repo.git", str(state_dir / "durations.json")
+    state_dir.mkdir()
+    runner.shards = [StubShard(runner.shard_run_id(0), "passed"), StubShard(runner.shard_run_id(1), "passed", True)]
+
+    merged = runner.execute_test_run()
+    assert merged["status"] == "error"
+    assert [shard["status"] for shard in merged["shards"]] == ["passed", "error"]
+    assert "shard 1 crashed: KeyError" in merged["output"]["stderr"]
+    assert merged["output"]["stdout"].count("===== shard") == 2
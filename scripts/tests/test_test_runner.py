@@ -0,0 +1,77 @@
+import subprocess
+
+import pytest
+
+from worker import load_test_runner
+
+test_runner = load_test_runner()
+
+
+def git(repo, *args) -> str:
+    return subprocess.run(["git", "-C", str(repo)] + list(args), capture_output=True, text=True,
+                          check=True).stdout.strip()
+
+
+def commit(repo, name, content) -> str:
+    (repo / name).write_text(content)
+    git(repo, "add", name)
+    git(repo, "commit", "-q", "-m", f"{name}: {content}")
+    return git(repo, "rev-parse", "HEAD")
+
+
+@pytest.fixture
+def upstream(tmp_path):
+    repo = tmp_path / "upstream"
+    repo.mkdir()
+    git(repo, "init", "-q", "-b", "main")
+    git(repo, "config", "user.email", "dev@example.com")
+    git(repo, "config", "user.name", "dev")
+    commit(repo, "requirements.txt", "")
+    return repo
+
+
+@pytest.fixture
+def cluster(fake_kube, state_dir, tmp_path, monkeypatch):
+    """A fake cluster with one ready test pod in namespace im-test"""
+    monkeypatch.setenv("ARTIFACT_DIR", str(tmp_path / "artifacts"))
+    monkeypatch.setenv("GIT_MIRROR_DIR", str(tmp_path / "mirrors"))
+    fake_kube.run(["create", "namespace", "im-test"])
+    fake_kube.run(["apply", "-f", "/dev/null"], namespace="im-test")
+    return fake_kube
+
+
+def runner_for(kube, upstream, sha, test_cmd, **kwargs):
+    return test_runner.TestRunner(namespace="im-test", repo_url=str(upstream), commit=sha, test_cmd=test_cmd,
+                                  project_type="fastapi", kube=kube, **kwargs)
+
+
+def test_upstream_fetch_works_on_a_repo_the_mirror_created(cluster, upstream):
+    first = commit(upstream, "a.py", "1")
+    result = runner_for(cluster, upstream, first, "grep -q 1 a.py").execute_test_run()
+    assert result["status"] == "passed", result["output"]
+
+    # The next commit's bundle is over the limit, so the pod fetches upstream
+    second = commit(upstream, "a.py", "2")
+    runner = runner_for(cluster, upstream, second, "grep -q 2 a.py")
+    runner.mirror.max_bundle_bytes = 0
+    result = runner.execute_test_run()
+    assert result["status"] == "passed", result["output"]
+    assert "repo_update" in [step["step"] for step in result["steps"]]
+
+
+def test_stepwise_runner_updates_a_repo_the_mirror_created(cluster, upstream):
+    first = commit(upstream, "a.py", "1")
+    assert runner_for(cluster, upstream, first, "grep -q 1 a.py").execute_test_run()["status"] == "passed"
+
+    second = commit(upstream, "a.py", "2")
+    result = runner_for(cluster, upstream, second, "grep -q 2 a.py", pipeline=False).execute_test_run()
+    assert result["status"] == "passed", result["output"]
+
+
+@pytest.mark.parametrize("pipeline", [True, False])
+def test_test_failures_name_their_step(cluster, upstream, pipeline):
+    sha = commit(upstream, "a.py", "1")
+    result = runner_for(cluster, upstream, sha, "grep -q 2 a.py", pipeline=pipeline).execute_test_run()
+
+    assert result["status"] == "failed"
+    assert [error.get("step") for error in result["output"]["kubectl_errors"]] == ["test_execution"]
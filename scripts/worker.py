@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+import importlib.util
+import json
+import os
+import signal
+import sys
+from typing import Any, Callable, Dict
+
+from git_mirror import GitMirror
+from kube_client import KubeClient
+from namespace_handler import handle_namespace, release_test_pods, scale_test_pods
+from namespace_lifecycle import NamespaceLifecycle
+from pool_manager import PoolManager
+
+
+def load_test_runner():
+    """Import test-runner.py, whose file name is not a valid module name"""
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-runner.py")
+    spec = importlib.util.spec_from_file_location("test_runner", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Worker:
+    """Serves namespace and test requests as JSON lines over stdin/stdout"""
+
+    def __init__(self, kube: KubeClient):
+        self.kube = kube
+        self.pool = PoolManager.from_env(kube)
+        self.lifecycle = NamespaceLifecycle.from_env(kube)
+        self.out = None
+        self.request_id = None
+        self.runner = None  # the test run in progress, for cancel()
+        self.test_runner = load_test_runner()
+        self.actions: Dict[str, Callable[[Dict[str, Any]], Dict[str, Any]]] = {
+            "ping": lambda args: {"status": "ok", "pid": os.getpid()},
+            "namespace": self.namespace,
+            "test": self.test,
+            "scale_pods": lambda args: scale_test_pods(args["namespace"], int(args["replicas"]), kube=self.kube,
+                                                       lease=args.get("lease") or ""),
+            "release_pods": lambda args: release_test_pods(args["namespace"], args["lease"], kube=self.kube),
+            "pool_maintain": self.pool_maintain,
+            "reap": self.reap,
+            "commits_between": self.commits_between,
+        }
+
+    def namespace(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        result, _ = handle_namespace(args["chat_id"], args["user_id"], args["project_type"],
+                                     kube=self.kube, pool=self.pool, lifecycle=self.lifecycle)
+        return result
+
+    def reap(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        if self.lifecycle is None:
+            return {"status": "disabled"}
+        return self.lifecycle.reap()
+
+    def commits_between(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        """List the commits a bisect searches, from the server's git mirror"""
+        mirror = GitMirror.from_env()
+        if mirror is None:
+            raise RuntimeError("bisect needs the git mirror (GIT_MIRROR=0 is set)")
+        commits = mirror.commits_between(args["repo_url"], args["good"], args["bad"])
+        good = mirror.resolve(args["repo_url"], args["good"])
+        return {"good": good, "commits": commits}
+
+    def pool_maintain(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        if self.pool is None:
+            return {"status": "disabled"}
+        return self.pool.maintain()
+
+    def test(self, args: Dict[str, Any]) -> Dict[str, Any]:
+        pods = args.get("pods") or []
+        if len(pods) > 1:
+            runner = self.test_runner.ShardedTestRunner(
+                namespace=args["namespace"],
+                repo_url=args["repo_url"],
+                commit=args["commit"],
+                test_cmd=args.get("test_cmd") or "pytest tests/",
+                project_type=args.get("project_type") or "fastapi",
+                pods=pods,
+                kube=self.kube,
+                on_event=self.emit,
+                run_id=args.get("run_id") or "",
+                incremental=bool(args.get("incremental"))
+            )
+            return self.run(runner)
+        runner = self.test_runner.TestRunner(
+            namespace=args["namespace"],
+            repo_url=args["repo_url"],
+            commit=args["commit"],
+            test_cmd=args.get("test_cmd") or "pytest tests/",
+            project_type=args.get("project_type") or "fastapi",
+            kube=self.kube,
+            on_event=self.emit,
+            pod_name=args.get("pod") or "",
+            pod_ready=bool(args.get("pod_ready")),
+            run_id=args.get("run_id") or "",
+            incremental=bool(args.get("incremental"))
+        )
+        return self.run(runner)
+
+    def run(self, runner) -> Dict[str, Any]:
+        self.runner = runner
+        try:
+            return runner.execute_test_run()
+        finally:
+            self.runner = None
+
+    def cancel(self, signum=None, frame=None):
+        """SIGTERM handler: cancel the test run in progress, if any
+
+        The run still answers its request (with status "cancelled"), so the
+        worker stays usable. A signal arriving between requests is ignored.
+        """
+        if self.runner is not None:
+            self.runner.cancel()
+
+    def emit(self, event: Dict[str, Any]):
+        """Stream a progress event for the request being served"""
+        self.write({"id": self.request_id, "event": event})
+
+    def write(self, message: Dict[str, Any]):
+        self.out.write(json.dumps(message) + "\n")
+        self.out.flush()
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Dispatch one request and wrap its result or error"""
+        self.request_id = request.get("id")
+        response: Dict[str, Any] = {"id": self.request_id}
+        action = self.actions.get(request.get("action", ""))
+        if action is None:
+            response["error"] = f"unknown action: {request.get('action')}"
+            return response
+        try:
+            response["result"] = action(request.get("args") or {})
+        except Exception as e:
+            response["error"] = f"{type(e).__name__}: {e}"
+        return response
+
+    def serve(self, stdin, stdout):
+        self.out = stdout
+        for line in stdin:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError as e:
+                response = {"id": None, "error": f"invalid request: {e}"}
+            else:
+                response = self.handle(request)
+            self.write(response)
+
+
+def main():
+    # Keep stdout reserved for the protocol; stray prints go to stderr
+    protocol_out = sys.stdout
+    sys.stdout = sys.stderr
+
+    kube = KubeClient()
+    # One-shot workers serve a single request, where a proxy costs more than it saves
+    if "--no-proxy" not in sys.argv[1:] and not kube.start_proxy():
+        sys.stderr.write("kubectl proxy unavailable, falling back to kubectl per call\n")
+
+    try:
+        worker = Worker(kube)
+        signal.signal(signal.SIGTERM, worker.cancel)
+        worker.serve(sys.stdin, protocol_out)
+    finally:
+        kube.close()
+
+if __name__ == '__main__':
+    main()